@@ -0,0 +1,105 @@
+"""Maintenance commands, run next to the API with the same environment:
+
+python -m app.cli backfill-rollup
+python -m app.cli maintain-partitions
+python -m app.cli export-waste --format parquet --output waste.parquet [--team-id 1] [--from ...] [--to ...]
+python -m app.cli detect-anomalies --output anomalies.json [--team-id 1] [--from ...] [--to ...]
+python -m app.cli cache-report
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+
+from app.services import waste_analytics_service, waste_export_service, waste_service
+from app.utils import cache, columnar, db, partitions
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def backfill_rollup(_: argparse.Namespace) -> None:
+    pool = await db.connect()
+    try:
+        await db.initdb(pool)
+        rows = await waste_service.backfill_daily_rollup()
+        logger.info(f"Backfilled {rows} daily rollup rows")
+    finally:
+        await db.disconnect()
+
+
+async def maintain_partitions(_: argparse.Namespace) -> None:
+    # meant to run from a monthly cron job; startup only covers the months ahead at the time it ran
+    pool = await db.connect()
+    try:
+        async with pool.acquire() as conn:
+            result = await partitions.maintain_partitions(conn)
+        logger.info(f"Created partitions {result['created']}, detached partitions {result['detached']}")
+    finally:
+        await db.disconnect()
+
+
+async def export_waste(args: argparse.Namespace) -> None:
+    filters = waste_service.build_waste_filter(args.start, args.end)
+    await db.connect()
+    try:
+        await waste_export_service.write_columnar_file(args.output, args.format, args.team_id, filters)
+    finally:
+        await db.disconnect()
+
+
+async def detect_anomalies(args: argparse.Namespace) -> None:
+    filters = waste_service.build_waste_filter(args.start, args.end)
+    await db.connect()
+    try:
+        report = await waste_analytics_service.detect_anomalies(
+            team_id=args.team_id,
+            start=filters.start.date() if filters and filters.start else None,
+            end=filters.end.date() if filters and filters.end else None,
+            window=args.window,
+            threshold=args.threshold,
+        )
+    finally:
+        await db.disconnect()
+    with open(args.output, "w") as output:
+        json.dump(report, output)
+    logger.info(f"Wrote {len(report['outliers'])} anomalies for {len(report['users'])} users to {args.output}")
+
+
+async def cache_report(_: argparse.Namespace) -> None:
+    report = await cache.memory_report()
+    print(json.dumps(report, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="TearWaste maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("backfill-rollup").set_defaults(run=backfill_rollup)
+    commands.add_parser("maintain-partitions").set_defaults(run=maintain_partitions)
+
+    export = commands.add_parser("export-waste")
+    export.add_argument("--format", choices=columnar.COLUMNAR_FORMATS, default="parquet")
+    export.add_argument("--output", required=True)
+    export.add_argument("--team-id", type=int)
+    export.add_argument("--from", dest="start")
+    export.add_argument("--to", dest="end")
+    export.set_defaults(run=export_waste)
+
+    anomalies = commands.add_parser("detect-anomalies")
+    anomalies.add_argument("--output", required=True)
+    anomalies.add_argument("--team-id", type=int)
+    anomalies.add_argument("--from", dest="start")
+    anomalies.add_argument("--to", dest="end")
+    anomalies.add_argument("--window", type=int, default=waste_analytics_service.ANOMALY_WINDOW_DAYS)
+    anomalies.add_argument("--threshold", type=float, default=waste_analytics_service.ANOMALY_Z_THRESHOLD)
+    anomalies.set_defaults(run=detect_anomalies)
+
+    commands.add_parser("cache-report").set_defaults(run=cache_report)
+
+    args = parser.parse_args()
+    asyncio.run(args.run(args))
+
+
+if __name__ == "__main__":
+    main()
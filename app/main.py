@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import uuid
 from contextlib import asynccontextmanager
@@ -9,10 +10,13 @@ from app.routes.authentication_routes import authentication_router
 from app.routes.team_routes import team_router
 from app.routes.user_routes import user_router
 from app.routes.waste_routes import waste_router
+from app.services import warmup_service, waste_service
 from app.services.authentication_service import AuthenticationError
 from app.services.authorization_service import AuthorizationError
-from app.utils import db
+from app.utils import cache, db
+from app.utils.columnar import MissingDependencyError
 from app.utils.db import DatabaseError
+from app.utils.idempotency import IdempotencyError
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,7 +30,17 @@ logger.addHandler(console_handler)
 async def lifespan(_: FastAPI):
     pool = await db.connect()
     await db.initdb(pool)
+    await cache.start_local_cache()
+    # the server answers liveness probes while warming up, and readiness probes once it is done
+    warmup = asyncio.create_task(warmup_service.warm_up())
+    purger = asyncio.create_task(cache.purge_expired_periodically())
     yield
+    warmup_service.set_ready(False)
+    warmup.cancel()
+    purger.cancel()
+    await waste_service.drain_write_coalescer()
+    await cache.stop_local_cache()
+    await cache.breaker.stop()
     await db.disconnect()
 
 
@@ -80,7 +94,47 @@ async def database_error_exception_handler(_: Request, exc: DatabaseError):
     raise HTTPException(status_code=400, detail=str(exc))
 
 
+@app.exception_handler(IdempotencyError)
+async def idempotency_error_exception_handler(_: Request, exc: IdempotencyError):
+    logger.error(f"IdempotencyError occurred: {str(exc)}")
+    raise HTTPException(status_code=409, detail=str(exc))
+
+
+@app.exception_handler(MissingDependencyError)
+async def missing_dependency_exception_handler(_: Request, exc: MissingDependencyError):
+    logger.error(f"MissingDependencyError occurred: {str(exc)}")
+    raise HTTPException(status_code=501, detail=str(exc))
+
+
+@app.exception_handler(cache.CacheUnavailableError)
+async def cache_unavailable_exception_handler(_: Request, exc: cache.CacheUnavailableError):
+    logger.error(f"CacheUnavailableError occurred: {str(exc)}")
+    raise HTTPException(status_code=503, detail=str(exc))
+
+
 @app.get("/")
 async def root():
     logger.info("Root endpoint accessed.")
     return {"message": "Hello World"}
+
+
+@app.get("/healthz/live")
+async def liveness():
+    return {"status": "live"}
+
+
+@app.get("/healthz/ready")
+async def readiness():
+    if not warmup_service.is_ready():
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"status": "ready"}
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "write_coalescer": waste_service.get_write_coalescer_stats(),
+        "local_cache": cache.local_cache.stats(),
+        "cache": cache.metrics.stats(),
+        "cache_breaker": cache.breaker_stats(),
+    }
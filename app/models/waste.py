@@ -1,7 +1,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
+
+
+def utc_now() -> datetime:
+    """The current time as naive UTC, the form waste timestamps are stored in."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 @dataclass
@@ -12,13 +17,16 @@ class WasteEntry:
         weight: float,
         user_id: int,
         id: int | None = None,
-        timestamp: datetime = datetime.now(),
+        timestamp: datetime | None = None,
+        team_id: int | None = None,
     ):
         self.id = id
         self.type = type
         self.weight = weight
-        self.timestamp = timestamp
+        self.timestamp = timestamp if timestamp is not None else utc_now()
         self.user_id = user_id
+        # team of the user when the entry was written, set by writes to find the team aggregates to invalidate
+        self.team_id = team_id
 
     def to_dict(self) -> dict:
         """Convert the WasteEntry instance to a dictionary."""
@@ -43,3 +51,47 @@ class WasteEntry:
             timestamp=timestamp,  # Convert ISO format string to datetime
             user_id=data["user_id"],
         )
+
+
+@dataclass(frozen=True)
+class WasteFilter:
+    """Optional restrictions on waste reads: `start` is inclusive, `end` exclusive."""
+
+    start: datetime | None = None
+    end: datetime | None = None
+    type: str | None = None
+
+    def cache_key(self) -> str:
+        """Stable representation of the filter, used to cache filtered reads separately."""
+        start = self.start.isoformat() if self.start else ""
+        end = self.end.isoformat() if self.end else ""
+        return f"{start},{end},{self.type or ''}"
+
+
+@dataclass
+class WasteTotal:
+    def __init__(self, type: str, bucket: datetime, total_weight: float, entry_count: int):
+        self.type = type
+        self.bucket = bucket
+        self.total_weight = total_weight
+        self.entry_count = entry_count
+
+    def to_dict(self) -> dict:
+        """Convert the WasteTotal instance to a dictionary."""
+        return {
+            "type": self.type,
+            "bucket": self.bucket.isoformat(),
+            "total_weight": self.total_weight,
+            "entry_count": self.entry_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> WasteTotal:
+        """Create a WasteTotal instance from a dictionary."""
+        bucket = datetime.fromisoformat(data["bucket"]) if isinstance(data["bucket"], str) else data["bucket"]
+        return cls(
+            type=data["type"],
+            bucket=bucket,
+            total_weight=data["total_weight"],
+            entry_count=data["entry_count"],
+        )
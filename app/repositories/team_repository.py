@@ -1,10 +1,27 @@
 from abc import abstractmethod
-from typing import Optional
+from functools import partial
+from typing import Dict, Optional
 
 from app.models.teams import Team
 from app.repositories import Repository
 from app.utils import cache
-from app.utils.db import fetchrow
+from app.utils.db import fetchrow, hot_query
+
+READ_TEAM = hot_query(
+    """
+SELECT *
+FROM teams
+WHERE id = $1
+"""
+)
+
+READ_ALL_TEAMS = hot_query(
+    """
+SELECT *
+FROM teams
+ORDER BY id
+"""
+)
 
 
 class AbstractTeamRepository(Repository):
@@ -37,22 +54,13 @@ class TeamRepository(AbstractTeamRepository):
         return team
 
     async def read(self, team_id: int) -> Optional[Team]:
-        query = """
-        SELECT *
-        FROM teams
-        WHERE id = $1
-        """
-        row = await fetchrow(self.conn, query, team_id)
+        row = await fetchrow(self.conn, READ_TEAM, team_id)
         if row:
             return Team.from_dict(row)
         return None
 
     async def read_all(self) -> list[Team]:
-        query = """
-        SELECT *
-        FROM teams
-        """
-        rows = await self.conn.fetch(query)
+        rows = await self.conn.fetch(READ_ALL_TEAMS)
         return [Team.from_dict(row) for row in rows]
 
 
@@ -60,28 +68,44 @@ class CacheTeamRepository(TeamRepository):
 
     async def create(self, team: Team) -> Team:
         result = await super().create(team)
-        await cache.set_value(f"team:{result.id}", result.to_dict())
-        await cache.delete_key("all_teams")
+        async with cache.pipeline() as writes:
+            if cache.policy_for("team:").write_on_create:
+                writes.set_value(f"team:{result.id}", result.to_dict())
+            else:
+                writes.delete(f"team:{result.id}")
+            writes.update_field_if_cached("all_teams", str(result.id), result.to_dict())
         return result
 
     async def read(self, team_id: int) -> Optional[Team]:
         cache_key = f"team:{team_id}"
         cached_data = await cache.get_value(cache_key)
-        if cached_data is not None:
-            return Team.from_dict(cached_data)
-        else:
-            result = await super().read(team_id)
-            if result:
-                await cache.set_value(cache_key, result.to_dict())
-            return result
+        if cached_data is None:
+            cached_data = await cache.single_flight(
+                cache_key, partial(self._load_team, team_id), partial(cache.get_value, cache_key)
+            )
+        # an empty value is a cached "not found"
+        return Team.from_dict(cached_data) if cached_data else None
+
+    async def _load_team(self, team_id: int) -> Optional[dict]:
+        result = await super().read(team_id)
+        if result is None:
+            await cache.set_missing(f"team:{team_id}")
+            return None
+        await cache.set_value(f"team:{team_id}", result.to_dict())
+        return result.to_dict()
 
     async def read_all(self) -> list[Team]:
-        # Attempt to retrieve all teams from cache
-        cached_teams = await cache.get_value("all_teams")
-        if cached_teams is not None:
-            return [Team.from_dict(team) for team in cached_teams]
+        # Attempt to retrieve all teams from cache, a hash of teams by id
+        cached_teams = await cache.get_fields("all_teams")
+        if cached_teams is None:
+            cached_teams = await cache.single_flight(
+                "all_teams", self._load_all_teams, partial(cache.get_fields, "all_teams")
+            )
+        return [Team.from_dict(team) for _, team in sorted(cached_teams.items(), key=lambda item: int(item[0]))]
 
+    async def _load_all_teams(self) -> Dict[str, dict]:
         # If not in cache, retrieve from database and cache the result
-        teams = await super().read_all()
-        await cache.set_value("all_teams", [team.to_dict() for team in teams])
+        teams = {str(team.id): team.to_dict() for team in await super().read_all()}
+        if teams:
+            await cache.set_fields("all_teams", teams)
         return teams
@@ -1,11 +1,37 @@
 from abc import abstractmethod
-from typing import List, Optional
+from functools import partial
+from typing import Dict, List, Optional
 
 from app.models.users import User
 from app.repositories import Repository
 from app.utils import cache
 from app.utils.cache import set_value
-from app.utils.db import execute, fetch, fetchrow
+from app.utils.db import execute, fetch, fetchrow, hot_query
+
+READ_USER = hot_query(
+    """
+SELECT *
+FROM users
+WHERE id = $1
+"""
+)
+
+READ_USERS_BY_TEAM_ID = hot_query(
+    """
+SELECT *
+FROM users
+WHERE team_id = $1
+ORDER BY id
+"""
+)
+
+READ_USER_BY_USERNAME = hot_query(
+    """
+SELECT *
+FROM users
+WHERE username = $1
+"""
+)
 
 
 class AbstractUserRepository(Repository):
@@ -51,12 +77,7 @@ class UserRepository(AbstractUserRepository):
         return user
 
     async def read(self, user_id: int) -> Optional[User]:
-        query = """
-        SELECT *
-        FROM users
-        WHERE id = $1
-        """
-        row = await fetchrow(self.conn, query, user_id)
+        row = await fetchrow(self.conn, READ_USER, user_id)
         if row:
             return User.from_dict(row)
         return None
@@ -69,22 +90,12 @@ class UserRepository(AbstractUserRepository):
         await execute(self.conn, query, user_id)
 
     async def get_users_by_team_id(self, team_id: int) -> List[User]:
-        query = """
-        SELECT *
-        FROM users
-        WHERE team_id = $1
-        """
-        rows = await fetch(self.conn, query, team_id)
+        rows = await fetch(self.conn, READ_USERS_BY_TEAM_ID, team_id)
         users = [User.from_dict(row) for row in rows]
         return users
 
     async def get_user_by_username(self, username: str) -> Optional[User]:
-        query = """
-        SELECT *
-        FROM users
-        WHERE username = $1
-        """
-        row = await fetchrow(self.conn, query, username)
+        row = await fetchrow(self.conn, READ_USER_BY_USERNAME, username)
         if row:
             return User.from_dict(row)
         return None
@@ -93,46 +104,81 @@ class UserRepository(AbstractUserRepository):
 class CacheUserRepository(UserRepository):
     async def create(self, user: User) -> User:
         result = await super().create(user)
-        await set_value(f"user:{result.id}", result.to_dict())
-        await cache.delete_key(f"users_by_team_id:{result.team_id}")
+        async with cache.pipeline() as writes:
+            if cache.policy_for("user:").write_on_create:
+                writes.set_value(f"user:{result.id}", result.to_dict())
+            else:
+                writes.delete(f"user:{result.id}")
+            # overwrites the "not found" a lookup of the username before it was taken may have cached; a lookup still
+            # running only caches one if the key is missing, so it cannot hide the new user either
+            writes.set_value(f"user_by_username:{result.username}", result.to_dict())
+            writes.update_field_if_cached(f"users_by_team_id:{result.team_id}", str(result.id), result.to_dict())
+            # the team summary lists every member, including those without entries
+            writes.delete(f"waste_summary_by_team_id:{result.team_id}")
         return result
 
     async def read(self, user_id: int) -> Optional[User]:
         cache_key = f"user:{user_id}"
         cached_data = await cache.get_value(cache_key)
-        if cached_data is not None:
-            return User.from_dict(cached_data)
-        else:
-            result = await super().read(user_id)
-            if result:
-                await set_value(cache_key, result.to_dict())
-            return result
+        if cached_data is None:
+            cached_data = await cache.single_flight(
+                cache_key, partial(self._load_user, user_id), partial(cache.get_value, cache_key)
+            )
+        # an empty value is a cached "not found"
+        return User.from_dict(cached_data) if cached_data else None
+
+    async def _load_user(self, user_id: int) -> Optional[dict]:
+        result = await super().read(user_id)
+        if result is None:
+            await cache.set_missing(f"user:{user_id}")
+            return None
+        await set_value(f"user:{user_id}", result.to_dict())
+        return result.to_dict()
 
     async def delete(self, user_id: int) -> None:
         user = await self.read(user_id)
-        await super().delete(user.id)
-        await cache.delete_key(f"user:{user.id}")
-        await cache.delete_key(f"users_by_team_id:{user.team_id}")
-        await cache.delete_key(f"users_by_username:{user.username}")
+        await super().delete(user_id)
+        if user is None:
+            return
+        async with cache.pipeline() as writes:
+            # team totals only count current members
+            writes.delete(
+                f"user:{user_id}",
+                f"user_by_username:{user.username}",
+                f"waste_summary_by_team_id:{user.team_id}",
+                f"waste_aggregate_by_team_id:{user.team_id}",
+            )
+            writes.delete_field(f"users_by_team_id:{user.team_id}", str(user_id))
 
     async def get_users_by_team_id(self, team_id: int) -> List[User]:
+        # a hash of the members by id, so joining or leaving users update it in place
         cache_key = f"users_by_team_id:{team_id}"
-        cached_data = await cache.get_value(cache_key)
-        if cached_data is not None:
-            return [User.from_dict(data) for data in cached_data]
-        else:
-            results = await super().get_users_by_team_id(team_id)
-            if results:
-                await set_value(cache_key, [result.to_dict() for result in results])
-            return results
+        cached_data = await cache.get_fields(cache_key)
+        if cached_data is None:
+            cached_data = await cache.single_flight(
+                cache_key, partial(self._load_users_by_team_id, team_id), partial(cache.get_fields, cache_key)
+            )
+        return [User.from_dict(data) for _, data in sorted(cached_data.items(), key=lambda item: int(item[0]))]
+
+    async def _load_users_by_team_id(self, team_id: int) -> Dict[str, dict]:
+        results = {str(result.id): result.to_dict() for result in await super().get_users_by_team_id(team_id)}
+        if results:
+            await cache.set_fields(f"users_by_team_id:{team_id}", results)
+        return results
 
     async def get_user_by_username(self, username: str) -> Optional[User]:
         cache_key = f"user_by_username:{username}"
         cached_data = await cache.get_value(cache_key)
-        if cached_data is not None:
-            return User.from_dict(cached_data)
-        else:
-            result = await super().get_user_by_username(username)
-            if result:
-                await set_value(cache_key, result.to_dict())
-            return result
+        if cached_data is None:
+            cached_data = await cache.single_flight(
+                cache_key, partial(self._load_user_by_username, username), partial(cache.get_value, cache_key)
+            )
+        return User.from_dict(cached_data) if cached_data else None
+
+    async def _load_user_by_username(self, username: str) -> Optional[dict]:
+        result = await super().get_user_by_username(username)
+        if result is None:
+            await cache.set_missing(f"user_by_username:{username}")
+            return None
+        await set_value(f"user_by_username:{username}", result.to_dict())
+        return result.to_dict()
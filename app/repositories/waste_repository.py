@@ -1,10 +1,116 @@
 from abc import abstractmethod
-from typing import List, Optional
+from datetime import date, datetime, time, timedelta
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Union
 
-from app.models.waste import WasteEntry
+from app.models.waste import WasteEntry, WasteFilter, WasteTotal
 from app.repositories import Repository
 from app.utils import cache
-from app.utils.db import execute, fetch, fetchrow
+from app.utils.db import FILL_DAILY_ROLLUP, copy_records_to_table, execute, fetch, fetchrow, hot_query
+from app.utils.waste_types import registry
+
+# Adds the rows of `{added}` to the daily rollup; runs as part of the statement that writes them
+ADD_TO_DAILY_ROLLUP = """
+INSERT INTO waste_daily_rollup (user_id, type_id, day, total_weight, entry_count)
+SELECT added.user_id, added.type_id, added.timestamp::date, sum(added.weight), count(*)
+FROM {added} AS added
+GROUP BY added.user_id, added.type_id, added.timestamp::date
+ON CONFLICT (user_id, type_id, day) DO UPDATE
+SET total_weight = waste_daily_rollup.total_weight + excluded.total_weight,
+    entry_count = waste_daily_rollup.entry_count + excluded.entry_count
+"""
+
+# Creates the types named in `{names}` that are not in waste_types yet. Only names missing from the in-process
+# registry are passed, so known types never touch the table on the insert path.
+CREATE_WASTE_TYPES = """
+INSERT INTO waste_types (name)
+SELECT DISTINCT unnest({names}::varchar[])
+ON CONFLICT (name) DO UPDATE SET name = excluded.name
+RETURNING id, name
+"""
+
+# $5 is the type id when the registry knows the type; otherwise the type is created by the same statement
+INSERT_WASTE_ENTRY = hot_query(
+    f"""
+WITH new_types AS (
+    {CREATE_WASTE_TYPES.format(names="array_remove(ARRAY[CASE WHEN $5::smallint IS NULL THEN $1 END], NULL)")}
+), inserted AS (
+    INSERT INTO waste_entries (type_id, weight, timestamp, user_id)
+    SELECT coalesce($5::smallint, (SELECT id FROM new_types)), $2, $3, $4
+    RETURNING *
+), rollup AS (
+    {ADD_TO_DAILY_ROLLUP.format(added="inserted")}
+)
+SELECT inserted.id, inserted.type_id, users.team_id
+FROM inserted
+LEFT JOIN users ON users.id = inserted.user_id
+"""
+)
+
+# Ids are drawn per row next to the row's position, so mapping them back does not rely on insert order.
+# $5 holds the type id of each entry, or NULL when the registry does not know the type yet
+_UNKNOWN_TYPE_NAMES = "array(SELECT type FROM unnest($1::varchar[], $5::smallint[]) AS t (type, id) WHERE id IS NULL)"
+INSERT_WASTE_ENTRIES = hot_query(
+    f"""
+WITH new_types AS (
+    {CREATE_WASTE_TYPES.format(names=_UNKNOWN_TYPE_NAMES)}
+), entries AS (
+    SELECT nextval(pg_get_serial_sequence('waste_entries', 'id')) AS id,
+           coalesce(entries.known_type_id, new_types.id) AS type_id,
+           entries.*
+    FROM unnest($1::varchar[], $2::double precision[], $3::timestamp[], $4::integer[], $5::smallint[])
+        WITH ORDINALITY AS entries (type, weight, timestamp, user_id, known_type_id, position)
+    LEFT JOIN new_types ON new_types.name = entries.type AND entries.known_type_id IS NULL
+), inserted AS (
+    INSERT INTO waste_entries (id, type_id, weight, timestamp, user_id)
+    SELECT id, type_id, weight, timestamp, user_id
+    FROM entries
+    RETURNING *
+), rollup AS (
+    {ADD_TO_DAILY_ROLLUP.format(added="inserted")}
+)
+SELECT entries.position, entries.id, entries.type_id, users.team_id
+FROM entries
+JOIN inserted ON inserted.id = entries.id
+LEFT JOIN users ON users.id = entries.user_id
+"""
+)
+
+READ_WASTE_ENTRY = hot_query(
+    """
+SELECT *
+FROM waste_entries
+WHERE id = $1
+"""
+)
+
+# the unfiltered first page is the one prepared at startup
+WASTE_PAGE_BY_USER_ID = """
+SELECT *
+FROM waste_entries
+WHERE user_id = $1{conditions}
+ORDER BY timestamp DESC, id DESC
+LIMIT $2
+"""
+hot_query(WASTE_PAGE_BY_USER_ID.format(conditions=""))
+
+# Buckets the daily rollup can answer; hourly series still come from the raw entries
+ROLLUP_BUCKETS = ("day", "week", "month")
+# The current members of team $1. Entries are kept by user rather than by the team at the time of writing, so team
+# totals follow users who change team and leave out deleted users, from the raw entries and the rollup alike.
+TEAM_MEMBERS = "IN (SELECT id FROM users WHERE team_id = $1)"
+
+EPOCH = datetime(1970, 1, 1)
+# newest entries of a user kept in the cached history; pages past them are read from the database
+CACHED_HISTORY_SIZE = 1000
+# entries read per round trip when a filtered page is served from the cached history
+CACHED_PAGE_CHUNK_SIZE = 200
+
+
+class MissingUsersError(ValueError):
+    def __init__(self, user_ids: Set[int]):
+        self.user_ids = user_ids
+        super().__init__(f"Users {sorted(user_ids)} do not exist")
 
 
 class AbstractWasteRepository(Repository):
@@ -13,6 +119,20 @@ class AbstractWasteRepository(Repository):
     async def create(self, waste_entry: WasteEntry) -> WasteEntry:
         raise NotImplementedError
 
+    @abstractmethod
+    async def create_many(self, waste_entries: List[WasteEntry]) -> List[WasteEntry]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert_many(self, waste_entries: List[WasteEntry]) -> List[WasteEntry]:
+        """Insert the entries and nothing else, so a failed insert can be retried; see `write_user_waste`."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def write_user_waste(self, waste_entries: List[WasteEntry]) -> None:
+        """Bring what is cached up to date with entries `insert_many` has committed."""
+        raise NotImplementedError
+
     @abstractmethod
     async def read(self, entry_id: int) -> Optional[WasteEntry]:
         raise NotImplementedError
@@ -22,92 +142,639 @@ class AbstractWasteRepository(Repository):
         raise NotImplementedError
 
     @abstractmethod
-    async def get_waste_by_user_id(self, user_id: int) -> List[WasteEntry]:
+    async def get_waste_by_user_id(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        filters: Optional[WasteFilter] = None,
+    ) -> List[WasteEntry]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iterate_waste_by_user_id(
+        self, user_id: int, batch_size: int, filters: Optional[WasteFilter] = None
+    ) -> AsyncIterator[List[dict]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iterate_waste_columns(
+        self, batch_size: int, team_id: Optional[int] = None, filters: Optional[WasteFilter] = None
+    ) -> AsyncIterator[Dict[str, list]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def aggregate_waste_by_user_id(
+        self, user_id: int, bucket: str, filters: Optional[WasteFilter] = None
+    ) -> List[WasteTotal]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def aggregate_waste_by_team_id(
+        self, team_id: int, bucket: str, filters: Optional[WasteFilter] = None
+    ) -> List[WasteTotal]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_daily_totals(
+        self, start: date, end: date, team_id: Optional[int] = None, user_id: Optional[int] = None
+    ) -> Dict[str, list]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_team_waste_summary(self, team_id: int, filters: Optional[WasteFilter] = None) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def rebuild_daily_rollup(self) -> int:
         raise NotImplementedError
 
 
 class WasteRepository(AbstractWasteRepository):
     async def create(self, waste_entry: WasteEntry) -> WasteEntry:
-        query = """
-        INSERT INTO waste_entries (type, weight, timestamp, user_id)
-        VALUES ($1, $2, $3, $4)
-        RETURNING id
-        """
+        registry.check_new_types([waste_entry.type])
         row = await fetchrow(
             self.conn,
-            query,
+            INSERT_WASTE_ENTRY,
             waste_entry.type,
             waste_entry.weight,
             waste_entry.timestamp,
             waste_entry.user_id,
+            registry.get_id(waste_entry.type),
         )
+        registry.register(row["type_id"], waste_entry.type)
         waste_entry.id = row["id"]
+        waste_entry.team_id = row["team_id"]
         return waste_entry
 
-    async def read(self, entry_id: int) -> Optional[WasteEntry]:
-        query = """
-        SELECT *
-        FROM waste_entries
-        WHERE id = $1
+    async def create_many(self, waste_entries: List[WasteEntry]) -> List[WasteEntry]:
+        if not waste_entries:
+            return waste_entries
+
+        # COPY cannot return generated keys, so validate the users, look up their teams, create unknown types and
+        # reserve the ids in one round trip
+        query = f"""
+        WITH missing AS (
+            SELECT array(SELECT unnest($1::integer[]) EXCEPT SELECT id FROM users) AS user_ids
+        ), new_types AS (
+            {CREATE_WASTE_TYPES.format(names="$3")}
+        )
+        SELECT missing.user_ids AS missing_user_ids,
+               array(
+                   SELECT nextval(pg_get_serial_sequence('waste_entries', 'id'))
+                   FROM generate_series(1, $2)
+                   WHERE cardinality(missing.user_ids) = 0
+               ) AS ids,
+               array(SELECT row(id, name) FROM new_types) AS new_types,
+               array(SELECT row(id, team_id) FROM users WHERE id = ANY($1::integer[])) AS teams
+        FROM missing
         """
-        row = await fetchrow(self.conn, query, entry_id)
+        user_ids = list({entry.user_id for entry in waste_entries})
+        new_type_names = list({entry.type for entry in waste_entries if registry.get_id(entry.type) is None})
+        registry.check_new_types(new_type_names)
+        row = await fetchrow(self.conn, query, user_ids, len(waste_entries), new_type_names)
+        for type_id, name in row["new_types"]:
+            registry.register(type_id, name)
+        if row["missing_user_ids"]:
+            raise MissingUsersError(set(row["missing_user_ids"]))
+
+        teams = dict(row["teams"])
+        for waste_entry, entry_id in zip(waste_entries, row["ids"]):
+            waste_entry.id = entry_id
+            waste_entry.team_id = teams[waste_entry.user_id]
+        type_ids = [registry.get_id(entry.type) for entry in waste_entries]
+        records = [
+            (entry.id, type_id, entry.weight, entry.timestamp, entry.user_id)
+            for entry, type_id in zip(waste_entries, type_ids)
+        ]
+        # COPY cannot feed a CTE, so the rollup is updated by a second statement in the same transaction
+        rollup_query = ADD_TO_DAILY_ROLLUP.format(
+            added="""(
+                SELECT *
+                FROM unnest($1::smallint[], $2::double precision[], $3::timestamp[], $4::integer[])
+                    AS entries (type_id, weight, timestamp, user_id)
+            )"""
+        )
+        async with self.conn.transaction():
+            await copy_records_to_table(
+                self.conn, "waste_entries", records=records, columns=["id", "type_id", "weight", "timestamp", "user_id"]
+            )
+            await execute(
+                self.conn,
+                rollup_query,
+                type_ids,
+                [entry.weight for entry in waste_entries],
+                [entry.timestamp for entry in waste_entries],
+                [entry.user_id for entry in waste_entries],
+            )
+        return waste_entries
+
+    async def insert_many(self, waste_entries: List[WasteEntry]) -> List[WasteEntry]:
+        # A single multi-row INSERT, cheaper than COPY for the small batches built by the write coalescer
+        registry.check_new_types(entry.type for entry in waste_entries)
+        rows = await fetch(
+            self.conn,
+            INSERT_WASTE_ENTRIES,
+            [entry.type for entry in waste_entries],
+            [entry.weight for entry in waste_entries],
+            [entry.timestamp for entry in waste_entries],
+            [entry.user_id for entry in waste_entries],
+            [registry.get_id(entry.type) for entry in waste_entries],
+        )
+        for row in rows:
+            waste_entry = waste_entries[row["position"] - 1]
+            waste_entry.id = row["id"]
+            waste_entry.team_id = row["team_id"]
+            registry.register(row["type_id"], waste_entry.type)
+        return waste_entries
+
+    async def write_user_waste(self, waste_entries: List[WasteEntry]) -> None:
+        pass
+
+    async def read(self, entry_id: int) -> Optional[WasteEntry]:
+        row = await fetchrow(self.conn, READ_WASTE_ENTRY, entry_id)
         if row:
-            return WasteEntry.from_dict(row)
+            (waste_entry,) = await self._rows_to_entries([row])
+            return waste_entry
         return None
 
     async def delete(self, entry_id: int) -> None:
+        await self._delete(entry_id)
+
+    async def _delete(self, entry_id: int) -> Optional[WasteEntry]:
+        """Delete the entry and return what it was, with the team of its user, or None if there was none."""
+        # Emptied rollup rows are kept with entry_count = 0 and skipped by the aggregate reads
         query = """
-        DELETE FROM waste_entries
-        WHERE id = $1
+        WITH deleted AS (
+            DELETE FROM waste_entries
+            WHERE id = $1
+            RETURNING *
+        ), rollup AS (
+            UPDATE waste_daily_rollup
+            SET total_weight = waste_daily_rollup.total_weight - deleted.weight,
+                entry_count = waste_daily_rollup.entry_count - 1
+            FROM deleted
+            WHERE waste_daily_rollup.user_id = deleted.user_id
+              AND waste_daily_rollup.type_id = deleted.type_id
+              AND waste_daily_rollup.day = deleted.timestamp::date
+        )
+        SELECT deleted.*, users.team_id
+        FROM deleted
+        LEFT JOIN users ON users.id = deleted.user_id
         """
-        await execute(self.conn, query, entry_id)
+        row = await fetchrow(self.conn, query, entry_id)
+        if row is None:
+            return None
+        (waste_entry,) = await self._rows_to_entries([row])
+        waste_entry.team_id = row["team_id"]
+        return waste_entry
 
-    async def get_waste_by_user_id(self, user_id: int) -> List[WasteEntry]:
-        query = """
-        SELECT *
+    async def get_waste_by_user_id(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        filters: Optional[WasteFilter] = None,
+    ) -> List[WasteEntry]:
+        # Newest first; `after` is the (timestamp, id) of the last entry of the previous page
+        args: list = [user_id, limit]
+        conditions = await self._filter_conditions(filters, args)
+        if after is not None:
+            args.extend(after)
+            conditions += f" AND (timestamp, id) < (${len(args) - 1}, ${len(args)})"
+        rows = await fetch(self.conn, WASTE_PAGE_BY_USER_ID.format(conditions=conditions), *args)
+        waste_entries = await self._rows_to_entries(rows)
+        return waste_entries
+
+    async def iterate_waste_by_user_id(
+        self, user_id: int, batch_size: int, filters: Optional[WasteFilter] = None
+    ) -> AsyncIterator[List[dict]]:
+        # Server-side cursors only live inside a transaction; rows are pulled batch_size at a time
+        args: list = [user_id]
+        conditions = await self._filter_conditions(filters, args)
+        query = f"""
+        SELECT id, type_id, weight, timestamp, user_id
         FROM waste_entries
-        WHERE user_id = $1
+        WHERE user_id = $1{conditions}
+        ORDER BY timestamp, id
         """
-        rows = await fetch(self.conn, query, user_id)
-        waste_entries = self._rows_to_entries(rows)
-        return waste_entries
+        async with self.conn.transaction(readonly=True):
+            cursor = await self.conn.cursor(query, *args)
+            while rows := await cursor.fetch(batch_size):
+                names = await registry.resolve_names(self.conn, {row["type_id"] for row in rows})
+                yield [dict(row, type=names[row["type_id"]]) for row in rows]
+
+    async def iterate_waste_columns(
+        self, batch_size: int, team_id: Optional[int] = None, filters: Optional[WasteFilter] = None
+    ) -> AsyncIterator[Dict[str, list]]:
+        """Yield entries batch_size at a time as one list per column, for columnar exports."""
+        args: list = []
+        conditions = "true"
+        if team_id is not None:
+            args.append(team_id)
+            conditions += " AND user_id IN (SELECT id FROM users WHERE team_id = $1)"
+        conditions += await self._filter_conditions(filters, args)
+        query = f"""
+        SELECT id, type_id, weight, timestamp, user_id
+        FROM waste_entries
+        WHERE {conditions}
+        ORDER BY timestamp, id
+        """
+        async with self.conn.transaction(readonly=True):
+            cursor = await self.conn.cursor(query, *args)
+            while rows := await cursor.fetch(batch_size):
+                ids, type_ids, weights, timestamps, user_ids = zip(*rows)
+                names = await registry.resolve_names(self.conn, set(type_ids))
+                yield {
+                    "id": list(ids),
+                    "type": [names[type_id] for type_id in type_ids],
+                    "weight": list(weights),
+                    "timestamp": list(timestamps),
+                    "user_id": list(user_ids),
+                }
+
+    async def aggregate_waste_by_user_id(
+        self, user_id: int, bucket: str, filters: Optional[WasteFilter] = None
+    ) -> List[WasteTotal]:
+        if self._rollup_can_answer(bucket, filters):
+            return await self._aggregate_daily_rollup("= $1", user_id, bucket, filters)
+        args: list = [user_id, bucket]
+        conditions = await self._filter_conditions(filters, args)
+        query = f"""
+        SELECT type_id, date_trunc($2, timestamp) AS bucket, sum(weight) AS total_weight, count(*) AS entry_count
+        FROM waste_entries
+        WHERE user_id = $1{conditions}
+        GROUP BY type_id, bucket
+        """
+        rows = await fetch(self.conn, query, *args)
+        return await self._rows_to_totals(rows)
+
+    async def aggregate_waste_by_team_id(
+        self, team_id: int, bucket: str, filters: Optional[WasteFilter] = None
+    ) -> List[WasteTotal]:
+        if self._rollup_can_answer(bucket, filters):
+            return await self._aggregate_daily_rollup(TEAM_MEMBERS, team_id, bucket, filters)
+        args: list = [team_id, bucket]
+        conditions = await self._filter_conditions(filters, args)
+        query = f"""
+        SELECT type_id, date_trunc($2, timestamp) AS bucket, sum(weight) AS total_weight, count(*) AS entry_count
+        FROM waste_entries
+        WHERE user_id {TEAM_MEMBERS}{conditions}
+        GROUP BY type_id, bucket
+        """
+        rows = await fetch(self.conn, query, *args)
+        return await self._rows_to_totals(rows)
+
+    async def get_daily_totals(
+        self, start: date, end: date, team_id: Optional[int] = None, user_id: Optional[int] = None
+    ) -> Dict[str, list]:
+        """Total weight per user and day in [start, end) from the rollup, as one list per column.
+
+        Days come back as offsets from `start`, which index straight into an array without date conversions.
+        """
+        args: list = [start, end]
+        conditions = ""
+        if team_id is not None:
+            args.append(team_id)
+            conditions += f" AND user_id IN (SELECT id FROM users WHERE team_id = ${len(args)})"
+        if user_id is not None:
+            args.append(user_id)
+            conditions += f" AND user_id = ${len(args)}"
+        query = f"""
+        SELECT user_id, day - $1::date AS day_offset, sum(total_weight) AS total_weight
+        FROM waste_daily_rollup
+        WHERE day >= $1 AND day < $2 AND entry_count > 0{conditions}
+        GROUP BY user_id, day
+        """
+        rows = await fetch(self.conn, query, *args)
+        user_ids, offsets, weights = zip(*rows) if rows else ((), (), ())
+        return {"user_id": list(user_ids), "day_offset": list(offsets), "total_weight": list(weights)}
+
+    async def get_team_waste_summary(self, team_id: int, filters: Optional[WasteFilter] = None) -> dict:
+        """Per-member, per-type and overall totals of a team in one pass over its members' entries."""
+        args: list = [team_id]
+        conditions = await self._filter_conditions(filters, args)
+        # the window sits in the join so members without entries in it are still listed
+        query = f"""
+        SELECT users.id AS user_id,
+               users.username,
+               waste_entries.type_id,
+               GROUPING(users.id, users.username) AS not_by_member,
+               GROUPING(waste_entries.type_id) AS not_by_type,
+               coalesce(sum(waste_entries.weight), 0) AS total_weight,
+               count(waste_entries.id) AS entry_count
+        FROM users
+        LEFT JOIN waste_entries ON waste_entries.user_id = users.id{conditions}
+        WHERE users.team_id = $1
+        GROUP BY GROUPING SETS ((users.id, users.username), (waste_entries.type_id), ())
+        ORDER BY users.id
+        """
+        rows = await fetch(self.conn, query, *args)
+        names = await registry.resolve_names(self.conn, {row["type_id"] for row in rows if row["type_id"] is not None})
+
+        summary: dict = {"team_id": team_id, "total_weight": 0.0, "entry_count": 0, "members": [], "types": []}
+        for row in rows:
+            totals = {"total_weight": row["total_weight"], "entry_count": row["entry_count"]}
+            if not row["not_by_member"]:
+                summary["members"].append({"user_id": row["user_id"], "username": row["username"], **totals})
+            elif not row["not_by_type"]:
+                # members without entries form a group with a NULL type
+                if row["type_id"] is not None:
+                    summary["types"].append({"type": names[row["type_id"]], **totals})
+            else:
+                summary.update(totals)
+        summary["types"].sort(key=lambda totals: totals["type"])
+        return summary
+
+    async def _aggregate_daily_rollup(
+        self, users: str, owner_id: int, bucket: str, filters: Optional[WasteFilter]
+    ) -> List[WasteTotal]:
+        # Reads one row per user, type and day, so the cost follows the days asked for rather than the entries.
+        # `users` is the condition on user_id that picks the owner's rows, with the owner's id as $1
+        args: list = [owner_id, bucket]
+        conditions = ""
+        if filters is not None and filters.start is not None:
+            args.append(filters.start.date())
+            conditions += f" AND day >= ${len(args)}"
+        if filters is not None and filters.end is not None:
+            args.append(filters.end.date())
+            conditions += f" AND day < ${len(args)}"
+        if filters is not None and filters.type is not None:
+            args.append(await registry.resolve_id(self.conn, filters.type))
+            conditions += f" AND type_id = ${len(args)}"
+        query = f"""
+        SELECT type_id,
+               date_trunc($2, day::timestamp) AS bucket,
+               sum(total_weight) AS total_weight,
+               sum(entry_count) AS entry_count
+        FROM waste_daily_rollup
+        WHERE user_id {users} AND entry_count > 0{conditions}
+        GROUP BY type_id, bucket
+        """
+        rows = await fetch(self.conn, query, *args)
+        return await self._rows_to_totals(rows)
 
     @staticmethod
-    def _rows_to_entries(rows) -> List[WasteEntry]:
-        return [WasteEntry.from_dict(row) for row in rows]
+    def _rollup_can_answer(bucket: str, filters: Optional[WasteFilter]) -> bool:
+        """The rollup only knows whole days, so it cannot serve hourly buckets or bounds inside a day."""
+        if bucket not in ROLLUP_BUCKETS:
+            return False
+        if filters is None:
+            return True
+        return all(bound is None or bound.time() == time.min for bound in (filters.start, filters.end))
+
+    async def rebuild_daily_rollup(self) -> int:
+        # Writers are blocked while the rollup is rebuilt, so no entry is counted twice or missed
+        async with self.conn.transaction():
+            await execute(self.conn, "LOCK TABLE waste_entries IN SHARE MODE")
+            await execute(self.conn, "TRUNCATE waste_daily_rollup")
+            status = await execute(self.conn, FILL_DAILY_ROLLUP)
+        return int(status.split()[-1])
+
+    async def _filter_conditions(self, filters: Optional[WasteFilter], args: list) -> str:
+        """Append the filter values to `args` and return the matching SQL conditions."""
+        conditions = ""
+        if filters is None:
+            return conditions
+        if filters.start is not None:
+            args.append(filters.start)
+            conditions += f" AND timestamp >= ${len(args)}"
+        if filters.end is not None:
+            args.append(filters.end)
+            conditions += f" AND timestamp < ${len(args)}"
+        if filters.type is not None:
+            # an unknown type resolves to NULL, which matches no entry
+            args.append(await registry.resolve_id(self.conn, filters.type))
+            conditions += f" AND type_id = ${len(args)}"
+        return conditions
+
+    async def _rows_to_entries(self, rows) -> List[WasteEntry]:
+        names = await registry.resolve_names(self.conn, {row["type_id"] for row in rows})
+        return [WasteEntry.from_dict(dict(row, type=names[row["type_id"]])) for row in rows]
+
+    async def _rows_to_totals(self, rows) -> List[WasteTotal]:
+        names = await registry.resolve_names(self.conn, {row["type_id"] for row in rows})
+        totals = [WasteTotal.from_dict(dict(row, type=names[row["type_id"]])) for row in rows]
+        return sorted(totals, key=lambda total: (total.type, total.bucket))
 
 
 class CacheWasteRepository(WasteRepository):
+    """Caches single entries, the newest part of each user's history and the aggregates computed from it.
+
+    A user's history is a sorted set scored by timestamp, which writes add to and remove from in place; pages and
+    filtered reads are ranges of it. Only the newest CACHED_HISTORY_SIZE entries are kept, and pages that reach
+    past them are read from the database. Aggregates and summaries are hashes that writes invalidate.
+    """
+
     async def create(self, waste_entry: WasteEntry) -> WasteEntry:
         result = await super().create(waste_entry)
-        await cache.set_value(f"waste:{result.id}", result.to_dict())
-        await cache.delete_key(f"waste_by_user_id:{result.user_id}")
+        async with cache.pipeline() as writes:
+            if cache.policy_for("waste:").write_on_create:
+                writes.set_value(f"waste:{result.id}", result.to_dict())
+            self._add_to_user_waste(writes, [result])
         return result
 
+    async def create_many(self, waste_entries: List[WasteEntry]) -> List[WasteEntry]:
+        results = await super().create_many(waste_entries)
+        await self.write_user_waste(results)
+        return results
+
+    async def write_user_waste(self, waste_entries: List[WasteEntry]) -> None:
+        async with cache.pipeline() as writes:
+            self._add_to_user_waste(writes, waste_entries)
+
+    def _add_to_user_waste(self, writes: cache.CachePipeline, waste_entries: List[WasteEntry]) -> None:
+        by_user: Dict[int, List[WasteEntry]] = {}
+        for entry in waste_entries:
+            by_user.setdefault(entry.user_id, []).append(entry)
+        for user_id, entries in by_user.items():
+            writes.add_sorted_if_cached(f"waste_by_user_id:{user_id}", _history_members(entries), CACHED_HISTORY_SIZE)
+        team_ids = list({entry.team_id for entry in waste_entries if entry.team_id is not None})
+        self._invalidate_waste_aggregates(writes, list(by_user), team_ids)
+
+    def _invalidate_waste_aggregates(
+        self, writes: cache.CachePipeline, user_ids: List[int], team_ids: List[int]
+    ) -> None:
+        keys = [f"waste_aggregate_by_user_id:{user_id}" for user_id in user_ids]
+        # team aggregates include every member, so the teams of the touched users go stale too
+        for team_id in team_ids:
+            keys += [f"waste_aggregate_by_team_id:{team_id}", f"waste_summary_by_team_id:{team_id}"]
+        writes.delete(*keys)
+
     async def read(self, entry_id: int) -> Optional[WasteEntry]:
         cache_key = f"waste:{entry_id}"
         cached_data = await cache.get_value(cache_key)
-        if cached_data is not None:
-            return WasteEntry.from_dict(cached_data)
-        else:
-            result = await super().read(entry_id)
-            if result:
-                await cache.set_value(cache_key, result.to_dict())
-            return result
+        if cached_data is None:
+            cached_data = await cache.single_flight(
+                cache_key, partial(self._load_entry, entry_id), partial(cache.get_value, cache_key)
+            )
+        return WasteEntry.from_dict(cached_data) if cached_data else None
+
+    async def _load_entry(self, entry_id: int) -> Optional[dict]:
+        result = await super().read(entry_id)
+        if result is None:
+            return None
+        await cache.set_value(f"waste:{entry_id}", result.to_dict())
+        return result.to_dict()
 
     async def delete(self, entry_id: int) -> None:
-        entry = await self.read(entry_id)
-        await super().delete(entry_id)
-        await cache.delete_key(f"waste:{entry_id}")
-        await cache.delete_key(f"waste_by_user_id:{entry.user_id}")
+        entry = await self._delete(entry_id)
+        if entry is None:
+            return
+        async with cache.pipeline() as writes:
+            writes.delete(f"waste:{entry_id}")
+            writes.remove_sorted(f"waste_by_user_id:{entry.user_id}", _timestamp_score(entry.timestamp), entry_id)
+            team_ids = [entry.team_id] if entry.team_id is not None else []
+            self._invalidate_waste_aggregates(writes, [entry.user_id], team_ids)
 
-    async def get_waste_by_user_id(self, user_id: int) -> List[WasteEntry]:
+    async def get_waste_by_user_id(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        filters: Optional[WasteFilter] = None,
+    ) -> List[WasteEntry]:
         cache_key = f"waste_by_user_id:{user_id}"
-        cached_data = await cache.get_value(cache_key)
+        filters = filters or WasteFilter()
+        cached_page = await self._read_cached_page(user_id, limit, after, filters)
+        if cached_page is not None:
+            return cached_page
+        if not cache.available():
+            return await super().get_waste_by_user_id(user_id, limit, after, filters)
+        values, truncated = await cache.single_flight(
+            cache_key,
+            partial(self._load_user_waste, user_id),
+            partial(cache.get_sorted_desc, cache_key, "+inf", "-inf"),
+        )
+        page = _select_page([WasteEntry.from_dict(value) for value in values], limit, after, filters)
+        if truncated and (limit is None or len(page) < limit):
+            return await super().get_waste_by_user_id(user_id, limit, after, filters)
+        return page
+
+    async def _load_user_waste(self, user_id: int) -> Tuple[List[dict], bool]:
+        # one row past the window tells whether the history goes on beyond it
+        history = await super().get_waste_by_user_id(user_id, CACHED_HISTORY_SIZE + 1)
+        truncated = len(history) > CACHED_HISTORY_SIZE
+        history = history[:CACHED_HISTORY_SIZE]
+        # cached even when empty, like the users that do not exist, so reads of a user without entries stay off the
+        # database
+        await cache.set_sorted(f"waste_by_user_id:{user_id}", _history_members(history), complete=not truncated)
+        return [entry.to_dict() for entry in history], truncated
+
+    async def _read_cached_page(
+        self, user_id: int, limit: Optional[int], after: Optional[Tuple[datetime, int]], filters: WasteFilter
+    ) -> Optional[List[WasteEntry]]:
+        cache_key = f"waste_by_user_id:{user_id}"
+        max_score: Union[int, str] = f"({_timestamp_score(filters.end)}" if filters.end else "+inf"
+        if after and (filters.end is None or after[0] < filters.end):
+            max_score = _timestamp_score(after[0])
+        min_score = _timestamp_score(filters.start) if filters.start else "-inf"
+        # a type filter or the entries sharing the cursor's timestamp can drop rows, so pages are read in chunks
+        chunk_size = None if limit is None else max(limit, CACHED_PAGE_CHUNK_SIZE)
+
+        page: List[WasteEntry] = []
+        offset = 0
+        while True:
+            cached = await cache.get_sorted_desc(cache_key, max_score, min_score, offset, chunk_size)
+            if cached is None:
+                return None
+            values, truncated = cached
+            page += _select_page([WasteEntry.from_dict(value) for value in values], None, after, filters)
+            if limit is not None and len(page) >= limit:
+                return page[:limit]
+            if truncated:
+                # the page reaches past the newest entries, which are all that is cached
+                return await super().get_waste_by_user_id(user_id, limit, after, filters)
+            if chunk_size is None or len(values) < chunk_size:
+                return page
+            offset += chunk_size
+
+    async def aggregate_waste_by_user_id(
+        self, user_id: int, bucket: str, filters: Optional[WasteFilter] = None
+    ) -> List[WasteTotal]:
+        cache_key = f"waste_aggregate_by_user_id:{user_id}"
+        field = f"{bucket}:{(filters or WasteFilter()).cache_key()}"
+        cached_data = await cache.get_field(cache_key, field)
+        if cached_data is None:
+            cached_data = await cache.single_flight(
+                f"{cache_key}:{field}",
+                partial(self._load_user_aggregate, user_id, bucket, filters),
+                partial(cache.get_field, cache_key, field),
+            )
+        return [WasteTotal.from_dict(data) for data in cached_data]
+
+    async def _load_user_aggregate(self, user_id: int, bucket: str, filters: Optional[WasteFilter]) -> List[dict]:
+        results = [result.to_dict() for result in await super().aggregate_waste_by_user_id(user_id, bucket, filters)]
+        await cache.set_field(
+            f"waste_aggregate_by_user_id:{user_id}", f"{bucket}:{(filters or WasteFilter()).cache_key()}", results
+        )
+        return results
+
+    async def aggregate_waste_by_team_id(
+        self, team_id: int, bucket: str, filters: Optional[WasteFilter] = None
+    ) -> List[WasteTotal]:
+        cache_key = f"waste_aggregate_by_team_id:{team_id}"
+        field = f"{bucket}:{(filters or WasteFilter()).cache_key()}"
+        cached_data = await cache.get_field(cache_key, field)
+        if cached_data is None:
+            cached_data = await cache.single_flight(
+                f"{cache_key}:{field}",
+                partial(self._load_team_aggregate, team_id, bucket, filters),
+                partial(cache.get_field, cache_key, field),
+            )
+        return [WasteTotal.from_dict(data) for data in cached_data]
+
+    async def _load_team_aggregate(self, team_id: int, bucket: str, filters: Optional[WasteFilter]) -> List[dict]:
+        results = [result.to_dict() for result in await super().aggregate_waste_by_team_id(team_id, bucket, filters)]
+        await cache.set_field(
+            f"waste_aggregate_by_team_id:{team_id}", f"{bucket}:{(filters or WasteFilter()).cache_key()}", results
+        )
+        return results
+
+    async def get_team_waste_summary(self, team_id: int, filters: Optional[WasteFilter] = None) -> dict:
+        cache_key = f"waste_summary_by_team_id:{team_id}"
+        window_field = (filters or WasteFilter()).cache_key()
+        cached_data = await cache.get_field(cache_key, window_field)
         if cached_data is not None:
-            return [WasteEntry.from_dict(data) for data in cached_data]
+            return cached_data  # type: ignore
         else:
-            results = await super().get_waste_by_user_id(user_id)
-            if results:
-                await cache.set_value(cache_key, [result.to_dict() for result in results])
-            return results
+            return await cache.single_flight(
+                f"{cache_key}:{window_field}",
+                partial(self._load_team_waste_summary, team_id, filters),
+                partial(cache.get_field, cache_key, window_field),
+            )
+
+    async def _load_team_waste_summary(self, team_id: int, filters: Optional[WasteFilter]) -> dict:
+        summary = await super().get_team_waste_summary(team_id, filters)
+        await cache.set_field(f"waste_summary_by_team_id:{team_id}", (filters or WasteFilter()).cache_key(), summary)
+        return summary
+
+    async def rebuild_daily_rollup(self) -> int:
+        rows = await super().rebuild_daily_rollup()
+        # cached aggregates may have been computed from the rollup before it was rebuilt
+        await cache.delete_matching("waste_aggregate_by_*")
+        return rows
+
+
+def _timestamp_score(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def _history_members(entries: List[WasteEntry]) -> List[Tuple[int, int, dict]]:
+    # entries get their ids when they are written, so only written entries make it into a history
+    return [(_timestamp_score(entry.timestamp), entry.id, entry.to_dict()) for entry in entries if entry.id is not None]
+
+
+def _select_page(
+    entries: List[WasteEntry], limit: Optional[int], after: Optional[Tuple[datetime, int]], filters: WasteFilter
+) -> List[WasteEntry]:
+    """Apply a page and filter to entries ordered newest first, the way get_waste_by_user_id does in SQL."""
+    selected = [
+        entry
+        for entry in entries
+        if (after is None or (entry.timestamp, entry.id) < after)
+        and (filters.start is None or entry.timestamp >= filters.start)
+        and (filters.end is None or entry.timestamp < filters.end)
+        and (filters.type is None or entry.type == filters.type)
+    ]
+    return selected[:limit] if limit is not None else selected
@@ -1,10 +1,11 @@
 import logging
+from typing import Optional
 
-from fastapi import APIRouter, Body, Request
+from fastapi import APIRouter, Body, Query, Request
 from starlette import status
 from starlette.responses import JSONResponse
 
-from app.services import authorization_service, team_service
+from app.services import authorization_service, team_service, waste_service
 from app.utils.permissions import Permission
 
 logger = logging.getLogger(__name__)
@@ -26,3 +27,17 @@ async def get_all_teams() -> JSONResponse:
     logger.info("Received request to get all teams")
     teams = await team_service.get_all_teams()
     return JSONResponse([team.to_dict() for team in teams], status_code=status.HTTP_200_OK)
+
+
+@team_router.get("/teams/{team_id}/waste/summary")
+@authorization_service.require_permission(Permission.GET_WASTE_BY_TEAM_ID)
+async def get_team_waste_summary(
+    request: Request,
+    team_id: int,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+) -> JSONResponse:
+    logger.info(f"Received request for the waste summary of team {team_id}")
+    filters = waste_service.build_waste_filter(start, end)
+    summary = await waste_service.get_team_waste_summary(team_id, filters)
+    return JSONResponse(summary, status_code=status.HTTP_200_OK)
@@ -1,15 +1,31 @@
 import logging
+import tempfile
+from typing import List, Optional
 
-from fastapi import APIRouter, Body, Request
+from fastapi import APIRouter, BackgroundTasks, Body, Header, HTTPException, Query, Request
 from starlette import status
-from starlette.responses import JSONResponse
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, StreamingResponse
 
-from app.services import authorization_service, waste_service
+from app.services import (
+    authorization_service,
+    waste_analytics_service,
+    waste_export_service,
+    waste_import_service,
+    waste_service,
+)
+from app.utils import columnar, idempotency
+from app.utils.ndjson import NDJSON_MEDIA_TYPE
+from app.utils.pagination import DEFAULT_PAGE_SIZE
 from app.utils.permissions import Permission
 
 logger = logging.getLogger(__name__)
 waste_router = APIRouter()
 
+STREAM_RESULTS_MEMORY_SIZE = 1024 * 1024
+STREAM_RESULTS_CHUNK_SIZE = 64 * 1024
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 
 def construct_waste_entries_data(waste_entries):
     return [entry.to_dict() for entry in waste_entries]
@@ -22,24 +38,231 @@ async def create_waste(
     type: str = Body(...),
     weight: float = Body(...),
     user_id: int = Body(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ) -> JSONResponse:
     logger.info(f"Attempting to create waste entry with type: {type}, weight: {weight}, user_id: {user_id}")
 
-    waste = await waste_service.create_waste(type, weight, user_id)
+    async def create() -> idempotency.Response:
+        waste = await waste_service.create_waste(type, weight, user_id)
+        logger.info(f"Waste entry created successfully for user_id: {user_id}")
+        return status.HTTP_201_CREATED, waste.to_dict()
+
+    if idempotency_key is None:
+        status_code, content = await create()
+    else:
+        request_fingerprint = idempotency.fingerprint({"type": type, "weight": weight, "user_id": user_id})
+        status_code, content = await idempotency.run_once(
+            "waste", request.state.user.id, idempotency_key, request_fingerprint, create
+        )
+
+    return JSONResponse(content, status_code=status_code)
+
+
+@waste_router.post("/waste/batch")
+@authorization_service.require_permission(Permission.CREATE_WASTE)
+async def create_waste_batch(request: Request, entries: List[dict] = Body(..., embed=True)) -> JSONResponse:
+    logger.info(f"Attempting to create batch of {len(entries)} waste entries")
+
+    waste_entries = await waste_service.create_waste_batch(entries)
+
+    logger.info(f"Batch of {len(waste_entries)} waste entries created successfully")
+    return JSONResponse({"ids": [entry.id for entry in waste_entries]}, status_code=status.HTTP_201_CREATED)
+
+
+@waste_router.post("/waste/stream")
+@authorization_service.require_permission(Permission.CREATE_WASTE)
+async def stream_waste(request: Request) -> StreamingResponse:
+    content_type = request.headers.get("Content-Type", "")
+    if not content_type.startswith(NDJSON_MEDIA_TYPE):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Expected {NDJSON_MEDIA_TYPE} request body"
+        )
+    logger.info("Streaming waste entries from request body")
+
+    # The body is consumed before responding so nothing else reads from the ASGI receive channel meanwhile;
+    # per-line results are spooled to disk once they outgrow memory.
+    results = tempfile.SpooledTemporaryFile(max_size=STREAM_RESULTS_MEMORY_SIZE, mode="w+")
+    summary = await waste_service.ingest_waste_stream(request.stream(), results)
+    results.seek(0)
+
+    logger.info(f"Streamed waste entries ingested: {summary}")
+    return StreamingResponse(
+        iter(lambda: results.read(STREAM_RESULTS_CHUNK_SIZE), ""),
+        media_type=NDJSON_MEDIA_TYPE,
+        status_code=status.HTTP_200_OK,
+        background=BackgroundTask(results.close),
+    )
+
+
+@waste_router.post("/waste/import")
+@authorization_service.require_permission(Permission.IMPORT_WASTE)
+async def import_waste(request: Request, background_tasks: BackgroundTasks) -> JSONResponse:
+    logger.info("Received waste CSV import")
 
-    logger.info(f"Waste entry created successfully for user_id: {user_id}")
-    return JSONResponse(waste.to_dict(), status_code=status.HTTP_201_CREATED)
+    job = await waste_import_service.create_import_job(request.stream())
+    background_tasks.add_task(waste_import_service.run_import_job, job["id"])
+
+    logger.info(f"Waste import {job['id']} accepted")
+    return JSONResponse(job, status_code=status.HTTP_202_ACCEPTED)
+
+
+@waste_router.get("/waste/import/{job_id}")
+@authorization_service.require_permission(Permission.IMPORT_WASTE)
+async def get_import_job(request: Request, job_id: str) -> JSONResponse:
+    logger.info(f"Fetching waste import job {job_id}")
+
+    job = await waste_import_service.get_import_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Import job {job_id} not found")
+
+    return JSONResponse(job, status_code=status.HTTP_200_OK)
 
 
 @waste_router.get("/waste/user/{user_id}")
 @authorization_service.require_permission(Permission.GET_WASTE_BY_USER_ID)
-async def get_waste_by_user_id(request: Request, user_id: int) -> JSONResponse:
+async def get_waste_by_user_id(
+    request: Request,
+    user_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    type: Optional[str] = Query(None),
+) -> JSONResponse:
     logger.info(f"Fetching waste entries for user_id: {user_id}")
 
-    waste_entries = await waste_service.get_waste_by_user_id(user_id)
+    filters = waste_service.build_waste_filter(start, end, type)
+    waste_entries, next_cursor = await waste_service.get_waste_by_user_id(user_id, limit, cursor, filters)
 
     logger.info(f"Found {len(waste_entries)} waste entries for user_id: {user_id}")
 
     waste_entries_data = construct_waste_entries_data(waste_entries)
 
-    return JSONResponse(content=waste_entries_data, status_code=status.HTTP_200_OK)
+    # the body stays a plain list; the cursor for the following page travels in a header
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return JSONResponse(content=waste_entries_data, status_code=status.HTTP_200_OK, headers=headers)
+
+
+@waste_router.get("/waste/user/{user_id}/export")
+@authorization_service.require_permission(Permission.GET_WASTE_BY_USER_ID)
+async def export_waste_by_user_id(
+    request: Request,
+    user_id: int,
+    format: str = Query("ndjson"),
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    type: Optional[str] = Query(None),
+) -> StreamingResponse:
+    logger.info(f"Exporting waste entries for user_id: {user_id} as {format}")
+
+    filters = waste_service.build_waste_filter(start, end, type)
+    chunks = await waste_service.export_waste_by_user_id(user_id, format, filters)
+
+    media_type = NDJSON_MEDIA_TYPE if format == "ndjson" else "application/json"
+    headers = {"Content-Disposition": f'attachment; filename="waste-user-{user_id}.{format}"'}
+    return StreamingResponse(chunks, media_type=media_type, headers=headers, status_code=status.HTTP_200_OK)
+
+
+@waste_router.get("/waste/user/{user_id}/aggregate")
+@authorization_service.require_permission(Permission.GET_WASTE_BY_USER_ID)
+async def aggregate_waste_by_user_id(
+    request: Request,
+    user_id: int,
+    bucket: str = Query("day"),
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    type: Optional[str] = Query(None),
+) -> JSONResponse:
+    logger.info(f"Aggregating waste entries for user_id: {user_id} by {bucket}")
+
+    filters = waste_service.build_waste_filter(start, end, type)
+    series = await waste_service.aggregate_waste_by_user_id(user_id, bucket, filters)
+    return JSONResponse(content=series, status_code=status.HTTP_200_OK)
+
+
+@waste_router.get("/waste/team/{team_id}/aggregate")
+@authorization_service.require_permission(Permission.GET_WASTE_BY_TEAM_ID)
+async def aggregate_waste_by_team_id(
+    request: Request,
+    team_id: int,
+    bucket: str = Query("day"),
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    type: Optional[str] = Query(None),
+) -> JSONResponse:
+    logger.info(f"Aggregating waste entries for team_id: {team_id} by {bucket}")
+
+    filters = waste_service.build_waste_filter(start, end, type)
+    series = await waste_service.aggregate_waste_by_team_id(team_id, bucket, filters)
+    return JSONResponse(content=series, status_code=status.HTTP_200_OK)
+
+
+@waste_router.get("/waste/export")
+@authorization_service.require_permission(Permission.GET_WASTE_BY_TEAM_ID)
+async def export_waste_columnar(
+    request: Request,
+    format: str = Query("parquet"),
+    team_id: Optional[int] = Query(None),
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+) -> StreamingResponse:
+    logger.info(f"Exporting waste entries as {format} for team_id: {team_id}")
+
+    filters = waste_service.build_waste_filter(start, end)
+    chunks = await waste_export_service.export_columnar(format, team_id, filters)
+
+    headers = {"Content-Disposition": f'attachment; filename="waste.{format}"'}
+    return StreamingResponse(
+        chunks, media_type=columnar.MEDIA_TYPES[format], headers=headers, status_code=status.HTTP_200_OK
+    )
+
+
+@waste_router.get("/waste/user/{user_id}/anomalies")
+@authorization_service.require_permission(Permission.GET_WASTE_BY_USER_ID)
+async def detect_waste_anomalies_by_user_id(
+    request: Request,
+    user_id: int,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    window: int = Query(waste_analytics_service.ANOMALY_WINDOW_DAYS),
+    threshold: float = Query(waste_analytics_service.ANOMALY_Z_THRESHOLD),
+) -> JSONResponse:
+    logger.info(f"Detecting waste anomalies for user_id: {user_id}")
+
+    filters = waste_service.build_waste_filter(start, end)
+    report = await waste_analytics_service.detect_anomalies(
+        user_id=user_id,
+        start=_filter_day(filters, "start"),
+        end=_filter_day(filters, "end"),
+        window=window,
+        threshold=threshold,
+    )
+    return JSONResponse(report, status_code=status.HTTP_200_OK)
+
+
+@waste_router.get("/waste/team/{team_id}/anomalies")
+@authorization_service.require_permission(Permission.GET_WASTE_BY_TEAM_ID)
+async def detect_waste_anomalies_by_team_id(
+    request: Request,
+    team_id: int,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    window: int = Query(waste_analytics_service.ANOMALY_WINDOW_DAYS),
+    threshold: float = Query(waste_analytics_service.ANOMALY_Z_THRESHOLD),
+) -> JSONResponse:
+    logger.info(f"Detecting waste anomalies for team_id: {team_id}")
+
+    filters = waste_service.build_waste_filter(start, end)
+    report = await waste_analytics_service.detect_anomalies(
+        team_id=team_id,
+        start=_filter_day(filters, "start"),
+        end=_filter_day(filters, "end"),
+        window=window,
+        threshold=threshold,
+    )
+    return JSONResponse({"team_id": team_id, **report}, status_code=status.HTTP_200_OK)
+
+
+def _filter_day(filters, bound: str):
+    value = getattr(filters, bound) if filters else None
+    return value.date() if value else None
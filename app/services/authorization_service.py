@@ -52,7 +52,7 @@ async def verify_authorization(current_user: User, permission: Permission, reque
                 f"User {current_user.id} does not have access to user {request_user_id}",
             )
 
-        if permission == Permission.GET_USERS_BY_TEAM_ID:
+        if permission in (Permission.GET_USERS_BY_TEAM_ID, Permission.GET_WASTE_BY_TEAM_ID):
             request_team_id = request_data["team_id"]
             verify(
                 request_team_id == current_user.team_id,
@@ -73,6 +73,7 @@ def require_permission(required_permission: Permission):
             user = await authentication_service.verify_authentication(token)
             logger.info(f"User authenticated: {user}")
             await verify_authorization(user, required_permission, kwargs)
+            request.state.user = user
             return await func(*args, **kwargs)
 
         return wrapper
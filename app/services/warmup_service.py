@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from typing import Dict
+
+from app.services import team_service, user_service
+from app.utils import cache, db
+
+logger = logging.getLogger(__name__)
+
+# teams whose members are cached at startup, the first ones by id
+WARMUP_MAX_TEAMS = int(os.getenv("WARMUP_MAX_TEAMS", "100"))
+
+_ready = False
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+def set_ready(ready: bool) -> None:
+    global _ready
+    _ready = ready
+
+
+async def warm_up() -> None:
+    """Get a fresh replica ready for traffic, then report it ready.
+
+    Both steps only save the first requests some latency, so a failing step is logged and the replica is
+    reported ready regardless.
+    """
+    started = time.monotonic()
+    try:
+        await db.prepare_pool(db.get_db_pool())
+    except Exception:
+        logger.exception("Could not prepare the database connections")
+    try:
+        primed = await prime_caches()
+        logger.info(f"Primed the cache with {primed['teams']} teams and {primed['users']} users")
+    except Exception:
+        logger.exception("Could not prime the cache")
+    set_ready(True)
+    logger.info(f"Warmed up in {time.monotonic() - started:.2f}s")
+
+
+async def prime_caches() -> Dict[str, int]:
+    """Cache the teams, and the members of the first WARMUP_MAX_TEAMS teams, the lookups every request starts with."""
+    async with team_service.get_team_repo() as repo:
+        teams = await repo.read_all()
+    await cache.set_many({f"team:{team.id}": team.to_dict() for team in teams})
+
+    # reading the members also caches each team's member list
+    users = []
+    async with user_service.get_user_repo() as repo:
+        for team_id in [team.id for team in teams[:WARMUP_MAX_TEAMS] if team.id is not None]:
+            users += await repo.get_users_by_team_id(team_id)
+    values = {}
+    for user in users:
+        values[f"user:{user.id}"] = values[f"user_by_username:{user.username}"] = user.to_dict()
+    await cache.set_many(values)
+    return {"teams": len(teams), "users": len(users)}
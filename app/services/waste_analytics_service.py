@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+from typing import Optional
+
+from app.services import team_service, user_service, waste_service
+from app.utils import analytics
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_WINDOW_DAYS = int(os.getenv("WASTE_ANOMALY_WINDOW_DAYS", "28"))
+ANOMALY_Z_THRESHOLD = float(os.getenv("WASTE_ANOMALY_Z_THRESHOLD", "3.0"))
+# days of history needed before a day can be flagged
+ANOMALY_MIN_PERIODS = 7
+DEFAULT_PERIOD_DAYS = 365
+MAX_PERIOD_DAYS = 5 * 366
+
+
+async def detect_anomalies(
+    team_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    window: int = ANOMALY_WINDOW_DAYS,
+    threshold: float = ANOMALY_Z_THRESHOLD,
+) -> dict:
+    """Daily totals per user over [start, end), with per-user statistics and the days that spike."""
+    logger.info(f"Detecting waste anomalies for team_id: {team_id}, user_id: {user_id}, from {start} to {end}")
+
+    analytics.require_numpy()
+    end = end or date.today() + timedelta(days=1)
+    start = start or end - timedelta(days=DEFAULT_PERIOD_DAYS)
+    num_days = (end - start).days
+    if not 0 < num_days <= MAX_PERIOD_DAYS:
+        raise ValueError(f"The period must cover between 1 and {MAX_PERIOD_DAYS} days")
+    if window < 1 or threshold <= 0:
+        raise ValueError("window must be at least 1 and threshold must be positive")
+    if team_id is not None:
+        await team_service.assert_team_exists(team_id)
+    if user_id is not None:
+        await user_service.assert_user_exists(user_id)
+
+    async with waste_service.get_waste_repo() as repo:
+        totals = await repo.get_daily_totals(start, end, team_id, user_id)
+
+    # the array work is CPU bound, so it runs off the event loop
+    result = await asyncio.to_thread(_analyse, totals, start, num_days, window, threshold)
+    logger.info(f"Found {len(result['outliers'])} waste anomalies across {len(result['users'])} users")
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "window": window,
+        "threshold": threshold,
+        **result,
+    }
+
+
+def _analyse(totals: dict, start: date, num_days: int, window: int, threshold: float) -> dict:
+    if not totals["user_id"]:
+        return {"users": [], "outliers": []}
+    users, matrix = analytics.daily_matrix(totals["user_id"], totals["day_offset"], totals["total_weight"], num_days)
+    return analytics.detect_outliers(users, matrix, start, window, threshold, min(ANOMALY_MIN_PERIODS, window))
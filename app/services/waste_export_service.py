@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import logging
+import os
+from typing import AsyncIterator, Optional
+
+from app.models.waste import WasteFilter
+from app.services import team_service, waste_service
+from app.utils.columnar import ColumnarWriter, require_pyarrow, validate_format
+
+logger = logging.getLogger(__name__)
+
+# Rows per record batch; also the most rows held in memory by one export
+COLUMNAR_BATCH_SIZE = int(os.getenv("WASTE_COLUMNAR_BATCH_SIZE", "50000"))
+
+
+async def export_columnar(
+    format: str, team_id: Optional[int] = None, filters: Optional[WasteFilter] = None
+) -> AsyncIterator[bytes]:
+    logger.info(f"Exporting waste entries as {format} for team_id: {team_id}, filters: {filters}")
+
+    require_pyarrow()
+    validate_format(format)
+    if team_id is not None:
+        await team_service.assert_team_exists(team_id)
+    return _stream_columnar(format, team_id, filters)
+
+
+async def _stream_columnar(format: str, team_id: Optional[int], filters: Optional[WasteFilter]) -> AsyncIterator[bytes]:
+    writer = ColumnarWriter(format)
+    async with waste_service.get_waste_repo() as repo:
+        async for columns in repo.iterate_waste_columns(COLUMNAR_BATCH_SIZE, team_id, filters):
+            yield writer.write(columns)
+    yield writer.close()
+
+    logger.info(f"Exported {writer.rows} waste entries as {format}")
+
+
+async def write_columnar_file(
+    path: str, format: str, team_id: Optional[int] = None, filters: Optional[WasteFilter] = None
+) -> int:
+    size = 0
+    with open(path, "wb") as output:
+        async for chunk in await export_columnar(format, team_id, filters):
+            output.write(chunk)
+            size += len(chunk)
+    logger.info(f"Wrote {size} bytes of {format} to {path}")
+    return size
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import itertools
+import logging
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import AsyncIterable, List, Optional, Tuple
+
+from app.models.waste import WasteEntry
+from app.services import waste_service
+from app.utils import cache
+
+logger = logging.getLogger(__name__)
+
+IMPORT_DIR = os.getenv("WASTE_IMPORT_DIR", tempfile.gettempdir())
+# Each chunk is written with one COPY on its own pool connection
+IMPORT_CHUNK_SIZE = int(os.getenv("WASTE_IMPORT_CHUNK_SIZE", "5000"))
+MAX_RECORDED_ERRORS = 100
+REQUIRED_COLUMNS = {"type", "weight", "user_id"}
+
+
+def _job_key(job_id: str) -> str:
+    return f"waste_import_job:{job_id}"
+
+
+def _spool_path(job_id: str) -> str:
+    return os.path.join(IMPORT_DIR, f"waste-import-{job_id}.csv")
+
+
+async def create_import_job(chunks: AsyncIterable[bytes]) -> dict:
+    # jobs are tracked in Redis only
+    cache.require_available()
+    job_id = uuid.uuid4().hex
+    path = _spool_path(job_id)
+    logger.info(f"Spooling waste import {job_id} to {path}")
+
+    size = 0
+    try:
+        with open(path, "wb") as spool:
+            async for chunk in chunks:
+                spool.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        # including the upload being cancelled when the client goes away
+        os.remove(path)
+        raise
+
+    job = {
+        "id": job_id,
+        "status": "pending",
+        "bytes": size,
+        "rows_processed": 0,
+        "rows_imported": 0,
+        "rows_rejected": 0,
+        "rows_per_second": 0.0,
+        "errors": [],
+        "created_at": datetime.now().isoformat(),
+        "finished_at": None,
+    }
+    if not await cache.set_durable(_job_key(job_id), job):
+        os.remove(path)
+        raise cache.CacheUnavailableError(f"Could not record waste import {job_id}")
+    logger.info(f"Waste import {job_id} spooled ({size} bytes)")
+    return job
+
+
+async def get_import_job(job_id: str) -> Optional[dict]:
+    logger.info(f"Fetching waste import job {job_id}")
+    cache.require_available()
+    return await cache.get_durable(_job_key(job_id))  # type: ignore
+
+
+async def run_import_job(job_id: str) -> None:
+    path = _spool_path(job_id)
+    try:
+        await _run_import(job_id, path)
+    finally:
+        # whatever happened, including Redis being down before the job could be read, the upload is not needed
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def _run_import(job_id: str, path: str) -> None:
+    job = await get_import_job(job_id)
+    if job is None:
+        logger.error(f"Waste import job {job_id} not found")
+        return
+
+    job["status"] = "running"
+    await cache.set_durable(_job_key(job_id), job)
+    started = time.monotonic()
+    try:
+        with open(path, newline="", encoding="utf-8") as spool:
+            reader = csv.DictReader(spool)
+            fieldnames = await asyncio.to_thread(lambda: reader.fieldnames)
+            missing_columns = REQUIRED_COLUMNS - set(fieldnames or [])
+            if missing_columns:
+                raise ValueError(f"CSV header is missing columns {sorted(missing_columns)}")
+
+            while True:
+                # parsing is CPU bound, so it is kept off the event loop
+                chunk, errors, rows = await asyncio.to_thread(_parse_chunk, reader)
+                if not rows:
+                    break
+                for line_number, error in errors:
+                    _record_error(job, line_number, error)
+                job["rows_processed"] += rows
+                await _import_chunk(job, chunk, started)
+        job["status"] = "completed"
+    except Exception as e:
+        logger.error(f"Waste import {job_id} failed: {str(e)}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+
+    job["finished_at"] = datetime.now().isoformat()
+    _update_throughput(job, started)
+    await cache.set_durable(_job_key(job_id), job)
+    logger.info(
+        f"Waste import {job_id} {job['status']}: {job['rows_imported']} imported, {job['rows_rejected']} rejected"
+    )
+
+
+def _parse_chunk(reader: csv.DictReader) -> Tuple[List[Tuple[int, WasteEntry]], List[Tuple[int, str]], int]:
+    """Parse the next IMPORT_CHUNK_SIZE rows into entries and errors, by line number, and count the rows read."""
+    chunk: List[Tuple[int, WasteEntry]] = []
+    errors: List[Tuple[int, str]] = []
+    rows = 0
+    for row in itertools.islice(reader, IMPORT_CHUNK_SIZE):
+        rows += 1
+        try:
+            chunk.append((reader.line_num, waste_service.parse_waste_entry(row)))
+        except ValueError as e:
+            errors.append((reader.line_num, str(e)))
+    return chunk, errors, rows
+
+
+async def _import_chunk(job: dict, chunk: List[Tuple[int, WasteEntry]], started: float) -> None:
+    errors = await waste_service.create_numbered_waste_entries(chunk)
+    for line_number, error in errors.items():
+        _record_error(job, line_number, error)
+    job["rows_imported"] += len(chunk) - len(errors)
+    _update_throughput(job, started)
+    await cache.set_durable(_job_key(job["id"]), job)
+
+
+def _record_error(job: dict, line_number: int, error: str) -> None:
+    job["rows_rejected"] += 1
+    if len(job["errors"]) < MAX_RECORDED_ERRORS:
+        job["errors"].append({"line": line_number, "error": error})
+
+
+def _update_throughput(job: dict, started: float) -> None:
+    elapsed = time.monotonic() - started
+    job["rows_per_second"] = round(job["rows_processed"] / elapsed, 1) if elapsed > 0 else 0.0
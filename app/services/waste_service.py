@@ -1,14 +1,38 @@
+import json
 import logging
+import math
+import os
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, List
+from datetime import datetime, timezone
+from typing import IO, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple, Union
 
-from app.models.waste import WasteEntry
-from app.repositories.waste_repository import CacheWasteRepository, WasteRepository
-from app.services import user_service
-from app.utils.db import get_db_pool
+from app.models.waste import WasteEntry, WasteFilter, WasteTotal, utc_now
+from app.repositories.waste_repository import CacheWasteRepository, MissingUsersError, WasteRepository
+from app.services import team_service, user_service
+from app.utils.coalescer import WriteCoalescer
+from app.utils.db import DatabaseError, get_db_pool
+from app.utils.ndjson import dumps_line, iter_lines
+from app.utils.pagination import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor, validate_page_size
 
 logger = logging.getLogger(__name__)
 
+MAX_BATCH_SIZE = 1000
+MAX_TYPE_LENGTH = 100
+
+AGGREGATE_BUCKETS = ("hour", "day", "week", "month")
+
+EXPORT_FORMATS = ("ndjson", "json")
+EXPORT_BATCH_SIZE = int(os.getenv("WASTE_EXPORT_BATCH_SIZE", "1000"))
+
+# Streamed uploads are written in batches of this many lines, which bounds memory per upload
+STREAM_BATCH_SIZE = int(os.getenv("WASTE_STREAM_BATCH_SIZE", "500"))
+STREAM_MAX_LINE_LENGTH = 64 * 1024
+
+# Opt-in coalescing of concurrent single-entry writes into multi-row inserts
+WRITE_COALESCING = os.getenv("WASTE_WRITE_COALESCING", "false").lower() == "true"
+COALESCE_WINDOW_MS = float(os.getenv("WASTE_COALESCE_WINDOW_MS", "5"))
+COALESCE_MAX_BATCH_SIZE = int(os.getenv("WASTE_COALESCE_MAX_BATCH_SIZE", "100"))
+
 
 @asynccontextmanager
 async def get_waste_repo() -> AsyncIterator[WasteRepository]:
@@ -24,6 +48,7 @@ async def create_waste(
 ) -> WasteEntry:
     logger.info(f"Creating waste entry with type: {type}, weight: {weight}, user_id: {user_id}")
 
+    validate_waste_type(type)
     await user_service.assert_user_exists(user_id)
     waste = WasteEntry(
         type=type,
@@ -31,19 +56,329 @@ async def create_waste(
         user_id=user_id,
     )
 
+    if write_coalescer is not None:
+        entry = await write_coalescer.submit(waste)
+    else:
+        async with get_waste_repo() as repo:
+            entry = await repo.create(waste)
+
+    logger.info(f"Waste entry created with ID: {entry.id} for user_id: {user_id}")
+    return entry
+
+
+async def insert_waste_entries(waste_entries: List[WasteEntry]) -> List[WasteEntry]:
     async with get_waste_repo() as repo:
-        entry = await repo.create(waste)
+        return await repo.insert_many(waste_entries)
 
-        logger.info(f"Waste entry created with ID: {entry.id} for user_id: {user_id}")
-        return entry
 
+async def cache_waste_entries(waste_entries: List[WasteEntry]) -> None:
+    async with get_waste_repo() as repo:
+        await repo.write_user_waste(waste_entries)
 
-async def get_waste_by_user_id(user_id: int) -> List[WasteEntry]:
-    logger.info(f"Fetching waste entries for user_id: {user_id}")
 
-    await user_service.assert_user_exists(user_id)
+write_coalescer = (
+    WriteCoalescer(
+        insert_waste_entries,
+        window=COALESCE_WINDOW_MS / 1000,
+        max_batch_size=COALESCE_MAX_BATCH_SIZE,
+        after_flush=cache_waste_entries,
+    )
+    if WRITE_COALESCING
+    else None
+)
+
+
+def get_write_coalescer_stats() -> Optional[dict]:
+    return write_coalescer.stats() if write_coalescer is not None else None
+
+
+async def drain_write_coalescer() -> None:
+    if write_coalescer is not None:
+        await write_coalescer.drain()
+        logger.info(f"Write coalescer drained: {write_coalescer.stats()}")
+
+
+def validate_waste_type(type: str) -> None:
+    if not type or len(type) > MAX_TYPE_LENGTH:
+        raise ValueError(f"Waste type must be between 1 and {MAX_TYPE_LENGTH} characters")
+
+
+def parse_timestamp(value: Optional[str]) -> datetime:
+    if not value:
+        return utc_now()
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    # timestamps are stored without a time zone, so offsets are normalised to naive UTC
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def build_waste_filter(
+    start: Optional[str] = None, end: Optional[str] = None, type: Optional[str] = None
+) -> Optional[WasteFilter]:
+    if start is None and end is None and type is None:
+        return None
+    filters = WasteFilter(
+        start=_parse_filter_timestamp(start, "from"),
+        end=_parse_filter_timestamp(end, "to"),
+        type=type,
+    )
+    if filters.type is not None:
+        validate_waste_type(filters.type)
+    if filters.start is not None and filters.end is not None and filters.start >= filters.end:
+        raise ValueError("'from' must be earlier than 'to'")
+    return filters
+
+
+def _parse_filter_timestamp(value: Optional[str], field: str) -> Optional[datetime]:
+    if value is None:
+        return None
+    if not value:
+        raise ValueError(f"Invalid '{field}' timestamp: {value!r}")
+    try:
+        return parse_timestamp(value)
+    except ValueError:
+        raise ValueError(f"Invalid '{field}' timestamp: {value!r}")
+
+
+def parse_waste_entry(data: dict) -> WasteEntry:
+    # JSON lines carry typed values and CSV rows strings, with None for the fields of a short row
+    try:
+        type = data["type"]
+        if not isinstance(type, str):
+            raise ValueError(f"Waste type must be a string, got {type!r}")
+        validate_waste_type(type)
+        return WasteEntry(
+            type=type,
+            weight=_parse_weight(data["weight"]),
+            user_id=_parse_user_id(data["user_id"]),
+            timestamp=parse_timestamp(data.get("timestamp")),
+        )
+    except KeyError as e:
+        raise ValueError(f"Missing field {e}")
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid waste entry: {e}")
+
+
+def _parse_weight(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"Weight must be a number, got {value!r}")
+    weight = float(value)
+    if not math.isfinite(weight):
+        raise ValueError(f"Weight must be finite, got {value!r}")
+    return weight
+
+
+def _parse_user_id(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"User id must be an integer, got {value!r}")
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"User id must be an integer, got {value!r}")
+    return int(value)
+
+
+async def create_waste_batch(entries: List[dict]) -> List[WasteEntry]:
+    logger.info(f"Creating batch of {len(entries)} waste entries")
+
+    if len(entries) > MAX_BATCH_SIZE:
+        raise ValueError(f"Batch size {len(entries)} exceeds the maximum of {MAX_BATCH_SIZE}")
+    waste_entries = [parse_waste_entry(entry) for entry in entries]
+
     async with get_waste_repo() as repo:
-        waste_entries = await repo.get_waste_by_user_id(user_id)
+        waste_entries = await repo.create_many(waste_entries)
 
-        logger.info(f"Found {len(waste_entries)} waste entries for user_id: {user_id}")
+        logger.info(f"Created batch of {len(waste_entries)} waste entries")
         return waste_entries
+
+
+async def ingest_waste_stream(chunks: AsyncIterable[bytes], results: IO[str]) -> Dict[str, int]:
+    logger.info("Ingesting waste entry stream")
+
+    summary = {"accepted": 0, "rejected": 0}
+    pending: List[Tuple[int, Union[WasteEntry, str]]] = []
+    line_number = 0
+    async for line in iter_lines(chunks, STREAM_MAX_LINE_LENGTH):
+        line_number += 1
+        if line is None:
+            pending.append((line_number, f"Line exceeds {STREAM_MAX_LINE_LENGTH} bytes"))
+        elif line.strip():
+            try:
+                pending.append((line_number, parse_waste_entry(json.loads(line))))
+            except ValueError as e:
+                pending.append((line_number, str(e)))
+
+        if len(pending) >= STREAM_BATCH_SIZE:
+            await _write_stream_batch(pending, results, summary)
+            pending = []
+
+    if pending:
+        await _write_stream_batch(pending, results, summary)
+    logger.info(f"Finished ingesting waste entry stream of {line_number} lines: {summary}")
+    return summary
+
+
+async def _write_stream_batch(
+    pending: List[Tuple[int, Union[WasteEntry, str]]], results: IO[str], summary: Dict[str, int]
+) -> None:
+    errors = {line_number: entry for line_number, entry in pending if isinstance(entry, str)}
+    numbered_entries = [(line_number, entry) for line_number, entry in pending if isinstance(entry, WasteEntry)]
+    errors.update(await create_numbered_waste_entries(numbered_entries))
+
+    for line_number, entry in pending:
+        if isinstance(entry, WasteEntry) and line_number not in errors:
+            results.write(dumps_line({"line": line_number, "status": "accepted", "id": entry.id}))
+        else:
+            results.write(dumps_line({"line": line_number, "status": "rejected", "error": errors[line_number]}))
+    summary["accepted"] += len(pending) - len(errors)
+    summary["rejected"] += len(errors)
+
+
+async def create_numbered_waste_entries(numbered_entries: List[Tuple[int, WasteEntry]]) -> Dict[int, str]:
+    """Write entries keyed by their input line number and return the errors of the lines that were rejected."""
+    errors: Dict[int, str] = {}
+    while numbered_entries:
+        try:
+            async with get_waste_repo() as repo:
+                await repo.create_many([entry for _, entry in numbered_entries])
+            break
+        except MissingUsersError as e:
+            for line_number, entry in numbered_entries:
+                if entry.user_id in e.user_ids:
+                    errors[line_number] = f"User {entry.user_id} does not exist"
+            numbered_entries = [(number, entry) for number, entry in numbered_entries if number not in errors]
+        except DatabaseError as e:
+            logger.error(f"Failed to write batch of {len(numbered_entries)} waste entries: {str(e)}")
+            errors.update((line_number, str(e)) for line_number, _ in numbered_entries)
+            break
+    return errors
+
+
+async def get_waste_by_user_id(
+    user_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, filters: Optional[WasteFilter] = None
+) -> Tuple[List[WasteEntry], Optional[str]]:
+    logger.info(f"Fetching waste entries for user_id: {user_id}, limit: {limit}, cursor: {cursor}, filters: {filters}")
+
+    validate_page_size(limit)
+    after = decode_cursor(cursor) if cursor else None
+    await user_service.assert_user_exists(user_id)
+    async with get_waste_repo() as repo:
+        # one extra row tells whether another page follows
+        waste_entries = await repo.get_waste_by_user_id(user_id, limit + 1, after, filters)
+
+    next_cursor = None
+    if len(waste_entries) > limit:
+        waste_entries = waste_entries[:limit]
+        next_cursor = encode_cursor(waste_entries[-1].timestamp, waste_entries[-1].id)  # type: ignore
+
+    logger.info(f"Found {len(waste_entries)} waste entries for user_id: {user_id}")
+    return waste_entries, next_cursor
+
+
+async def export_waste_by_user_id(
+    user_id: int, format: str, filters: Optional[WasteFilter] = None
+) -> AsyncIterator[str]:
+    logger.info(f"Exporting waste entries for user_id: {user_id} as {format}")
+
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format {format}, expected one of {EXPORT_FORMATS}")
+    await user_service.assert_user_exists(user_id)
+    return _stream_waste_export(user_id, format, filters)
+
+
+async def _stream_waste_export(user_id: int, format: str, filters: Optional[WasteFilter]) -> AsyncIterator[str]:
+    # Rows go straight from the cursor to the response, so memory is bounded by one batch
+    exported = 0
+    async with get_waste_repo() as repo:
+        if format == "json":
+            yield "["
+        async for rows in repo.iterate_waste_by_user_id(user_id, EXPORT_BATCH_SIZE, filters):
+            lines = [json.dumps(_export_row(row)) for row in rows]
+            if format == "json":
+                yield ("," if exported else "") + ",".join(lines)
+            else:
+                yield "\n".join(lines) + "\n"
+            exported += len(rows)
+        if format == "json":
+            yield "]"
+
+    logger.info(f"Exported {exported} waste entries for user_id: {user_id}")
+
+
+def _export_row(row) -> dict:
+    return {
+        "id": row["id"],
+        "type": row["type"],
+        "weight": row["weight"],
+        "timestamp": row["timestamp"].isoformat(),
+        "user_id": row["user_id"],
+    }
+
+
+async def aggregate_waste_by_user_id(user_id: int, bucket: str, filters: Optional[WasteFilter] = None) -> dict:
+    logger.info(f"Aggregating waste entries for user_id: {user_id} by {bucket}, filters: {filters}")
+
+    validate_bucket(bucket)
+    await user_service.assert_user_exists(user_id)
+    async with get_waste_repo() as repo:
+        totals = await repo.aggregate_waste_by_user_id(user_id, bucket, filters)
+
+    logger.info(f"Aggregated waste entries for user_id: {user_id} into {len(totals)} totals")
+    return construct_waste_series(bucket, totals)
+
+
+async def aggregate_waste_by_team_id(team_id: int, bucket: str, filters: Optional[WasteFilter] = None) -> dict:
+    logger.info(f"Aggregating waste entries for team_id: {team_id} by {bucket}, filters: {filters}")
+
+    validate_bucket(bucket)
+    await team_service.assert_team_exists(team_id)
+    async with get_waste_repo() as repo:
+        totals = await repo.aggregate_waste_by_team_id(team_id, bucket, filters)
+
+    logger.info(f"Aggregated waste entries for team_id: {team_id} into {len(totals)} totals")
+    return construct_waste_series(bucket, totals)
+
+
+def validate_bucket(bucket: str) -> None:
+    if bucket not in AGGREGATE_BUCKETS:
+        raise ValueError(f"Unsupported bucket {bucket}, expected one of {AGGREGATE_BUCKETS}")
+
+
+def construct_waste_series(bucket: str, totals: List[WasteTotal]) -> dict:
+    """Group totals into one columnar series per waste type, ordered by bucket."""
+    series: Dict[str, dict] = {}
+    for total in totals:
+        points = series.setdefault(
+            total.type, {"type": total.type, "buckets": [], "total_weight": [], "entry_count": []}
+        )
+        points["buckets"].append(total.bucket.isoformat())
+        points["total_weight"].append(total.total_weight)
+        points["entry_count"].append(total.entry_count)
+    return {"bucket": bucket, "series": list(series.values())}
+
+
+async def get_team_waste_summary(team_id: int, filters: Optional[WasteFilter] = None) -> dict:
+    logger.info(f"Fetching waste summary for team_id: {team_id}, filters: {filters}")
+
+    await team_service.assert_team_exists(team_id)
+    async with get_waste_repo() as repo:
+        summary = await repo.get_team_waste_summary(team_id, filters)
+
+    logger.info(f"Waste summary for team_id: {team_id} covers {len(summary['members'])} members")
+    return {
+        "from": filters.start.isoformat() if filters and filters.start else None,
+        "to": filters.end.isoformat() if filters and filters.end else None,
+        **summary,
+    }
+
+
+async def backfill_daily_rollup() -> int:
+    logger.info("Rebuilding the daily waste rollup from waste_entries")
+
+    async with get_waste_repo() as repo:
+        rows = await repo.rebuild_daily_rollup()
+
+    logger.info(f"Daily waste rollup rebuilt with {rows} rows")
+    return rows
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+from app.utils.columnar import MissingDependencyError
+from app.utils.optional_imports import optional_import
+
+# numpy is an optional dependency, only needed for analytics
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = optional_import("numpy")
+
+PERCENTILES = (50, 95, 99)
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise MissingDependencyError("Waste analytics need numpy, install the analytics extra")
+
+
+def daily_matrix(
+    user_ids: Sequence[int], day_offsets: Sequence[int], weights: Sequence[float], num_days: int
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Scatter (user, day offset, weight) triples into a dense users x days matrix; days without entries are 0.
+
+    Returns the sorted user ids alongside the matrix, row i belonging to users[i].
+    """
+    users, rows = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+    offsets = np.asarray(day_offsets, dtype=np.int64)
+    matrix = np.zeros((len(users), num_days))
+    np.add.at(matrix, (rows, offsets), np.asarray(weights, dtype=np.float64))
+    return users, matrix
+
+
+def rolling_mean_std(matrix: "np.ndarray", window: int, min_periods: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Mean and standard deviation of the `window` days before each day, excluding the day itself.
+
+    Leaving the day out keeps a spike from inflating its own baseline. Days with fewer than `min_periods`
+    previous days get NaN.
+    """
+    padded = np.pad(matrix, ((0, 0), (1, 0)))
+    sums = np.cumsum(padded, axis=1)
+    squares = np.cumsum(padded**2, axis=1)
+    days = np.arange(matrix.shape[1])
+    lower = np.maximum(days - window, 0)
+    counts = (days - lower).astype(np.float64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (sums[:, days] - sums[:, lower]) / counts
+        variance = (squares[:, days] - squares[:, lower]) / counts - mean**2
+    std = np.sqrt(np.clip(variance, 0, None))
+    too_short = counts < min_periods
+    mean[:, too_short] = np.nan
+    std[:, too_short] = np.nan
+    return mean, std
+
+
+def z_scores(matrix: "np.ndarray", mean: "np.ndarray", std: "np.ndarray") -> "np.ndarray":
+    """Z-score of every day against its rolling baseline; flat baselines give 0 unless the day departs from them,
+    and an infinite score of the departure's sign if it does.
+
+    A baseline of days without any logged weight has nothing to depart from, so its days get NaN like days
+    without enough history.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = (matrix - mean) / std
+    flat = std == 0
+    departure = matrix[flat] - mean[flat]
+    flat_scores = np.zeros_like(departure)
+    moved = departure != 0
+    flat_scores[moved] = np.copysign(np.inf, departure[moved])
+    flat_scores[mean[flat] == 0] = np.nan
+    scores[flat] = flat_scores
+    return scores
+
+
+def percentiles(matrix: "np.ndarray", q: Sequence[float] = PERCENTILES) -> "np.ndarray":
+    """Per-row percentiles, shaped rows x len(q)."""
+    return np.percentile(matrix, q, axis=1).T
+
+
+def detect_outliers(
+    users: "np.ndarray", matrix: "np.ndarray", start: date, window: int, threshold: float, min_periods: int
+) -> Dict[str, list]:
+    """Flag the days whose total is more than `threshold` rolling standard deviations above the baseline."""
+    mean, std = rolling_mean_std(matrix, window, min_periods)
+    scores = z_scores(matrix, mean, std)
+    user_rows, day_offsets = np.nonzero(np.nan_to_num(scores, nan=0.0) > threshold)
+
+    summary = percentiles(matrix)
+    return {
+        "users": [
+            {
+                "user_id": int(user_id),
+                "mean": float(row_mean),
+                "std": float(row_std),
+                **{f"p{q}": float(value) for q, value in zip(PERCENTILES, row_percentiles)},
+            }
+            for user_id, row_mean, row_std, row_percentiles in zip(
+                users, matrix.mean(axis=1), matrix.std(axis=1), summary
+            )
+        ],
+        "outliers": _outlier_rows(users, matrix, mean, scores, start, user_rows, day_offsets),
+    }
+
+
+def _outlier_rows(users, matrix, mean, scores, start: date, user_rows, day_offsets) -> List[dict]:
+    return [
+        {
+            "user_id": int(users[row]),
+            "day": (start + timedelta(days=int(offset))).isoformat(),
+            "total_weight": float(matrix[row, offset]),
+            "rolling_mean": float(mean[row, offset]),
+            "z_score": float(scores[row, offset]) if np.isfinite(scores[row, offset]) else None,
+        }
+        for row, offset in zip(user_rows, day_offsets)
+    ]
@@ -1,14 +1,39 @@
 from __future__ import annotations
 
-import json
+import asyncio
 import logging
 import os
+import random
+import time
+import uuid
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from dataclasses import dataclass
+from functools import wraps
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
 import redis.asyncio as redis
 from dotenv import load_dotenv
 
+from app.utils import codecs
+from app.utils.cache_metrics import CacheMetrics
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.local_cache import LocalCache
+
 logger = logging.getLogger(__name__)
 load_dotenv()
 
@@ -17,30 +42,935 @@ PORT = os.getenv("REDIS_PORT")
 DB = os.getenv("REDIS_DB")
 
 
-pool = redis.ConnectionPool(host=HOST, port=PORT, db=DB, protocol=3)
+# Every key starts with the schema version and codec, so a deployment that changes either reads from a fresh
+# keyspace instead of decoding blobs in the old format; the old keys are left to expire or be evicted.
+# Bump SCHEMA_VERSION whenever the shape of a cached value changes.
+SCHEMA_VERSION = 1
+encoder = codecs.ValueEncoder(
+    codecs.get_codec(os.getenv("CACHE_CODEC", "json")),
+    codecs.get_compressor(os.getenv("CACHE_COMPRESSION", "none")),
+    int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024")),
+)
+KEY_PREFIX = f"v{SCHEMA_VERSION}:{encoder.codec.name}:"
+# State written with set_durable is not a copy of the database that a fresh keyspace can rebuild, so it keeps this
+# prefix and plain JSON whatever the version and codec; its values must stay readable by every release.
+DURABLE_PREFIX = "durable:"
+durable_encoder = codecs.ValueEncoder(codecs.get_codec("json"))
+
+# how long one replica may hold a key's load lock, and how often the others check on it meanwhile
+LOAD_LOCK_MS = int(os.getenv("CACHE_LOAD_LOCK_MS", "3000"))
+LOAD_POLL_MS = int(os.getenv("CACHE_LOAD_POLL_MS", "25"))
+
+# Commands that take longer than CACHE_TIMEOUT_MS fail, and CACHE_BREAKER_FAILURES failures in a row open the
+# circuit breaker: the cache then reads as empty and skips writes until a probe finds Redis back
+OPERATION_TIMEOUT_MS = int(os.getenv("CACHE_TIMEOUT_MS", "500"))
+BREAKER_FAILURES = int(os.getenv("CACHE_BREAKER_FAILURES", "5"))
+BREAKER_PROBE_SECONDS = float(os.getenv("CACHE_BREAKER_PROBE_SECONDS", "2"))
+# keys whose writes were skipped, remembered to be deleted once Redis answers; past that the TTLs bound staleness
+STALE_KEYS_MAX = int(os.getenv("CACHE_STALE_KEYS_MAX", "100000"))
+
+# entries kept in process memory in front of Redis, 0 turns the local cache off
+LOCAL_CACHE_SIZE = int(os.getenv("CACHE_LOCAL_SIZE", "0"))
+LOCAL_CACHE_PREFIXES = tuple(prefix for prefix in os.getenv("CACHE_LOCAL_PREFIXES", "user:,team:").split(",") if prefix)
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """Expiry of a key family: `ttl` seconds plus up to `jitter` of it at random, so keys written together do not
+    expire together. Families with `write_on_create` unset are only cached once they are read."""
+
+    ttl: Optional[int]
+    jitter: float = 0.1
+    write_on_create: bool = True
+
+    def expiry(self) -> Optional[int]:
+        if self.ttl is None:
+            return None
+        return self.ttl + int(random.uniform(0, self.ttl * self.jitter))
+
+
+DAY = 24 * 60 * 60
+DEFAULT_POLICY = CachePolicy(ttl=int(os.getenv("CACHE_DEFAULT_TTL", "3600")))
+# Keyed by the prefix of the family's logical keys. In-place updates of collections keep the collection's TTL,
+# which bounds how long a missed update can stay visible.
+POLICIES: Dict[str, CachePolicy] = {
+    "user:": CachePolicy(ttl=DAY),
+    "user_by_username:": CachePolicy(ttl=DAY),
+    "team:": CachePolicy(ttl=DAY),
+    "all_teams": CachePolicy(ttl=60 * 60),
+    "users_by_team_id:": CachePolicy(ttl=60 * 60),
+    # single entries are rarely read after their creation
+    "waste:": CachePolicy(ttl=10 * 60, jitter=0.2, write_on_create=False),
+    "waste_by_user_id:": CachePolicy(ttl=60 * 60, jitter=0.2),
+    "waste_aggregate_by_": CachePolicy(ttl=15 * 60, jitter=0.2),
+    "waste_summary_by_team_id:": CachePolicy(ttl=15 * 60, jitter=0.2),
+    # written with set_durable, so the TTL is enforced by purge_expired rather than Redis
+    "waste_import_job:": CachePolicy(ttl=7 * DAY, jitter=0),
+}
+
+# Redis is configured to evict only keys with a TTL (volatile-lru), which cache keys always have. Import jobs and
+# the responses of idempotent requests are state rather than copies of the database, so they are written without
+# a TTL, and their expiry is kept in this sorted set for purge_expired to delete them once it has passed.
+DURABLE_EXPIRY_KEY = "expiry"
+# where releases that kept durable state under KEY_PREFIX recorded its expiry, drained by purge_expired
+LEGACY_DURABLE_EXPIRY_KEY = "durable_expiry"
+PURGE_INTERVAL_SECONDS = float(os.getenv("CACHE_PURGE_INTERVAL_SECONDS", "60"))
+PURGE_BATCH_SIZE = 1000
+
+
+# Lookups that find nothing are cached as an empty value for a short while, so unknown ids cost one Redis read
+# instead of a database query each. Creates overwrite or delete the key, so a tombstone never hides a new row.
+NEGATIVE_TTL = int(os.getenv("CACHE_NEGATIVE_TTL", "30"))
+
+
+def set_policy(family: str, policy: CachePolicy) -> None:
+    POLICIES[family] = policy
+
+
+def family_of(key: str) -> Optional[str]:
+    """The registered family `key` belongs to, the longest matching prefix."""
+    matches: List[str] = [family for family in POLICIES if key.startswith(family)]
+    return max(matches, key=len) if matches else None
+
+
+def family_name(key: str) -> str:
+    """The family `key` is reported under: its registered family, or the text up to its first colon."""
+    return family_of(key) or key.split(":", 1)[0] + ":"
+
+
+def policy_for(key: str) -> CachePolicy:
+    family = family_of(key)
+    return POLICIES[family] if family is not None else DEFAULT_POLICY
+
+
+def _apply_ttl_overrides(overrides: str) -> None:
+    # CACHE_TTL_OVERRIDES="waste:=300,user:=86400"
+    for override in filter(None, overrides.split(",")):
+        family, _, ttl = override.rpartition("=")
+        if int(ttl) <= 0:
+            # Redis never evicts a key without a TTL, so cache keys always get one
+            raise ValueError(f"Cache TTL override for {family} must be positive, got {ttl}")
+        policy = POLICIES.get(family, DEFAULT_POLICY)
+        POLICIES[family] = CachePolicy(int(ttl), policy.jitter, policy.write_on_create)
+
+
+_apply_ttl_overrides(os.getenv("CACHE_TTL_OVERRIDES", ""))
+
+pool = redis.ConnectionPool(
+    host=HOST,
+    port=PORT,
+    db=DB,
+    protocol=3,
+    socket_timeout=OPERATION_TIMEOUT_MS / 1000,
+    socket_connect_timeout=OPERATION_TIMEOUT_MS / 1000,
+)
+local_cache = LocalCache(LOCAL_CACHE_SIZE, tuple(KEY_PREFIX + prefix for prefix in LOCAL_CACHE_PREFIXES))
+metrics = CacheMetrics()
+
+T = TypeVar("T")
+# loads running in this process, by cache key
+_loads: Dict[str, asyncio.Future] = {}
+# Redis keys, and key patterns, that may hold values older than the database because writes to them were skipped
+_stale_keys: Set[str] = set()
+_stale_patterns: Set[str] = set()
+_invalidation: Optional[asyncio.Task] = None
+
+
+class CacheUnavailableError(redis.ConnectionError):
+    """Redis did not answer in time, or the circuit breaker is open."""
+
+
+# Collections are cached as hashes and sorted sets that writes update in place. The updates only apply to
+# collections that are already cached, since adding to a missing key would cache a partial collection, and they
+# drop keys of the wrong type left behind by older releases.
+UPDATE_HASH_IF_CACHED = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+# ARGV[1] caps the size of the set, 0 for no cap, and ARGV[2] is the floor member put in place of what the cap drops
+ADD_TO_SORTED_SET_IF_CACHED = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'zset' then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+for i = 3, #ARGV, 1000 do
+    redis.call('ZADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if tonumber(ARGV[1]) > 0 and excess > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, excess - 1)
+    local lowest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    redis.call('ZADD', KEYS[1], lowest[2], ARGV[2])
+end
+return 1
+"""
+# Deletes the durable keys whose expiry has passed, except those written again with a TTL meanwhile, which are
+# cache values now
+PURGE_EXPIRED = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, key in ipairs(expired) do
+    if redis.call('TTL', key) == -1 then
+        redis.call('DEL', key)
+    end
+    redis.call('ZREM', KEYS[1], key)
+end
+return #expired
+"""
+# Stores ARGV[1] under KEYS[1] without a TTL if nothing is stored there, and records its expiry ARGV[2] in KEYS[2]
+SET_DURABLE_IF_MISSING = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX') then
+    redis.call('ZADD', KEYS[2], ARGV[2], KEYS[1])
+    return 1
+end
+return 0
+"""
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+REMOVE_FROM_HASH = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    return redis.call('DEL', KEYS[1])
+end
+return redis.call('HDEL', KEYS[1], ARGV[1])
+"""
+REMOVE_FROM_SORTED_SET = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'zset' then
+    return redis.call('DEL', KEYS[1])
+end
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])) do
+    if string.sub(member, 1, #ARGV[2]) == ARGV[2] then
+        redis.call('ZREM', KEYS[1], member)
+    end
+end
+return 1
+"""
+
+
+async def _probe() -> None:
+    # the breaker stays open until this returns, so the stale keys are gone before anyone reads again
+    async with redis.Redis(connection_pool=pool) as cache:
+        await cache.ping()
+        await _invalidate_stale(cache)
+
+
+breaker = CircuitBreaker("redis", BREAKER_FAILURES, BREAKER_PROBE_SECONDS, _probe)
+
+
+def available() -> bool:
+    return breaker.allow()
+
+
+def require_available() -> None:
+    """For callers that keep state in Redis rather than cache it, and cannot carry on without it."""
+    if not available():
+        raise CacheUnavailableError("The cache is unavailable")
+
+
+def breaker_stats() -> dict:
+    return {**breaker.stats(), "stale_keys": len(_stale_keys), "stale_patterns": len(_stale_patterns)}
+
+
+@asynccontextmanager
+async def _guarded() -> AsyncIterator[None]:
+    if not breaker.allow():
+        raise CacheUnavailableError("The Redis circuit breaker is open")
+    try:
+        yield
+    except CacheUnavailableError:
+        raise
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        breaker.record_failure()
+        raise CacheUnavailableError(str(e)) from e
+    breaker.record_success()
 
 
 @asynccontextmanager
 async def get_cache() -> AsyncIterator[redis.Redis]:
+    """A Redis client whose connection and timeout errors count towards the circuit breaker and are raised as
+    CacheUnavailableError; while the breaker is open it fails right away."""
+    async with _guarded():
+        async with redis.Redis(connection_pool=pool) as cache:
+            cache: redis.Redis = cache  # type: ignore
+            yield cache
+
+
+def _mark_stale(key: str) -> None:
+    if len(_stale_keys) >= STALE_KEYS_MAX:
+        logger.error(f"Not tracking stale cache key {key}, {STALE_KEYS_MAX} are tracked already")
+        return
+    _stale_keys.add(key)
+    _schedule_invalidation()
+
+
+def _mark_stale_pattern(pattern: str) -> None:
+    _stale_patterns.add(pattern)
+    _schedule_invalidation()
+
+
+def _schedule_invalidation() -> None:
+    # an open breaker invalidates when its probe succeeds; a failure that did not open it is retried on its own
+    global _invalidation
+    if breaker.allow() and _invalidation is None:
+        _invalidation = asyncio.create_task(_invalidate_later())
+
+
+async def _invalidate_later() -> None:
+    global _invalidation
+    try:
+        await asyncio.sleep(BREAKER_PROBE_SECONDS)
+        if breaker.allow():
+            async with get_cache() as cache:
+                await _invalidate_stale(cache)
+    except CacheUnavailableError as e:
+        logger.warning(f"Could not invalidate stale cache keys yet: {str(e)}")
+    finally:
+        _invalidation = None
+    if _stale_keys or _stale_patterns:
+        _schedule_invalidation()
+
+
+async def _invalidate_stale(cache: redis.Redis) -> None:
+    """Delete the keys whose writes were skipped, including those marked while this runs."""
+    while _stale_keys or _stale_patterns:
+        keys, patterns = list(_stale_keys), list(_stale_patterns)
+        _stale_keys.clear()
+        _stale_patterns.clear()
+        try:
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                await cache.delete(*batch)
+            for pattern in patterns:
+                async for key in cache.scan_iter(match=pattern, count=500):
+                    await cache.delete(key)
+        except BaseException:
+            _stale_keys.update(keys)
+            _stale_patterns.update(patterns)
+            raise
+        logger.info(f"Invalidated {len(keys)} stale cache keys and {len(patterns)} patterns")
+
+
+def _fails_soft(default: Any = None, stale: Optional[Callable[[str], None]] = None):
+    """Make a cache helper taking the key first return `default` while Redis is unavailable instead of raising.
+
+    Reads then miss, so callers fall back to the database, and writes are skipped. A skipped write that should
+    have invalidated a value, like a delete, passes its Redis key, or key pattern, to `stale` so it is deleted once
+    Redis answers again; a skipped fill of a missed read leaves nothing behind to invalidate and passes no `stale`.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(key: str, *args, **kwargs):
+            try:
+                return await func(key, *args, **kwargs)
+            except CacheUnavailableError as e:
+                logger.debug(f"Cache unavailable for {key}: {str(e)}")
+                metrics.record_degraded(family_name(key))
+                if stale is not None:
+                    stale(redis_key(key))
+                return default
+
+        return wrapper
+
+    return decorator
+
+
+def redis_key(key: str) -> str:
+    """The key `key` is stored under in Redis."""
+    return KEY_PREFIX + key
+
+
+def durable_key(key: str) -> str:
+    """The key durable state `key` is stored under in Redis."""
+    return DURABLE_PREFIX + key
+
+
+def _eval(client: redis.Redis | redis.client.Pipeline, script: str, key: str, *args: Union[str, bytes, int]) -> Any:
+    # redis-py annotates script arguments as str, but encodes bytes and numbers like any other command argument
+    return client.eval(script, 1, key, *args)  # type: ignore[arg-type]
+
+
+class CachePipeline:
+    """Cache writes queued on a pipeline and sent to Redis in a single round trip."""
+
+    def __init__(self, pipe: redis.client.Pipeline):
+        self._pipe = pipe
+        # the Redis keys written, to be invalidated if the pipeline cannot be sent
+        self.keys: List[str] = []
+        # (family, "set" or "delete", payload size) of each command queued, recorded once the pipeline is sent
+        self.commands: List[Tuple[str, str, Optional[int]]] = []
+
+    def set_value(self, key: str, value: dict | list[dict], ttl: int | None = None) -> None:
+        ttl = ttl if ttl is not None else policy_for(key).expiry()
+        blob = encoder.encode(value)
+        self.commands.append((family_name(key), "set", len(blob)))
+        key = redis_key(key)
+        local_cache.invalidate(key)
+        self.keys.append(key)
+        self._pipe.set(key, blob, ex=ttl)
+
+    def delete(self, *keys: str) -> None:
+        self.commands += [(family_name(key), "delete", None) for key in keys]
+        keys = tuple(redis_key(key) for key in keys)
+        for key in keys:
+            local_cache.invalidate(key)
+        self.keys += keys
+        if keys:
+            self._pipe.delete(*keys)
+
+    def update_field_if_cached(self, key: str, field: str, value: dict) -> None:
+        blob = encoder.encode(value)
+        self.commands.append((family_name(key), "set", len(blob)))
+        key = redis_key(key)
+        self.keys.append(key)
+        _eval(self._pipe, UPDATE_HASH_IF_CACHED, key, field, blob)
+
+    def delete_field(self, key: str, field: str) -> None:
+        self.commands.append((family_name(key), "delete", None))
+        key = redis_key(key)
+        self.keys.append(key)
+        _eval(self._pipe, REMOVE_FROM_HASH, key, field)
+
+    def add_sorted_if_cached(self, key: str, members: Iterable[Tuple[int, int, dict]], max_size: int = 0) -> None:
+        """Add to the sorted set at `key` if it is cached, and drop its lowest members beyond `max_size`."""
+        family = family_name(key)
+        key = redis_key(key)
+        self.keys.append(key)
+        args: List[Union[str, bytes, int]] = [max_size, SORTED_FLOOR]
+        size = 0
+        for score, member_id, value in members:
+            member = _sorted_member(member_id, value)
+            size += len(member)
+            args += [score, member]
+        self.commands.append((family, "set", size))
+        _eval(self._pipe, ADD_TO_SORTED_SET_IF_CACHED, key, *args)
+
+    def remove_sorted(self, key: str, score: int, member_id: int) -> None:
+        self.commands.append((family_name(key), "delete", None))
+        key = redis_key(key)
+        self.keys.append(key)
+        _eval(self._pipe, REMOVE_FROM_SORTED_SET, key, score, f"{member_id:010d}:")
+
+
+@asynccontextmanager
+async def pipeline(invalidating: bool = True) -> AsyncIterator[CachePipeline]:
+    """Queue cache writes and send them together when the block exits without an error.
+
+    While Redis is unavailable the writes are skipped, and, unless they only fill the cache with what was read
+    from the database, the keys they touch invalidated once it is back.
+    """
     async with redis.Redis(connection_pool=pool) as cache:
-        cache: redis.Redis = cache  # type: ignore
-        yield cache
+        async with cache.pipeline(transaction=False) as pipe:
+            writes = CachePipeline(pipe)
+            yield writes
+            started = time.perf_counter()
+            try:
+                async with _guarded():
+                    await pipe.execute()
+            except CacheUnavailableError as e:
+                logger.warning(f"Skipped cache writes to {len(writes.keys)} keys: {str(e)}")
+                for family, _, _ in writes.commands:
+                    metrics.record_degraded(family)
+                if invalidating:
+                    for key in writes.keys:
+                        _mark_stale(key)
+            else:
+                metrics.record_pipeline(writes.commands, started)
+
 
+async def get_many(keys: List[str]) -> List[dict | list[dict] | None]:
+    """Values of `keys` in order, None for the missing ones, with a single MGET for those not held locally."""
+    started = time.perf_counter()
+    families = [family_name(key) for key in keys]
+    keys = [redis_key(key) for key in keys]
+    values: List[dict | list[dict] | None] = [local_cache.get(key) for key in keys]
+    missing = [i for i, value in enumerate(values) if value is None]
+    for i in set(range(len(keys))) - set(missing):
+        metrics.record_get(families[i], "get_many", started, hit=True, local=True)
+    if not missing:
+        return values
+    tokens = {i: local_cache.begin_fill(keys[i]) for i in missing}
+    try:
+        try:
+            async with get_cache() as cache:
+                found = await cache.mget([keys[i] for i in missing])
+        except CacheUnavailableError:
+            for i in missing:
+                metrics.record_degraded(families[i])
+            return values
+        for i, value in zip(missing, found):
+            metrics.record_get(
+                families[i], "get_many", started, hit=value is not None, size=len(value) if value is not None else None
+            )
+            if value is not None:
+                values[i] = encoder.decode(value)
+        return values
+    finally:
+        for i, token in tokens.items():
+            local_cache.finish_fill(keys[i], token, values[i])
 
-async def set_value(key: str, value: dict | list[dict]):
+
+async def set_many(values: Mapping[str, dict | list[dict]], ttl: int | None = None) -> None:
+    """Fill the cache with `values` read from the database."""
+    async with pipeline(invalidating=False) as writes:
+        for key, value in values.items():
+            writes.set_value(key, value, ttl)
+
+
+async def delete_many(keys: Iterable[str]) -> None:
+    async with pipeline() as writes:
+        writes.delete(*keys)
+
+
+async def start_local_cache() -> None:
+    await local_cache.start(host=HOST, port=PORT, db=DB)
+
+
+async def stop_local_cache() -> None:
+    await local_cache.stop()
+
+
+@_fails_soft(default=False)
+async def set_value(key: str, value: dict | list[dict], ttl: int | None = None, only_if_missing: bool = False) -> bool:
+    """Cache `value` under `key` for `ttl` seconds, or for as long as the key's family policy says."""
+    started = time.perf_counter()
+    family = family_name(key)
+    ttl = ttl if ttl is not None else policy_for(key).expiry()
+    key = redis_key(key)
+    blob = encoder.encode(value)
+    # this process sees its own writes right away, the other replicas once Redis tells them
+    local_cache.invalidate(key)
     async with get_cache() as cache:
-        json_value = json.dumps(value)
-        await cache.set(key, json_value.encode("utf-8"))
+        stored = bool(await cache.set(key, blob, ex=ttl, nx=only_if_missing))
+    metrics.record_set(family, "set", started, len(blob))
+    return stored
 
 
-async def get_value(key: str) -> dict | list[dict] | None:
+@_fails_soft(default=False)
+async def set_durable(key: str, value: dict | list[dict], ttl: int | None = None) -> bool:
+    """Store `value` under `key` without a Redis TTL, so it is never evicted, until `purge_expired` deletes it `ttl`
+    seconds from now, or as long as the key's family policy says."""
+    started = time.perf_counter()
+    family = family_name(key)
+    ttl = ttl if ttl is not None else policy_for(key).expiry()
+    key = durable_key(key)
+    blob = durable_encoder.encode(value)
     async with get_cache() as cache:
-        value = await cache.get(key)
+        async with cache.pipeline(transaction=True) as pipe:
+            pipe.set(key, blob)
+            if ttl is not None:
+                pipe.zadd(durable_key(DURABLE_EXPIRY_KEY), {key: time.time() + ttl})
+            await pipe.execute()
+    metrics.record_set(family, "set_durable", started, len(blob))
+    return True
+
+
+@_fails_soft(default=False)
+async def set_durable_if_missing(key: str, value: dict | list[dict], ttl: int) -> bool:
+    """Like `set_durable`, but only if nothing is stored under `key`; returns whether `value` was stored."""
+    started = time.perf_counter()
+    family = family_name(key)
+    key = durable_key(key)
+    blob = durable_encoder.encode(value)
+    async with get_cache() as cache:
+        # redis-py annotates script arguments as str, but encodes bytes and numbers like any other command argument
+        args: List[Any] = [key, durable_key(DURABLE_EXPIRY_KEY), blob, time.time() + ttl]
+        stored = await cast(Awaitable[int], cache.eval(SET_DURABLE_IF_MISSING, 2, *args))
+    metrics.record_set(family, "set_durable", started, len(blob))
+    return bool(stored)
+
+
+@_fails_soft(default=False)
+async def extend_durable(key: str, ttl: int) -> bool:
+    """Move the expiry of the durable value at `key` to `ttl` seconds from now, if it has one."""
+    async with get_cache() as cache:
+        expiry = {durable_key(key): time.time() + ttl}
+        changed = await cache.zadd(durable_key(DURABLE_EXPIRY_KEY), expiry, xx=True, ch=True)
+    return bool(changed)
+
+
+@_fails_soft()
+async def get_durable(key: str) -> dict | list[dict] | None:
+    started = time.perf_counter()
+    family = family_name(key)
+    async with get_cache() as cache:
+        value = await cache.get(durable_key(key))
+    metrics.record_get(family, "get_durable", started, hit=value is not None, size=len(value) if value else None)
+    return durable_encoder.decode(value) if value is not None else None
+
+
+@_fails_soft()
+async def delete_durable(key: str) -> None:
+    started = time.perf_counter()
+    family = family_name(key)
+    async with get_cache() as cache:
+        async with cache.pipeline(transaction=True) as pipe:
+            pipe.delete(durable_key(key))
+            pipe.zrem(durable_key(DURABLE_EXPIRY_KEY), durable_key(key))
+            await pipe.execute()
+    metrics.record_delete(family, started)
+
+
+async def purge_expired() -> int:
+    """Delete the durable keys whose expiry has passed, and return how many expired."""
+    purged = 0
+    async with get_cache() as cache:
+        for expiry_key in (durable_key(DURABLE_EXPIRY_KEY), redis_key(LEGACY_DURABLE_EXPIRY_KEY)):
+            while True:
+                expired = await _eval(cache, PURGE_EXPIRED, expiry_key, int(time.time()), PURGE_BATCH_SIZE)
+                purged += expired
+                if expired < PURGE_BATCH_SIZE:
+                    break
+    return purged
+
+
+async def purge_expired_periodically() -> None:
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+        try:
+            purged = await purge_expired()
+        except Exception as e:
+            # the keys are purged on a later run, once Redis answers again
+            logger.warning(f"Could not purge expired durable keys: {str(e)}")
+            continue
+        if purged:
+            logger.info(f"Purged {purged} expired durable keys")
+
+
+async def set_missing(key: str) -> bool:
+    """Cache that nothing exists under `key`; a value that was cached meanwhile is kept."""
+    return await set_value(key, {}, ttl=NEGATIVE_TTL, only_if_missing=True)
+
+
+@_fails_soft()
+async def get_value(key: str) -> dict | list[dict] | None:
+    started = time.perf_counter()
+    family = family_name(key)
+    key = redis_key(key)
+    cached = local_cache.get(key)
+    if cached is not None:
+        metrics.record_get(family, "get", started, hit=True, local=True)
+        return cached
+    token = local_cache.begin_fill(key)
+    decoded = None
+    try:
+        async with get_cache() as cache:
+            value = await cache.get(key)
+        metrics.record_get(
+            family, "get", started, hit=value is not None, size=len(value) if value is not None else None
+        )
         if value is not None:
-            return json.loads(value.decode("utf-8"))
-        return None
+            decoded = encoder.decode(value)
+        return decoded
+    finally:
+        local_cache.finish_fill(key, token, decoded)
 
 
+@_fails_soft(stale=_mark_stale)
 async def delete_key(key: str):
+    started = time.perf_counter()
+    family = family_name(key)
+    key = redis_key(key)
+    local_cache.invalidate(key)
     async with get_cache() as cache:
         await cache.delete(key)
+    metrics.record_delete(family, started)
+
+
+@_fails_soft()
+async def set_field(key: str, field: str, value: dict | list[dict]):
+    started = time.perf_counter()
+    family = family_name(key)
+    ttl = policy_for(key).expiry()
+    key = redis_key(key)
+    blob = encoder.encode(value)
+    async with get_cache() as cache:
+        async with cache.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={field: blob})
+            if ttl is not None:
+                pipe.expire(key, ttl)
+            await pipe.execute()
+    metrics.record_set(family, "set_field", started, len(blob))
+
+
+@_fails_soft()
+async def get_field(key: str, field: str) -> dict | list[dict] | None:
+    started = time.perf_counter()
+    family = family_name(key)
+    key = redis_key(key)
+    async with get_cache() as cache:
+        try:
+            value = await cast(Awaitable[Optional[bytes]], cache.hget(key, field))
+        except redis.ResponseError as e:
+            # a blob written by an older release under the same key
+            logger.warning(f"Discarding cache key {key}: {str(e)}")
+            await cache.delete(key)
+            return None
+        metrics.record_get(
+            family, "get_field", started, hit=value is not None, size=len(value) if value is not None else None
+        )
+        if value is not None:
+            return encoder.decode(value)
+        return None
+
+
+@_fails_soft(default=0, stale=_mark_stale_pattern)
+async def delete_matching(pattern: str) -> int:
+    """Delete every key matching `pattern`, walking the keyspace with SCAN so Redis is never blocked."""
+    pattern = redis_key(pattern)
+    deleted = 0
+    async with get_cache() as cache:
+        async for key in cache.scan_iter(match=pattern, count=500):
+            deleted += await cache.delete(key)
+    return deleted
+
+
+@_fails_soft()
+async def set_fields(key: str, values: Dict[str, dict]) -> None:
+    """Replace the hash at `key` with `values`."""
+    started = time.perf_counter()
+    family = family_name(key)
+    ttl = policy_for(key).expiry()
+    key = redis_key(key)
+    blobs = {field: encoder.encode(value) for field, value in values.items()}
+    async with get_cache() as cache:
+        async with cache.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=blobs)
+            if ttl is not None:
+                pipe.expire(key, ttl)
+            await pipe.execute()
+    metrics.record_set(family, "set_fields", started, sum(len(blob) for blob in blobs.values()))
+
+
+@_fails_soft()
+async def get_fields(key: str) -> Dict[str, dict] | None:
+    """Every field of the hash at `key`, or None if it is not cached."""
+    started = time.perf_counter()
+    family = family_name(key)
+    key = redis_key(key)
+    async with get_cache() as cache:
+        try:
+            values = await cast(Awaitable[Dict[bytes, bytes]], cache.hgetall(key))
+        except redis.ResponseError as e:
+            logger.warning(f"Discarding cache key {key}: {str(e)}")
+            await cache.delete(key)
+            return None
+        metrics.record_get(
+            family, "get_fields", started, hit=bool(values), size=sum(len(value) for value in values.values()) or None
+        )
+        if not values:
+            return None
+        return {field.decode("utf-8"): encoder.decode(value) for field, value in values.items()}
+
+
+# Sorted set members are "<zero padded id>:<encoded value>", so members with the same score order by id
+def _sorted_member(member_id: int, value: dict) -> bytes:
+    return f"{member_id:010d}:".encode("utf-8") + encoder.encode(value)
+
+
+# Marks a sorted set that holds only the highest scored members of a collection. It takes id 0 and the lowest
+# score cached, so it ranks below every member cached and above every member left out. Redis drops empty sorted
+# sets, so an empty collection is cached as a floor at -inf, which leaves nothing out.
+SORTED_FLOOR = f"{0:010d}:".encode("utf-8")
+
+
+def _sorted_value(member: bytes) -> dict:
+    return encoder.decode(member[11:])
+
+
+@_fails_soft()
+async def set_sorted(key: str, members: Iterable[Tuple[int, int, dict]], complete: bool = True) -> None:
+    """Replace the sorted set at `key` with the given (score, id, value) members.
+
+    `complete` is false when the members are only the highest scored of a collection; reads then report when they
+    reach the lowest member cached.
+    """
+    started = time.perf_counter()
+    family = family_name(key)
+    ttl = policy_for(key).expiry()
+    key = redis_key(key)
+    scores: Dict[bytes, float] = {_sorted_member(member_id, value): score for score, member_id, value in members}
+    if not complete:
+        scores[SORTED_FLOOR] = min(scores.values(), default=float("inf"))
+    elif not scores:
+        scores[SORTED_FLOOR] = float("-inf")
+    async with get_cache() as cache:
+        async with cache.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.zadd(key, scores)
+            if ttl is not None:
+                pipe.expire(key, ttl)
+            await pipe.execute()
+    metrics.record_set(family, "set_sorted", started, sum(len(member) for member in scores))
+
+
+@_fails_soft()
+async def get_sorted_desc(
+    key: str, max_score: int | str, min_score: int | str, offset: int = 0, count: Optional[int] = None
+) -> Tuple[List[dict], bool] | None:
+    """Values scored between `max_score` and `min_score`, highest first, or None if `key` is not cached.
+
+    Scores take Redis range syntax, so "(100" excludes 100. The flag is true when the values stop at the lowest
+    member of a set cached incomplete, or the range lies wholly below it, past which the collection may hold more
+    in the range.
+    """
+    started = time.perf_counter()
+    family = family_name(key)
+    key = redis_key(key)
+    async with get_cache() as cache:
+        try:
+            async with cache.pipeline(transaction=True) as pipe:
+                pipe.exists(key)
+                pipe.zscore(key, SORTED_FLOOR)
+                if count is None:
+                    pipe.zrevrangebyscore(key, max_score, min_score)
+                else:
+                    pipe.zrevrangebyscore(key, max_score, min_score, start=offset, num=count)
+                exists, floor_score, members = await pipe.execute()
+        except redis.ResponseError as e:
+            logger.warning(f"Discarding cache key {key}: {str(e)}")
+            await cache.delete(key)
+            return None
+        metrics.record_get(
+            family, "get_sorted", started, hit=bool(exists), size=sum(len(member) for member in members) or None
+        )
+        if not exists:
+            return None
+        if floor_score is not None and _below(max_score, floor_score):
+            return [], True
+        values: List[dict] = []
+        for member in members:
+            if member == SORTED_FLOOR:
+                return values, floor_score != float("-inf")
+            values.append(_sorted_value(member))
+        return values, False
+
+
+def _below(max_score: int | str, score: float) -> bool:
+    """Whether every score up to `max_score`, in Redis range syntax, is lower than `score`."""
+    bound = str(max_score)
+    if bound.startswith("("):
+        return float(bound[1:]) <= score
+    return float(bound) < score
+
+
+async def single_flight(key: str, load: Callable[[], Awaitable[T]], lookup: Callable[[], Awaitable[Optional[T]]]) -> T:
+    """Run `load` for a missed cache `key` once, however many requests miss it at the same time.
+
+    Concurrent callers in this process share the running load. Across replicas a short Redis lock elects one
+    loader; the other replicas poll `lookup` until it finds what that loader cached, and only load themselves
+    once the lock is gone or has expired without the key being filled. `load` is expected to fill the cache.
+    """
+    running = _loads.get(key)
+    if running is not None:
+        try:
+            return await asyncio.shield(running)
+        except asyncio.CancelledError:
+            if not running.cancelled():
+                raise
+            # the request that was loading went away, so this one takes over
+            return await single_flight(key, load, lookup)
+
+    future = asyncio.get_running_loop().create_future()
+    _loads[key] = future
+    try:
+        result = await _load_once_across_replicas(key, load, lookup)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # the waiters re-raise it; nobody waiting is not an error
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del _loads[key]
+
+
+async def _load_once_across_replicas(
+    key: str, load: Callable[[], Awaitable[T]], lookup: Callable[[], Awaitable[Optional[T]]]
+) -> T:
+    lock_key = redis_key(f"lock:{key}")
+    token = uuid.uuid4().hex
+    try:
+        async with get_cache() as cache:
+            acquired = await cache.set(lock_key, token, px=LOAD_LOCK_MS, nx=True)
+    except CacheUnavailableError:
+        # no lock to share and nothing to wait for, every replica loads for itself
+        return await _timed_load(key, load)
+    if acquired:
+        try:
+            return await _timed_load(key, load)
+        finally:
+            try:
+                async with get_cache() as cache:
+                    await _eval(cache, RELEASE_LOCK, lock_key, token)
+            except CacheUnavailableError:
+                pass  # the lock expires on its own
+
+    deadline = asyncio.get_running_loop().time() + LOAD_LOCK_MS / 1000
+    while asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(LOAD_POLL_MS / 1000)
+        try:
+            async with get_cache() as cache:
+                locked = await cache.exists(lock_key)
+        except CacheUnavailableError:
+            break
+        result = await lookup()
+        if result is not None:
+            return result
+        if not locked:
+            break
+    logger.debug(f"Loading {key} after waiting on another replica")
+    return await _timed_load(key, load)
+
+
+async def _timed_load(key: str, load: Callable[[], Awaitable[T]]) -> T:
+    started = time.perf_counter()
+    try:
+        return await load()
+    finally:
+        metrics.record_load(family_name(key), started)
+
+
+async def memory_report(batch_size: int = 500) -> Dict[str, dict]:
+    """Keys, bytes and keys without an expiry per key family, walking this deployment's keyspace and the durable
+    state with SCAN.
+
+    Keys outside the registered families are grouped by the text up to their first colon.
+    """
+    report: Dict[str, dict] = {}
+
+    async def measure(cache: redis.Redis, keys: List[bytes]) -> None:
+        async with cache.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.memory_usage(key)
+                pipe.ttl(key)
+            results = await pipe.execute()
+        for key, size, ttl in zip(keys, results[::2], results[1::2]):
+            family = family_name(key.decode("utf-8").removeprefix(KEY_PREFIX).removeprefix(DURABLE_PREFIX))
+            totals = report.setdefault(family, {"keys": 0, "bytes": 0, "no_expiry": 0})
+            totals["keys"] += 1
+            totals["bytes"] += size or 0
+            totals["no_expiry"] += ttl == -1
+
+    async with get_cache() as cache:
+        for prefix in (KEY_PREFIX, DURABLE_PREFIX):
+            keys: List[bytes] = []
+            async for key in cache.scan_iter(match=f"{prefix}*", count=batch_size):
+                keys.append(key)
+                if len(keys) >= batch_size:
+                    await measure(cache, keys)
+                    keys = []
+            if keys:
+                await measure(cache, keys)
+    return dict(sorted(report.items(), key=lambda item: -item[1]["bytes"]))
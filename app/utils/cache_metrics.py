@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Sequence, Tuple
+
+# upper bounds of the histogram buckets; values above the last one land in an overflow bucket
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288)
+
+
+class Histogram:
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def stats(self) -> dict:
+        labels = [str(bound) for bound in self.bounds] + ["inf"]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            # counts of the values up to each bound and above the previous one
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class FamilyMetrics:
+    """Counters of the cache operations on one key family."""
+
+    def __init__(self):
+        self.hits = 0
+        self.local_hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.deletes = 0
+        self.loads = 0
+        # operations that found Redis unavailable and were skipped
+        self.degraded = 0
+        self.latency_ms: Dict[str, Histogram] = {}
+        self.payload_bytes = Histogram(SIZE_BUCKETS)
+
+    def observe_latency(self, operation: str, started: float) -> None:
+        histogram = self.latency_ms.get(operation)
+        if histogram is None:
+            histogram = self.latency_ms[operation] = Histogram(LATENCY_BUCKETS_MS)
+        histogram.observe((time.perf_counter() - started) * 1000)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "local_hits": self.local_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "sets": self.sets,
+            "deletes": self.deletes,
+            "loads": self.loads,
+            "degraded": self.degraded,
+            "latency_ms": {operation: histogram.stats() for operation, histogram in sorted(self.latency_ms.items())},
+            "payload_bytes": self.payload_bytes.stats(),
+        }
+
+
+class CacheMetrics:
+    """Hits, misses, latencies and payload sizes of the cache per key family, plus the time spent loading what
+    was missed. Operations pass `time.perf_counter()` from before they started."""
+
+    def __init__(self):
+        self.families: Dict[str, FamilyMetrics] = {}
+
+    def family(self, name: str) -> FamilyMetrics:
+        metrics = self.families.get(name)
+        if metrics is None:
+            metrics = self.families[name] = FamilyMetrics()
+        return metrics
+
+    def record_get(
+        self, family: str, operation: str, started: float, hit: bool, size: Optional[int] = None, local: bool = False
+    ) -> None:
+        metrics = self.family(family)
+        if hit:
+            metrics.hits += 1
+            metrics.local_hits += local
+        else:
+            metrics.misses += 1
+        if size is not None:
+            metrics.payload_bytes.observe(size)
+        # values served from process memory would drown out the Redis round trips
+        if not local:
+            metrics.observe_latency(operation, started)
+
+    def record_set(self, family: str, operation: str, started: float, size: int) -> None:
+        metrics = self.family(family)
+        metrics.sets += 1
+        metrics.payload_bytes.observe(size)
+        metrics.observe_latency(operation, started)
+
+    def record_pipeline(self, commands: Sequence[Tuple[str, str, Optional[int]]], started: float) -> None:
+        """Count the (family, "set" or "delete", payload size) commands of a pipeline, and the latency of its round
+        trip once per family touched."""
+        for family, kind, size in commands:
+            metrics = self.family(family)
+            if kind == "delete":
+                metrics.deletes += 1
+            else:
+                metrics.sets += 1
+            if size is not None:
+                metrics.payload_bytes.observe(size)
+        for family in {family for family, _, _ in commands}:
+            self.family(family).observe_latency("pipeline", started)
+
+    def record_delete(self, family: str, started: float) -> None:
+        metrics = self.family(family)
+        metrics.deletes += 1
+        metrics.observe_latency("delete", started)
+
+    def record_load(self, family: str, started: float) -> None:
+        metrics = self.family(family)
+        metrics.loads += 1
+        metrics.observe_latency("load", started)
+
+    def record_degraded(self, family: str) -> None:
+        self.family(family).degraded += 1
+
+    def stats(self) -> dict:
+        return {name: metrics.stats() for name, metrics in sorted(self.families.items())}
+
+    def reset(self) -> None:
+        self.families.clear()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+
+
+class CircuitBreaker:
+    """Stops calling a dependency after `failure_threshold` failures in a row.
+
+    While open, `allow` is false so callers fail fast, and `probe` runs every `probe_interval` seconds in the
+    background. The breaker closes once a probe returns without raising; the probe is also where anything owed
+    to the dependency is caught up on, since no caller can reach it before the breaker closes.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, probe_interval: float, probe: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._prober: Optional[asyncio.Task] = None
+
+    def allow(self) -> bool:
+        return self.state == CLOSED
+
+    def record_success(self) -> None:
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == CLOSED and self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened += 1
+            logger.warning(f"Circuit {self.name} opened after {self.failures} failures")
+            self._prober = asyncio.create_task(self._probe_until_recovered())
+
+    async def _probe_until_recovered(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            try:
+                await self.probe()
+            except Exception as e:
+                logger.info(f"Circuit {self.name} stays open: {str(e)}")
+                continue
+            # nothing is awaited between the probe and closing, so no caller slips in before the catch-up is done
+            self.state = CLOSED
+            self.failures = 0
+            self._prober = None
+            logger.info(f"Circuit {self.name} closed")
+            return
+
+    async def stop(self) -> None:
+        if self._prober is not None:
+            self._prober.cancel()
+            try:
+                await self._prober
+            except asyncio.CancelledError:
+                pass
+            self._prober = None
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "opened": self.opened}
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, Generic, List, Optional, Set, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class WriteCoalescer(Generic[T, R]):
+    """Collects items submitted concurrently and flushes them together.
+
+    A flush happens when `window` seconds have passed since the first pending item arrived or as soon as
+    `max_batch_size` items are pending. `flush` receives the items in submission order and must return one
+    result per item, in the same order; each submitter gets its own result back.
+
+    If a flush of several items fails, each item is flushed again on its own, so `flush` must be all-or-nothing:
+    work that follows a successful write, such as updating a cache, goes into `after_flush` instead. It receives
+    the results that were written, before the submitters are answered, and its errors are logged and not retried.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[T]], Awaitable[List[R]]],
+        window: float,
+        max_batch_size: int,
+        after_flush: Optional[Callable[[List[R]], Awaitable[None]]] = None,
+    ):
+        self._flush = flush
+        self._after_flush = after_flush
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.flush_count = 0
+        self.row_count = 0
+        self.batch_sizes: Counter[int] = Counter()
+
+    async def submit(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[T, asyncio.Future]]):
+        self.flush_count += 1
+        self.row_count += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        logger.info(f"Flushing {len(batch)} coalesced writes")
+        written: List[R] = []
+        failed: List[Tuple[asyncio.Future, Exception]] = []
+        answered: List[asyncio.Future] = []
+        try:
+            results = await self._flush([item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                failed.append((batch[0][1], e))
+            else:
+                # one bad item must not fail the unrelated writes it shared a batch with
+                logger.warning(f"Coalesced flush of {len(batch)} writes failed, retrying one by one: {str(e)}")
+                for item, future in batch:
+                    try:
+                        (result,) = await self._flush([item])
+                    except Exception as item_error:
+                        failed.append((future, item_error))
+                    else:
+                        written.append(result)
+                        answered.append(future)
+        else:
+            written = results
+            answered = [future for _, future in batch]
+
+        if self._after_flush is not None and written:
+            try:
+                await self._after_flush(written)
+            except Exception:
+                # the rows are committed, so the submitters still get them back
+                logger.exception(f"Follow-up of {len(written)} coalesced writes failed")
+
+        for future, result in zip(answered, written):
+            self._resolve(future, result=result)
+        for future, error in failed:
+            self._resolve(future, exception=error)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result=None, exception: Optional[Exception] = None):
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    async def drain(self):
+        """Flush pending items and wait for every in-flight flush to finish."""
+        self._start_flush()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "flushes": self.flush_count,
+            "rows": self.row_count,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
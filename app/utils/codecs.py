@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from app.utils.optional_imports import optional_import
+
+# optional: orjson is a faster drop-in for the json codec, the others are only needed for the codec or
+# compression named after them
+if TYPE_CHECKING:
+    import lz4.frame as lz4
+    import msgpack
+    import orjson
+    import zstandard
+else:
+    orjson = optional_import("orjson")
+    msgpack = optional_import("msgpack")
+    lz4 = optional_import("lz4.frame")
+    zstandard = optional_import("zstandard")
+
+# Compressed and plain values are told apart by their first byte, so the compression setting can change
+# without invalidating what is already cached
+PLAIN = b"p"
+
+
+class Codec:
+    """Serialises cached values to bytes and back."""
+
+    name = ""
+
+    @staticmethod
+    def available() -> bool:
+        return True
+
+    def dumps(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data.decode("utf-8"))
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    @staticmethod
+    def available() -> bool:
+        return orjson is not None
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+
+    @staticmethod
+    def available() -> bool:
+        return msgpack is not None
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+class Compressor:
+    name = ""
+    tag = b""
+
+    @staticmethod
+    def available() -> bool:
+        return True
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class Lz4Compressor(Compressor):
+    name = "lz4"
+    tag = b"l"
+
+    @staticmethod
+    def available() -> bool:
+        return lz4 is not None
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    name = "zstd"
+    tag = b"z"
+
+    @staticmethod
+    def available() -> bool:
+        return zstandard is not None
+
+    def __init__(self, level: int = 3):
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+COMPRESSORS = {compressor.name: compressor for compressor in (Lz4Compressor, ZstdCompressor)}
+
+
+def get_codec(name: str) -> Codec:
+    if name not in CODECS:
+        raise ValueError(f"Unknown cache codec {name}, expected one of {sorted(CODECS)}")
+    if not CODECS[name].available():
+        raise ValueError(f"Cache codec {name} needs a package that is not installed")
+    return CODECS[name]()
+
+
+def get_compressor(name: Optional[str]) -> Optional[Compressor]:
+    if not name or name == "none":
+        return None
+    return _create_compressor(name)
+
+
+def _create_compressor(name: str) -> Compressor:
+    if name not in COMPRESSORS:
+        raise ValueError(f"Unknown cache compression {name}, expected one of {sorted(COMPRESSORS)} or none")
+    if not COMPRESSORS[name].available():
+        raise ValueError(f"Cache compression {name} needs a package that is not installed")
+    return COMPRESSORS[name]()
+
+
+class ValueEncoder:
+    """A codec plus optional compression of the values at least `min_size` bytes long once encoded."""
+
+    def __init__(self, codec: Codec, compressor: Optional[Compressor] = None, min_size: int = 1024):
+        self.codec = codec
+        self.compressor = compressor
+        self.min_size = min_size
+        self._decompressors: Dict[bytes, Compressor] = {compressor.tag: compressor} if compressor else {}
+
+    def encode(self, value: Any) -> bytes:
+        data = self.codec.dumps(value)
+        if self.compressor is not None and len(data) >= self.min_size:
+            return self.compressor.tag + self.compressor.compress(data)
+        return PLAIN + data
+
+    def decode(self, blob: bytes) -> Any:
+        tag, data = blob[:1], blob[1:]
+        if tag != PLAIN:
+            data = self._decompressor(tag).decompress(data)
+        return self.codec.loads(data)
+
+    def _decompressor(self, tag: bytes) -> Compressor:
+        # values compressed under an earlier setting stay readable while the packages are installed
+        if tag not in self._decompressors:
+            name = next((name for name, compressor in COMPRESSORS.items() if compressor.tag == tag), None)
+            if name is None:
+                raise ValueError(f"Unknown cache compression tag {tag!r}")
+            self._decompressors[tag] = _create_compressor(name)
+        return self._decompressors[tag]
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Dict, List
+
+from app.utils.optional_imports import optional_import
+
+# pyarrow is an optional dependency, only needed for columnar exports
+if TYPE_CHECKING:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401 (used as pa.ipc)
+    import pyarrow.parquet as pq
+else:
+    pa = optional_import("pyarrow")
+    pq = optional_import("pyarrow.parquet")
+    optional_import("pyarrow.ipc")  # makes pa.ipc available
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_FORMATS = ("parquet", "arrow")
+MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+COMPRESSION = "zstd"
+
+
+class MissingDependencyError(Exception):
+    pass
+
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise MissingDependencyError("Columnar exports need pyarrow, install the analytics extra")
+
+
+def validate_format(format: str) -> None:
+    if format not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unsupported columnar format {format}, expected one of {COLUMNAR_FORMATS}")
+
+
+def waste_schema() -> "pa.Schema":
+    return pa.schema(
+        [
+            ("id", pa.int32()),
+            ("type", pa.string()),
+            ("weight", pa.float64()),
+            ("timestamp", pa.timestamp("us")),
+            ("user_id", pa.int32()),
+        ]
+    )
+
+
+class _ChunkSink:
+    """Write-only file object that hands out whatever was written since it was last drained."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class ColumnarWriter:
+    """Encodes column batches as a compressed Parquet file or Arrow IPC stream, one record batch at a time.
+
+    Each call returns the bytes produced so far, so a caller can stream them out and only one batch is held in
+    memory. Parquet writes every batch as its own row group.
+    """
+
+    def __init__(self, format: str):
+        require_pyarrow()
+        validate_format(format)
+        self.format = format
+        self.schema = waste_schema()
+        self._sink = _ChunkSink()
+        if format == "parquet":
+            self._writer = pq.ParquetWriter(self._sink, self.schema, compression=COMPRESSION)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+            self._writer = pa.ipc.new_stream(self._sink, self.schema, options=options)
+        self.rows = 0
+
+    def write(self, columns: Dict[str, list]) -> bytes:
+        batch = pa.record_batch([pa.array(columns[field.name], field.type) for field in self.schema], self.schema)
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
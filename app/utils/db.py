@@ -1,11 +1,13 @@
 import logging
 import os
 from functools import wraps
+from typing import List, Union
 
 import asyncpg
 from asyncpg import ForeignKeyViolationError, PostgresSyntaxError, UniqueViolationError
 from dotenv import load_dotenv
 
+from app.utils import partitions, waste_types
 from app.utils.password import hash_password
 
 logger = logging.getLogger(__name__)
@@ -19,13 +21,32 @@ DATABASE_URL = (
     f"/{os.getenv('POSTGRES_DB')}"
 )
 
+POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "10"))
+POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10"))
+
+# Fills an empty waste_daily_rollup from the entries written so far
+FILL_DAILY_ROLLUP = """
+INSERT INTO waste_daily_rollup (user_id, type_id, day, total_weight, entry_count)
+SELECT user_id, type_id, timestamp::date, sum(weight), count(*)
+FROM waste_entries
+GROUP BY user_id, type_id, timestamp::date
+"""
+
 pool: asyncpg.Pool
+# queries of the request path, prepared on every connection the pool opens once initdb has created the tables
+hot_queries: List[str] = []
+_schema_ready = False
 
 
 async def connect() -> asyncpg.Pool:
     global pool
     logger.info("Connecting to the database")
-    pool = await asyncpg.create_pool(DATABASE_URL)
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=POOL_MIN_SIZE,
+        max_size=max(POOL_MIN_SIZE, POOL_MAX_SIZE),
+        init=_init_connection,
+    )
     logger.info("Database connection pool created")
     return pool
 
@@ -41,19 +62,34 @@ async def initdb(pool: asyncpg.Pool):
     logger.info("Initializing the database")
     async with pool.acquire() as conn:
         logger.info("Creating tables")
+        await conn.execute(
+            """
+            create table if not exists waste_types
+            (
+                id   smallserial primary key,
+                name varchar(100) not null unique
+            );
+        """
+        )
         await conn.execute(
             """
             create table if not exists waste_entries
             (
-                id        serial
-                    primary key,
-                type      varchar(100)     not null,
+                id        serial,
+                type_id   smallint         not null references waste_types (id),
                 weight    double precision not null,
                 timestamp timestamp        not null,
-                user_id   integer          not null
-            );
+                user_id   integer          not null,
+                primary key (id, timestamp)
+            ) partition by range (timestamp);
         """
         )
+        if await partitions.is_partitioned(conn):
+            await conn.execute(
+                f"create table if not exists {partitions.DEFAULT_PARTITION} partition of waste_entries default;"
+            )
+        else:
+            logger.warning("waste_entries was created before partitioning and stays a single table")
         await conn.execute(
             """
             create table if not exists users
@@ -76,8 +112,47 @@ async def initdb(pool: asyncpg.Pool):
             );
         """
         )
+        rollup_exists = await conn.fetchval("SELECT to_regclass('waste_daily_rollup') IS NOT NULL")
+        await conn.execute(
+            """
+            create table if not exists waste_daily_rollup
+            (
+                user_id      integer          not null,
+                type_id      smallint         not null,
+                day          date             not null,
+                total_weight double precision not null,
+                entry_count  integer          not null,
+                primary key (user_id, type_id, day)
+            );
+        """
+        )
+        # teams are joined when the rollup is read; the team at the time of writing went stale as users moved
+        await conn.execute("ALTER TABLE waste_daily_rollup DROP COLUMN IF EXISTS team_id;")
+        await waste_types.migrate_type_names(conn)  # type: ignore[arg-type]
+        if not rollup_exists:
+            logger.info("Filling the daily waste rollup from waste_entries")
+            async with conn.transaction():
+                await conn.execute("LOCK TABLE waste_entries IN SHARE MODE")
+                await conn.execute(FILL_DAILY_ROLLUP)
         logger.info("Creating indexes")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_waste_entries_user_id ON waste_entries (user_id);")
+        # (user_id, timestamp, id) serves every lookup by user, so the index on user_id alone only slowed inserts
+        await conn.execute("DROP INDEX IF EXISTS idx_waste_entries_user_id;")
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_waste_entries_user_id_timestamp_id
+            ON waste_entries (user_id, timestamp DESC, id DESC);
+            """
+        )
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_waste_entries_user_id_type_id_timestamp
+            ON waste_entries (user_id, type_id, timestamp DESC);
+            """
+        )
+        # indexes on the partitioned table are created on every partition; BRIN stays tiny on append-only months
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_waste_entries_timestamp_brin ON waste_entries USING brin (timestamp);"
+        )
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_team_id ON users (team_id);")
         await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username);")
         await conn.execute(
@@ -109,9 +184,51 @@ async def initdb(pool: asyncpg.Pool):
                 1,
             )
             logger.info("Inserted new admin user")
+        logger.info("Maintaining waste_entries partitions")
+        await partitions.maintain_partitions(conn)
+        await waste_types.registry.load(conn)  # type: ignore[arg-type]
+    global _schema_ready
+    _schema_ready = True
+    # the connections opened before the tables existed are replaced, and the new ones prepared as they open
+    await pool.expire_connections()
     logger.info("Database initialized")
 
 
+def hot_query(query: str) -> str:
+    """Register `query` to be prepared by `prepare_pool`, and return it unchanged."""
+    hot_queries.append(query)
+    return query
+
+
+async def prepare_statements(conn: Union[asyncpg.Connection, asyncpg.pool.PoolConnectionProxy]) -> None:
+    for query in hot_queries:
+        # Connection.prepare() bypasses the statement cache that fetch() and execute() look queries up in, and
+        # asyncpg has no public call that fills it, so the statements go through the private call those methods
+        # make themselves. asyncpg is pinned to a minor version, and test_prepare_pool fails if this stops
+        # filling the cache.
+        await conn._prepare(query, use_cache=True)  # type: ignore[union-attr]
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # runs on every connection the pool opens, including those it opens under load or to replace recycled ones
+    if _schema_ready:
+        await prepare_statements(conn)
+
+
+async def prepare_pool(pool: asyncpg.Pool) -> int:
+    """Open the pool's minimum number of connections ahead of the first requests; the pool prepares the hot
+    queries on each as it opens it."""
+    connections = []
+    try:
+        for _ in range(pool.get_min_size()):
+            connections.append(await pool.acquire())
+    finally:
+        for conn in connections:
+            await pool.release(conn)
+    logger.info(f"Opened {len(connections)} connections with {len(hot_queries)} prepared statements")
+    return len(connections)
+
+
 def get_db_pool() -> asyncpg.pool.Pool:
     global pool
     return pool
@@ -170,3 +287,14 @@ async def fetch(
     logger.info(f"Fetching data with query: {query}")
     data = await conn.fetch(query, *args)
     return data
+
+
+@handle_errors
+async def copy_records_to_table(
+    conn: asyncpg.Connection,
+    table_name: str,
+    records: list,
+    columns: list[str],
+):
+    logger.info(f"Copying {len(records)} records to table: {table_name}")
+    return await conn.copy_records_to_table(table_name, records=records, columns=columns)
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Tuple
+
+from app.utils import cache
+
+logger = logging.getLogger(__name__)
+
+# How long a completed response is replayed for retries with the same key
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# How long a claimed key stays reserved if its request never completes (e.g. the replica dies). The claim is
+# stored without a Redis TTL, so it cannot be evicted, and its expiry is pushed back while the request runs.
+PENDING_TTL = 30
+WAIT_TIMEOUT = 10.0
+POLL_INTERVAL = 0.05
+MAX_KEY_LENGTH = 255
+
+Response = Tuple[int, dict]
+
+# Requests with a claimed key running in this process; duplicates await them instead of polling Redis
+_in_flight: Dict[str, asyncio.Future] = {}
+
+
+class IdempotencyError(Exception):
+    pass
+
+
+def fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+async def run_once(
+    scope: str, user_id: int, key: str, request_fingerprint: str, handler: Callable[[], Awaitable[Response]]
+) -> Response:
+    """Run `handler` once per idempotency key and replay its response for every retry with the same key.
+
+    Keys are chosen by clients, so they are only unique per authenticated user: the same key sent by another user
+    is a different request and never sees this one's response.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be between 1 and {MAX_KEY_LENGTH} characters")
+    cache_key = f"idempotency:{scope}:{user_id}:{key}"
+    deadline = time.monotonic() + WAIT_TIMEOUT
+
+    while True:
+        # the keys live in Redis only, so requests cannot be deduplicated without it
+        cache.require_available()
+        in_flight = _in_flight.get(cache_key)
+        if in_flight is not None:
+            logger.info(f"Idempotency key {key} is in flight in this process, waiting for it")
+            try:
+                await asyncio.wait_for(asyncio.shield(in_flight), timeout=max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise IdempotencyError(f"Request with Idempotency-Key {key} is still in progress")
+
+        pending = {"state": "pending", "fingerprint": request_fingerprint}
+        if await cache.set_durable_if_missing(cache_key, pending, ttl=PENDING_TTL):
+            return await _run_claimed(cache_key, request_fingerprint, handler)
+
+        stored = await cache.get_durable(cache_key)
+        if stored is None:
+            # the first request failed and released the key, so this one may claim it
+            continue
+        if stored["fingerprint"] != request_fingerprint:  # type: ignore
+            raise IdempotencyError(f"Idempotency-Key {key} was already used for a different request")
+        if stored["state"] == "completed":  # type: ignore
+            logger.info(f"Replaying stored response for idempotency key {key}")
+            return stored["status"], stored["body"]  # type: ignore
+
+        if time.monotonic() >= deadline:
+            raise IdempotencyError(f"Request with Idempotency-Key {key} is still in progress")
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def _run_claimed(
+    cache_key: str, request_fingerprint: str, handler: Callable[[], Awaitable[Response]]
+) -> Response:
+    done = asyncio.get_running_loop().create_future()
+    _in_flight[cache_key] = done
+    keep_claimed = asyncio.create_task(_extend_claim(cache_key))
+    try:
+        try:
+            status, body = await handler()
+        except ValueError:
+            # the request was rejected by validation before anything was written, so a retry may run it again
+            await cache.delete_durable(cache_key)
+            raise
+        finally:
+            keep_claimed.cancel()
+        # Any other failure may come after the write committed (e.g. updating the cache once the row is inserted), so
+        # the claim is kept and retries are answered as in progress until it expires instead of writing a second
+        # time. The same holds when the response cannot be stored, or the request is cancelled mid-handler.
+        completed = {"state": "completed", "fingerprint": request_fingerprint, "status": status, "body": body}
+        # stored without a Redis TTL, so evicting it under memory pressure cannot let a retry write again
+        if not await cache.set_durable(cache_key, completed, ttl=IDEMPOTENCY_TTL):
+            logger.warning(f"Could not store the response for {cache_key}, keeping the claim")
+        return status, body
+    finally:
+        # waiters re-check Redis, which now holds either the response or nothing
+        _in_flight.pop(cache_key, None)
+        done.set_result(None)
+
+
+async def _extend_claim(cache_key: str) -> None:
+    # a handler slower than PENDING_TTL must not have its claim purged, or a retry would run it a second time
+    while True:
+        await asyncio.sleep(PENDING_TTL / 3)
+        await cache.extend_durable(cache_key, PENDING_TTL)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+from redis._parsers import _AsyncRESP3Parser
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 1.0
+# an idle tracking connection is pinged this often, so a dead one stops serving values within a few seconds
+HEALTH_CHECK_INTERVAL = 5.0
+
+
+class LocalCache:
+    """Bounded in-process LRU in front of Redis for keys under `prefixes`.
+
+    Coherence comes from Redis client-side caching: a dedicated RESP3 connection runs `CLIENT TRACKING ON BCAST`
+    for the prefixes, and Redis pushes the name of every key under them that any client modifies, expires or
+    evicts. Values are only served while that connection is up; when it drops, everything is forgotten and reads
+    go to Redis until tracking is back.
+    """
+
+    def __init__(self, max_size: int, prefixes: Tuple[str, ...]):
+        self.max_size = max_size
+        self.prefixes = prefixes
+        self._values: OrderedDict[str, Any] = OrderedDict()
+        # reads in progress; an invalidation that lands before a read stores its value cancels the store
+        self._filling: Dict[str, object] = {}
+        self._tracking = False
+        self._listener: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    def covers(self, key: str) -> bool:
+        return self._tracking and key.startswith(self.prefixes)
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.covers(key):
+            return None
+        value = self._values.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._values.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def begin_fill(self, key: str) -> Optional[object]:
+        """Mark `key` as being read from Redis; pass the returned token to `finish_fill`."""
+        if not self.covers(key):
+            return None
+        token = object()
+        self._filling[key] = token
+        return token
+
+    def finish_fill(self, key: str, token: Optional[object], value: Any) -> None:
+        if token is None or self._filling.get(key) is not token:
+            return
+        del self._filling[key]
+        if value is None:
+            return
+        self._values[key] = value
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        self._values.pop(key, None)
+        self._filling.pop(key, None)
+
+    def clear(self) -> None:
+        self._values.clear()
+        self._filling.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._values), "hits": self.hits, "misses": self.misses, "tracking": self._tracking}
+
+    async def start(self, **connection_kwargs) -> None:
+        if self.max_size > 0 and self._listener is None:
+            self._listener = asyncio.create_task(self._listen(connection_kwargs))
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self, connection_kwargs: dict) -> None:
+        while True:
+            connection = redis.Connection(protocol=3, parser_class=_AsyncRESP3Parser, **connection_kwargs)
+            try:
+                await self._track(connection)
+            except (redis.ConnectionError, redis.TimeoutError, redis.ResponseError, OSError) as e:
+                logger.warning(f"Local cache disabled until Redis tracking is back: {str(e)}")
+            finally:
+                self._tracking = False
+                self.clear()
+                await connection.disconnect()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _track(self, connection: redis.Connection) -> None:
+        await connection.connect()
+        # redis-py has no public hook for push messages on a plain connection; the parser's is private, so redis is
+        # pinned to the minor version it is tested against (see test_redis_parser_has_the_invalidation_hook)
+        connection._parser.set_invalidation_push_handler(self._on_invalidation)  # type: ignore[attr-defined]
+        prefixes: List[str] = []
+        for prefix in self.prefixes:
+            prefixes += ["PREFIX", prefix]
+        await connection.send_command("CLIENT", "TRACKING", "ON", "BCAST", *prefixes)
+        await connection.read_response()
+        self._tracking = True
+        logger.info(f"Local cache tracking {', '.join(self.prefixes)}")
+
+        while True:
+            # invalidations are handled by the parser while waiting; a quiet interval is followed by a ping
+            if await connection.read_response(timeout=HEALTH_CHECK_INTERVAL, push_request=True) is None:
+                await connection.send_command("PING")
+                if await connection.read_response(timeout=HEALTH_CHECK_INTERVAL) is None:
+                    raise redis.TimeoutError("Redis did not answer a ping on the tracking connection")
+
+    async def _on_invalidation(self, message: list) -> list:
+        keys = message[1]
+        # a null key list means the whole database was flushed
+        if keys is None:
+            self.clear()
+        else:
+            for key in keys:
+                self.invalidate(key.decode("utf-8") if isinstance(key, bytes) else key)
+        return message
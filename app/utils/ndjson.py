@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import json
+from typing import AsyncIterable, AsyncIterator, Optional
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def iter_lines(chunks: AsyncIterable[bytes], max_line_length: int) -> AsyncIterator[Optional[bytes]]:
+    """Split a stream of byte chunks into lines without buffering more than one line at a time.
+
+    Lines longer than `max_line_length` are discarded up to the next newline and reported as None.
+    """
+    buffer = b""
+    discarding = False
+    async for chunk in chunks:
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if discarding:
+                # tail of a line that was already reported as too long
+                discarding = False
+            elif len(line) > max_line_length:
+                yield None
+            else:
+                yield line
+        if len(buffer) > max_line_length:
+            if not discarding:
+                discarding = True
+                yield None
+            buffer = b""
+    if buffer and not discarding:
+        yield buffer
+
+
+def dumps_line(value: dict | list) -> str:
+    return json.dumps(value) + "\n"
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+import importlib
+from types import ModuleType
+from typing import Optional
+
+
+def optional_import(name: str) -> Optional[ModuleType]:
+    """The module `name`, or None when the optional dependency that provides it is not installed.
+
+    Modules bind the result in the `else` branch of an `if TYPE_CHECKING:` block that imports the module, so type
+    checkers see the real module while the code checks for None before using it.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import logging
+import os
+from datetime import date
+from typing import List, Optional, Union
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# the helpers run on plain connections as well as on connections acquired from a pool
+Connection = Union[asyncpg.Connection, asyncpg.pool.PoolConnectionProxy]
+
+# waste_entries is range partitioned by month on timestamp; rows outside every month land in the default partition
+PARENT_TABLE = "waste_entries"
+DEFAULT_PARTITION = "waste_entries_default"
+PARTITION_PREFIX = "waste_entries_p"
+
+MONTHS_AHEAD = int(os.getenv("WASTE_PARTITION_MONTHS_AHEAD", "3"))
+# 0 keeps every partition attached
+RETENTION_MONTHS = int(os.getenv("WASTE_PARTITION_RETENTION_MONTHS", "0"))
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+async def is_partitioned(conn: Connection) -> bool:
+    return bool(await conn.fetchval("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass($1)", PARENT_TABLE))
+
+
+async def get_partitions(conn: Connection) -> List[str]:
+    rows = await conn.fetch(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass($1)
+        ORDER BY child.relname
+        """,
+        PARENT_TABLE,
+    )
+    return [row["relname"] for row in rows]
+
+
+async def create_partitions(conn: Connection, first_month: date, months: int) -> List[str]:
+    """Create the monthly partitions from `first_month` on that do not exist yet and return their names."""
+    created = []
+    for offset in range(months):
+        month = add_months(month_start(first_month), offset)
+        name = partition_name(month)
+        if await _create_partition(conn, name, month, add_months(month, 1)):
+            created.append(name)
+    return created
+
+
+async def _create_partition(conn: Connection, name: str, start: date, end: date) -> bool:
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    async with conn.transaction():
+        # replicas run this on startup at the same time; the lock makes the existence check reliable
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", PARENT_TABLE)
+        if name in await get_partitions(conn):
+            return False
+        has_default_rows = await conn.fetchval(
+            f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE timestamp >= $1 AND timestamp < $2)",
+            start,
+            end,
+        )
+        if not has_default_rows:
+            await conn.execute(f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} {bounds}")
+            logger.info(f"Created partition {name}")
+            return True
+
+        # Postgres refuses a new partition while the default one holds rows in its range,
+        # so the default partition is set aside while they are moved over
+        await conn.execute(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {DEFAULT_PARTITION}")
+        await conn.execute(f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} {bounds}")
+        moved = await conn.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE timestamp >= $1 AND timestamp < $2
+                RETURNING *
+            )
+            INSERT INTO {name}
+            SELECT * FROM moved
+            """,
+            start,
+            end,
+        )
+        await conn.execute(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+        logger.info(f"Created partition {name} and moved {moved.split()[-1]} rows out of {DEFAULT_PARTITION}")
+        return True
+
+
+async def detach_partitions(conn: Connection, before: date) -> List[str]:
+    """Detach the monthly partitions that end on or before `before` and return their names.
+
+    Detached partitions stay in the database as plain tables, to be archived or dropped. Their totals remain in
+    the daily rollup.
+    """
+    detached = []
+    cutoff = partition_name(month_start(before))
+    for name in await get_partitions(conn):
+        if name.startswith(PARTITION_PREFIX) and name < cutoff:
+            await conn.execute(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}")
+            logger.info(f"Detached partition {name}")
+            detached.append(name)
+    return detached
+
+
+async def maintain_partitions(
+    conn: Connection, today: Optional[date] = None, retention_months: int = RETENTION_MONTHS
+) -> dict:
+    """Pre-create partitions up to MONTHS_AHEAD months ahead and detach those past the retention window."""
+    if not await is_partitioned(conn):
+        logger.warning(f"{PARENT_TABLE} is not partitioned, skipping partition maintenance")
+        return {"created": [], "detached": []}
+
+    current_month = month_start(today or date.today())
+    created = await create_partitions(conn, current_month, MONTHS_AHEAD + 1)
+    detached = []
+    if retention_months > 0:
+        detached = await detach_partitions(conn, add_months(current_month, -retention_months))
+    return {"created": created, "detached": detached}
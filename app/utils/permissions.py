@@ -8,6 +8,8 @@ class Permission(enum.Enum):
     # Waste routes
     CREATE_WASTE = "create_waste"
     GET_WASTE_BY_USER_ID = "get_waste_by_user_id"
+    GET_WASTE_BY_TEAM_ID = "get_waste_by_team_id"
+    IMPORT_WASTE = "import_waste"
 
     # User routes
     CREATE_USER = "create_user"
@@ -26,6 +28,7 @@ EMPLOYEE_PERMISSIONS: List[Permission] = [
 MANAGER_PERMISSIONS: List[Permission] = [
     Permission.CREATE_WASTE,
     Permission.GET_WASTE_BY_USER_ID,
+    Permission.GET_WASTE_BY_TEAM_ID,
     Permission.GET_USERS_BY_TEAM_ID,
 ]
 
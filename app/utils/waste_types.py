@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Types are created by writes, so this bounds what clients can add; smallserial ids run out at 32767
+MAX_WASTE_TYPES = int(os.getenv("MAX_WASTE_TYPES", "1000"))
+
+# Tables that stored the type name in a `type` column before waste_types existed, with the constraints that
+# follow the switch to `type_id`
+_TYPE_NAME_TABLES = {
+    "waste_entries": "ADD FOREIGN KEY (type_id) REFERENCES waste_types (id)",
+    "waste_daily_rollup": "ADD PRIMARY KEY (user_id, type_id, day)",
+}
+
+
+class TooManyWasteTypesError(ValueError):
+    pass
+
+
+class WasteTypeRegistry:
+    """In-process map between waste type names and their smallint ids in `waste_types`.
+
+    Loaded when the database is initialised. Types created by this process are registered as soon as their id is
+    known. Types created by other replicas are picked up by reloading the table when a row carries an unknown id,
+    and by a lookup of the single name when a filter names an unknown type.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+
+    async def load(self, conn: asyncpg.Connection) -> None:
+        rows = await conn.fetch("SELECT id, name FROM waste_types")
+        self._ids = {row["name"]: row["id"] for row in rows}
+        self._names = {row["id"]: row["name"] for row in rows}
+        logger.info(f"Loaded {len(rows)} waste types")
+
+    def register(self, type_id: int, name: str) -> None:
+        self._ids[name] = type_id
+        self._names[type_id] = name
+
+    def get_id(self, name: str) -> Optional[int]:
+        return self._ids.get(name)
+
+    def check_new_types(self, names: Iterable[str]) -> None:
+        """Refuse to create types once MAX_WASTE_TYPES are known.
+
+        Types created by other replicas since the last load are not counted, so the cap is approximate.
+        """
+        new_names = {name for name in names if name not in self._ids}
+        if new_names and len(self._ids) + len(new_names) > MAX_WASTE_TYPES:
+            raise TooManyWasteTypesError(f"Cannot create waste types {sorted(new_names)}: {len(self._ids)} exist")
+
+    async def resolve_id(self, conn: asyncpg.Connection, name: str) -> Optional[int]:
+        """Id of the type called `name`, or None if no such type exists.
+
+        Names come from read filters, so an unknown one costs a single indexed lookup and never creates a type.
+        """
+        type_id = self._ids.get(name)
+        if type_id is None:
+            type_id = await conn.fetchval("SELECT id FROM waste_types WHERE name = $1", name)
+            if type_id is not None:
+                self.register(type_id, name)
+        return type_id
+
+    async def resolve_names(self, conn: asyncpg.Connection, type_ids: Iterable[int]) -> Dict[int, str]:
+        """Map from id to name that covers every id in `type_ids`."""
+        if any(type_id not in self._names for type_id in type_ids):
+            await self.load(conn)
+        return self._names
+
+
+registry = WasteTypeRegistry()
+
+
+async def migrate_type_names(conn: asyncpg.Connection) -> None:
+    """Move tables created before waste_types from a `type` name column to `type_id`.
+
+    Runs in one transaction, so a failure leaves the old schema in place for the next start to retry.
+    """
+    async with conn.transaction():
+        # replicas run this on startup at the same time
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('waste_types'))")
+        rows = await conn.fetch(
+            """
+            SELECT table_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND column_name = 'type' AND table_name = any($1::text[])
+            """,
+            list(_TYPE_NAME_TABLES),
+        )
+        for row in rows:
+            table = row["table_name"]
+            logger.warning(f"Migrating {table}.type to type_id")
+            await conn.execute(
+                f"INSERT INTO waste_types (name) SELECT DISTINCT type FROM {table} ON CONFLICT (name) DO NOTHING"
+            )
+            await conn.execute(f"ALTER TABLE {table} ADD COLUMN type_id smallint")
+            await conn.execute(
+                f"UPDATE {table} SET type_id = waste_types.id FROM waste_types WHERE waste_types.name = {table}.type"
+            )
+            await conn.execute(f"ALTER TABLE {table} ALTER COLUMN type_id SET NOT NULL")
+            # drops the indexes and the primary key that include the name as well
+            await conn.execute(f"ALTER TABLE {table} DROP COLUMN type")
+            await conn.execute(f"ALTER TABLE {table} {_TYPE_NAME_TABLES[table]}")
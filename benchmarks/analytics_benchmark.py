@@ -0,0 +1,81 @@
+"""Times the vectorized anomaly detection on synthetic daily totals against a per-user Python loop.
+
+python -m benchmarks.analytics_benchmark [--users 10000] [--days 365]
+"""
+
+import argparse
+import statistics
+import time
+from datetime import date
+
+import numpy as np
+
+from app.utils import analytics
+
+WINDOW = 28
+THRESHOLD = 3.0
+MIN_PERIODS = 7
+LOOP_SAMPLE = 200
+
+
+def synthetic_totals(users: int, days: int, seed: int = 0):
+    """Rollup shaped rows for `users` x `days`, with roughly a third of the days empty and a few spikes."""
+    rng = np.random.default_rng(seed)
+    user_ids, offsets = np.nonzero(rng.random((users, days)) > 0.3)
+    weights = rng.gamma(2.0, 2.0, len(user_ids))
+    spikes = rng.random(len(user_ids)) < 0.002
+    weights[spikes] *= 20
+    return (user_ids + 1).tolist(), offsets.tolist(), weights.tolist()
+
+
+def detect_with_loop(matrix, window: int, threshold: float, min_periods: int) -> int:
+    """Reference implementation: one pass over every day of every user in Python."""
+    found = 0
+    for row in matrix.tolist():
+        for day in range(min_periods, len(row)):
+            history = row[max(day - window, 0) : day]
+            mean = statistics.fmean(history)
+            std = statistics.pstdev(history, mean)
+            if (std == 0 and row[day] > mean) or (std > 0 and (row[day] - mean) / std > threshold):
+                found += 1
+    return found
+
+
+def timed(label: str, fn):
+    began = time.perf_counter()
+    result = fn()
+    print(f"{label:<40} {time.perf_counter() - began:8.3f}s")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    start = date(2024, 1, 1)
+    user_ids, offsets, weights = synthetic_totals(args.users, args.days)
+    print(f"{len(user_ids)} daily totals for {args.users} users over {args.days} days")
+
+    users, matrix = timed("daily_matrix", lambda: analytics.daily_matrix(user_ids, offsets, weights, args.days))
+    report = timed(
+        "detect_outliers",
+        lambda: analytics.detect_outliers(users, matrix, start, WINDOW, THRESHOLD, MIN_PERIODS),
+    )
+    print(f"{len(report['outliers'])} outliers")
+
+    sample = matrix[:LOOP_SAMPLE]
+    vectorized = timed(
+        f"detect_outliers, first {LOOP_SAMPLE} users",
+        lambda: analytics.detect_outliers(users[:LOOP_SAMPLE], sample, start, WINDOW, THRESHOLD, MIN_PERIODS),
+    )
+    looped = timed(
+        f"python loop, first {LOOP_SAMPLE} users", lambda: detect_with_loop(sample, WINDOW, THRESHOLD, MIN_PERIODS)
+    )
+    if looped != len(vectorized["outliers"]):
+        print(f"warning: loop found {looped} outliers, vectorized found {len(vectorized['outliers'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compares the cache codecs and compressions on a large waste history, the biggest values the cache holds.
+
+python -m benchmarks.cache_codec_benchmark [--entries 5000] [--rounds 50]
+
+Redis memory is measured with MEMORY USAGE when the Redis from the environment is reachable.
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import redis
+
+from app.utils import cache, codecs
+
+TYPES = ["Food", "Plastic", "Paper", "Glass", "Metal"]
+
+
+def waste_history(entries: int) -> list:
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "id": i,
+            "type": TYPES[i % len(TYPES)],
+            "weight": round(0.1 + (i * 7919 % 1000) / 100, 2),
+            "timestamp": (start + timedelta(minutes=37 * i)).isoformat(),
+            "user_id": 1,
+        }
+        for i in range(entries)
+    ]
+
+
+def redis_memory(client, encoded: bytes):
+    if client is None:
+        return None
+    client.set("benchmark:codec", encoded)
+    try:
+        return client.memory_usage("benchmark:codec")
+    finally:
+        client.delete("benchmark:codec")
+
+
+def connect():
+    try:
+        client = redis.Redis(host=cache.HOST or "localhost", port=cache.PORT or 6379, db=cache.DB or 0)
+        client.ping()
+        return client
+    except redis.RedisError:
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    value = waste_history(args.entries)
+    client = connect()
+    print(f"{args.entries} entries, {args.rounds} rounds")
+    print(f"{'codec':<10}{'compression':<13}{'encode ms':>10}{'decode ms':>10}{'bytes':>10}{'redis bytes':>13}")
+    for codec_name, codec in codecs.CODECS.items():
+        if not codec.available():
+            continue
+        for compressor_name in ["none", *(name for name, c in codecs.COMPRESSORS.items() if c.available())]:
+            encoder = codecs.ValueEncoder(codec(), codecs.get_compressor(compressor_name))
+
+            began = time.perf_counter()
+            for _ in range(args.rounds):
+                encoded = encoder.encode(value)
+            encode_ms = (time.perf_counter() - began) * 1000 / args.rounds
+
+            began = time.perf_counter()
+            for _ in range(args.rounds):
+                encoder.decode(encoded)
+            decode_ms = (time.perf_counter() - began) * 1000 / args.rounds
+
+            memory = redis_memory(client, encoded)
+            print(
+                f"{codec_name:<10}{compressor_name:<13}{encode_ms:>10.2f}{decode_ms:>10.2f}{len(encoded):>10}"
+                f"{memory if memory is not None else '-':>13}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import warnings
+from datetime import date
+
+import numpy as np
+
+from app.utils import analytics
+
+START = date(2024, 1, 1)
+
+
+def test_daily_matrix_sums_totals_per_user_and_day():
+    users, matrix = analytics.daily_matrix([7, 3, 7, 7], [0, 1, 0, 2], [1.0, 2.0, 0.5, 4.0], 3)
+
+    assert users.tolist() == [3, 7]
+    assert matrix.tolist() == [[0.0, 2.0, 0.0], [1.5, 0.0, 4.0]]
+
+
+def test_rolling_baseline_excludes_the_day_itself():
+    matrix = np.array([[1.0, 3.0, 5.0, 100.0]])
+
+    mean, std = analytics.rolling_mean_std(matrix, window=2, min_periods=2)
+
+    assert np.isnan(mean[0, :2]).all()
+    assert mean[0, 2:].tolist() == [2.0, 4.0]
+    assert std[0, 2:].tolist() == [1.0, 1.0]
+
+
+def test_detect_outliers_flags_spikes_only():
+    rng = np.random.default_rng(1)
+    matrix = rng.normal(10.0, 1.0, (2, 60))
+    matrix[1, 45] = 40.0
+
+    report = analytics.detect_outliers(np.array([1, 2]), matrix, START, window=28, threshold=4.0, min_periods=7)
+
+    assert [(outlier["user_id"], outlier["day"]) for outlier in report["outliers"]] == [(2, "2024-02-15")]
+    assert report["outliers"][0]["z_score"] > 4.0
+    assert [user["user_id"] for user in report["users"]] == [1, 2]
+
+
+def test_flat_series_has_no_outliers_until_it_moves():
+    matrix = np.full((1, 20), 2.0)
+    matrix[0, 15] = 2.5
+
+    report = analytics.detect_outliers(np.array([1]), matrix, START, window=10, threshold=3.0, min_periods=5)
+
+    assert report["outliers"] == [
+        {"user_id": 1, "day": "2024-01-16", "total_weight": 2.5, "rolling_mean": 2.0, "z_score": None}
+    ]
+
+
+def test_drop_below_a_flat_baseline_is_not_a_spike():
+    matrix = np.full((1, 20), 2.0)
+    matrix[0, 15] = 0.0
+
+    scores = analytics.z_scores(matrix, *analytics.rolling_mean_std(matrix, window=10, min_periods=5))
+    report = analytics.detect_outliers(np.array([1]), matrix, START, window=10, threshold=3.0, min_periods=5)
+
+    assert scores[0, 15] == -np.inf
+    assert report["outliers"] == []
+
+
+def test_first_logged_day_after_an_empty_baseline_is_not_a_spike():
+    matrix = np.zeros((1, 20))
+    matrix[0, 10:] = 5.0
+    matrix[0, 15] = 50.0
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        scores = analytics.z_scores(matrix, *analytics.rolling_mean_std(matrix, window=7, min_periods=5))
+        report = analytics.detect_outliers(np.array([1]), matrix, START, window=7, threshold=3.0, min_periods=5)
+
+    assert np.isnan(scores[0, 10])
+    assert [outlier["day"] for outlier in report["outliers"]] == ["2024-01-16"]
+
+
+def test_percentiles_per_user():
+    matrix = np.array([np.arange(101, dtype=float), np.zeros(101)])
+
+    assert analytics.percentiles(matrix).tolist() == [[50.0, 95.0, 99.0], [0.0, 0.0, 0.0]]
@@ -0,0 +1,345 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+import redis.asyncio as redis
+from redis._parsers import _AsyncRESP3Parser
+
+from app.utils import cache, cache_metrics
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.local_cache import LocalCache
+
+
+@pytest.fixture
+async def clean_cache():
+    async with cache.get_cache() as redis_cache:
+        await redis_cache.flushdb()
+    yield
+    async with cache.get_cache() as redis_cache:
+        await redis_cache.flushdb()
+
+
+async def test_single_flight_loads_once_for_concurrent_misses(clean_cache):
+    loads = []
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.05)
+        await cache.set_value("team:1", {"id": 1})
+        return {"id": 1}
+
+    results = await asyncio.gather(
+        *(cache.single_flight("team:1", load, lambda: cache.get_value("team:1")) for _ in range(20))
+    )
+
+    assert results == [{"id": 1}] * 20
+    assert len(loads) == 1
+    async with cache.get_cache() as redis_cache:
+        assert not await redis_cache.exists(cache.redis_key("lock:team:1"))
+
+
+async def test_single_flight_waits_for_another_replica(clean_cache):
+    async def load():
+        raise AssertionError("the replica holding the lock loads the key")
+
+    async def other_replica():
+        await asyncio.sleep(0.05)
+        await cache.set_value("team:2", {"id": 2})
+        await cache.delete_key("lock:team:2")
+
+    async with cache.get_cache() as redis_cache:
+        await redis_cache.set(cache.redis_key("lock:team:2"), "other", px=cache.LOAD_LOCK_MS)
+
+    result, _ = await asyncio.gather(
+        cache.single_flight("team:2", load, lambda: cache.get_value("team:2")), other_replica()
+    )
+
+    assert result == {"id": 2}
+
+
+async def test_single_flight_shares_errors_then_retries(clean_cache):
+    calls = []
+
+    async def failing_load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("database down")
+
+    async def lookup():
+        return None
+
+    results = await asyncio.gather(
+        *(cache.single_flight("team:3", failing_load, lookup) for _ in range(3)), return_exceptions=True
+    )
+
+    assert [str(result) for result in results] == ["database down"] * 3
+    assert len(calls) == 1
+
+    async def load():
+        return {"id": 3}
+
+    assert await cache.single_flight("team:3", load, lookup) == {"id": 3}
+
+
+@pytest.fixture
+async def local_cache(clean_cache):
+    local = LocalCache(2, (cache.redis_key("team:"),))
+    await local.start(host=cache.HOST, port=cache.PORT, db=cache.DB)
+    with patch.object(cache, "local_cache", local):
+        for _ in range(100):
+            if local.stats()["tracking"]:
+                break
+            await asyncio.sleep(0.01)
+        yield local
+    await local.stop()
+
+
+async def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+def test_redis_parser_has_the_invalidation_hook():
+    # LocalCache hooks into this private parser method; a redis upgrade that drops it must fail here
+    assert callable(getattr(_AsyncRESP3Parser, "set_invalidation_push_handler", None))
+
+
+async def test_local_cache_serves_hot_keys_from_memory(local_cache):
+    await cache.set_value("team:1", {"id": 1})
+    # let the invalidation caused by the write itself arrive first
+    await asyncio.sleep(0.05)
+
+    assert await cache.get_value("team:1") == {"id": 1}
+    assert await cache.get_value("team:1") == {"id": 1}
+    assert await cache.get_value("user:1") is None
+
+    assert local_cache.stats() == {"size": 1, "hits": 1, "misses": 1, "tracking": True}
+
+
+async def test_local_cache_is_invalidated_by_other_clients(local_cache):
+    await cache.set_value("team:1", {"id": 1, "name": "old"})
+    await cache.get_value("team:1")
+
+    # another replica writes through its own connection
+    async with cache.get_cache() as redis_cache:
+        await redis_cache.set(cache.redis_key("team:1"), cache.encoder.encode({"id": 1, "name": "new"}))
+    await wait_for(lambda: local_cache.stats()["size"] == 0)
+
+    assert await cache.get_value("team:1") == {"id": 1, "name": "new"}
+
+
+async def test_local_cache_is_bounded(local_cache):
+    for team_id in range(3):
+        await cache.set_value(f"team:{team_id}", {"id": team_id})
+    await asyncio.sleep(0.05)
+    for team_id in range(3):
+        await cache.get_value(f"team:{team_id}")
+
+    assert local_cache.stats()["size"] == 2
+    assert local_cache.get(cache.redis_key("team:0")) is None
+
+
+async def test_many_primitives(clean_cache):
+    await cache.set_many({"team:1": {"id": 1}, "team:2": {"id": 2}})
+
+    assert await cache.get_many(["team:1", "team:3", "team:2"]) == [{"id": 1}, None, {"id": 2}]
+
+    await cache.delete_many(["team:1", "team:2"])
+
+    assert await cache.get_many(["team:1", "team:2"]) == [None, None]
+
+
+async def test_durable_values_have_no_ttl_until_purged(clean_cache):
+    await cache.set_durable("waste_import_job:1", {"id": 1}, ttl=-1)
+    await cache.set_durable("waste_import_job:2", {"id": 2})
+    # written again before its expiry passed
+    await cache.set_durable("waste_import_job:3", {"id": 3}, ttl=-1)
+    await cache.set_durable("waste_import_job:3", {"id": 3})
+
+    async with cache.get_cache() as redis_cache:
+        ttl = await redis_cache.ttl(cache.durable_key("waste_import_job:2"))
+    purged = await cache.purge_expired()
+
+    assert ttl == -1
+    assert purged == 1
+    assert [await cache.get_durable(f"waste_import_job:{job_id}") for job_id in (1, 2, 3)] == [
+        None,
+        {"id": 2},
+        {"id": 3},
+    ]
+
+
+async def test_durable_values_outlive_a_codec_change(clean_cache):
+    await cache.set_durable("waste_import_job:1", {"id": 1})
+    # an earlier release kept durable state in the versioned keyspace
+    async with cache.get_cache() as redis_cache:
+        await redis_cache.set(cache.redis_key("waste_import_job:2"), cache.encoder.encode({"id": 2}))
+        await redis_cache.zadd(
+            cache.redis_key(cache.LEGACY_DURABLE_EXPIRY_KEY), {cache.redis_key("waste_import_job:2"): 0}
+        )
+
+    with patch.object(cache, "KEY_PREFIX", "v2:msgpack:"):
+        assert await cache.get_durable("waste_import_job:1") == {"id": 1}
+    purged = await cache.purge_expired()
+
+    assert purged == 1
+    async with cache.get_cache() as redis_cache:
+        assert not await redis_cache.exists(cache.redis_key("waste_import_job:2"))
+
+
+async def test_pipeline_sends_nothing_when_the_block_fails(clean_cache):
+    with pytest.raises(ValueError):
+        async with cache.pipeline() as writes:
+            writes.set_value("team:1", {"id": 1})
+            raise ValueError("write failed")
+
+    assert await cache.get_value("team:1") is None
+
+
+async def test_pipeline_updates_collections_only_if_cached(clean_cache):
+    await cache.set_fields("users_by_team_id:1", {"1": {"id": 1}})
+
+    async with cache.pipeline() as writes:
+        writes.update_field_if_cached("users_by_team_id:1", "2", {"id": 2})
+        writes.update_field_if_cached("users_by_team_id:2", "3", {"id": 3})
+        writes.delete_field("users_by_team_id:1", "1")
+
+    assert await cache.get_fields("users_by_team_id:1") == {"2": {"id": 2}}
+    assert await cache.get_fields("users_by_team_id:2") is None
+
+
+def test_policy_for_uses_the_longest_family():
+    assert cache.family_of("waste_by_user_id:1") == "waste_by_user_id:"
+    assert cache.family_of("waste:1") == "waste:"
+    assert cache.family_of("idempotency:waste:1") is None
+    assert cache.policy_for("idempotency:waste:1") == cache.DEFAULT_POLICY
+    assert not cache.policy_for("waste:1").write_on_create
+
+
+async def test_values_expire_per_family(clean_cache):
+    await cache.set_value("team:1", {"id": 1})
+    await cache.set_value("waste:1", {"id": 1}, ttl=5)
+    await cache.set_fields("users_by_team_id:1", {"1": {"id": 1}})
+
+    async with cache.get_cache() as redis_cache:
+        team_ttl = await redis_cache.ttl(cache.redis_key("team:1"))
+        waste_ttl = await redis_cache.ttl(cache.redis_key("waste:1"))
+        members_ttl = await redis_cache.ttl(cache.redis_key("users_by_team_id:1"))
+
+    assert cache.DAY <= team_ttl <= cache.DAY * 1.1
+    assert waste_ttl == 5
+    assert 60 * 60 <= members_ttl <= 60 * 60 * 1.1
+
+
+async def test_memory_report_per_family(clean_cache):
+    await cache.set_value("team:1", {"id": 1})
+    await cache.set_value("team:2", {"id": 2})
+    await cache.set_durable("idempotency:waste:1", {"state": "pending"}, ttl=30)
+    async with cache.get_cache() as redis_cache:
+        await redis_cache.set(cache.redis_key("legacy:1"), b"p{}")
+
+    report = await cache.memory_report(batch_size=2)
+
+    assert report["team:"]["keys"] == 2
+    assert report["team:"]["bytes"] > 0
+    assert report["idempotency:"]["keys"] == 1
+    assert report["legacy:"]["no_expiry"] == 1
+
+
+async def test_metrics_per_family(clean_cache):
+    cache.metrics.reset()
+
+    async def load():
+        await cache.set_fields("users_by_team_id:1", {"1": {"id": 1}})
+        return {"1": {"id": 1}}
+
+    await cache.get_value("team:1")
+    await cache.set_value("team:1", {"id": 1, "name": "Admin"})
+    await cache.get_value("team:1")
+    await cache.single_flight("users_by_team_id:1", load, lambda: cache.get_fields("users_by_team_id:1"))
+    await cache.get_fields("users_by_team_id:1")
+    await cache.delete_key("team:1")
+
+    stats = cache.metrics.stats()
+    teams, members = stats["team:"], stats["users_by_team_id:"]
+    assert (teams["hits"], teams["misses"], teams["sets"], teams["deletes"]) == (1, 1, 1, 1)
+    assert teams["hit_ratio"] == 0.5
+    assert teams["latency_ms"]["get"]["count"] == 2
+    assert teams["payload_bytes"]["count"] == 2
+    assert (members["loads"], members["sets"], members["hits"]) == (1, 1, 1)
+    assert members["latency_ms"]["load"]["count"] == 1
+
+
+async def test_metrics_count_pipeline_writes(clean_cache):
+    cache.metrics.reset()
+
+    async with cache.pipeline() as writes:
+        writes.set_value("team:1", {"id": 1, "name": "Admin"})
+        writes.update_field_if_cached("users_by_team_id:1", "1", {"id": 1})
+        writes.add_sorted_if_cached("waste_by_user_id:1", [(1, 1, {"id": 1})])
+        writes.remove_sorted("waste_by_user_id:1", 1, 1)
+        writes.delete("team:2", "team:3")
+
+    stats = cache.metrics.stats()
+    teams, history = stats["team:"], stats["waste_by_user_id:"]
+    assert (teams["sets"], teams["deletes"], teams["payload_bytes"]["count"]) == (1, 2, 1)
+    assert (history["sets"], history["deletes"], history["payload_bytes"]["count"]) == (1, 1, 1)
+    assert stats["users_by_team_id:"]["sets"] == 1
+    assert teams["latency_ms"]["pipeline"]["count"] == 1
+
+
+def test_histogram_buckets():
+    histogram = cache_metrics.Histogram((1, 10))
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+
+    assert histogram.stats() == {"count": 4, "mean": 14.125, "buckets": {"1": 2, "10": 1, "inf": 1}}
+
+
+async def test_cache_degrades_while_redis_is_unavailable(clean_cache):
+    # a value Redis keeps through the outage while the database moves on
+    async with cache.get_cache() as redis_cache:
+        await redis_cache.set(cache.redis_key("team:1"), cache.encoder.encode({"id": 1, "name": "old"}))
+    breaker = CircuitBreaker("redis", 2, 0.02, cache._probe)
+    unreachable = redis.ConnectionPool(host=cache.HOST, port=1, protocol=3, socket_connect_timeout=0.1)
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return {"id": 1, "name": "new"}
+
+    with patch.object(cache, "breaker", breaker), patch.object(cache, "BREAKER_PROBE_SECONDS", 0.02):
+        with patch.object(cache, "pool", unreachable):
+            # the write-through after the database write is skipped, a fill of a missed read too
+            async with cache.pipeline() as writes:
+                writes.set_value("team:1", {"id": 1, "name": "new"})
+            assert await cache.set_value("user:1", {"id": 1}) is False
+            assert await cache.get_value("team:1") is None
+            assert not cache.available()
+
+            # while open nothing waits on Redis, and loads go straight to the database
+            assert await cache.single_flight("team:1", load, lambda: cache.get_value("team:1")) == {
+                "id": 1,
+                "name": "new",
+            }
+            assert await cache.get_many(["user:1"]) == [None]
+            async with cache.pipeline() as writes:
+                writes.delete("users_by_team_id:1")
+            assert await cache.delete_matching("waste_aggregate_by_*") == 0
+            stats = cache.breaker_stats()
+
+        # Redis is back: the probe deletes what went stale before the breaker lets requests through
+        await wait_for(cache.available)
+        await breaker.stop()
+
+    assert loads == [1]
+    # the fill of user:1 is not among the stale keys
+    assert (stats["state"], stats["stale_keys"], stats["stale_patterns"]) == ("open", 2, 1)
+    assert cache.breaker_stats()["stale_keys"] == 0
+    assert await cache.get_value("team:1") is None
+    assert cache.metrics.stats()["team:"]["degraded"] >= 2
+    assert cache.metrics.stats()["user:"]["degraded"] == 2
+    assert cache.metrics.stats()["users_by_team_id:"]["degraded"] == 1
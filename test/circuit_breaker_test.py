@@ -0,0 +1,41 @@
+import asyncio
+
+from app.utils.circuit_breaker import CLOSED, OPEN, CircuitBreaker
+
+
+async def test_opens_after_consecutive_failures_and_closes_once_a_probe_succeeds():
+    probes = []
+
+    async def probe():
+        probes.append(1)
+        if len(probes) < 3:
+            raise ConnectionError("still down")
+
+    breaker = CircuitBreaker("test", failure_threshold=2, probe_interval=0.01, probe=probe)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    for _ in range(100):
+        if breaker.allow():
+            break
+        await asyncio.sleep(0.01)
+
+    assert len(probes) == 3
+    assert breaker.stats() == {"state": CLOSED, "failures": 0, "opened": 1}
+
+
+async def test_stop_cancels_probing():
+    async def probe():
+        raise ConnectionError("down")
+
+    breaker = CircuitBreaker("test", failure_threshold=1, probe_interval=0.01, probe=probe)
+    breaker.record_failure()
+    await breaker.stop()
+
+    assert breaker.state == OPEN
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from app.utils.coalescer import WriteCoalescer
+
+
+async def test_coalesces_concurrent_submits():
+    flushed = []
+
+    async def flush(items):
+        flushed.append(items)
+        return [item * 10 for item in items]
+
+    coalescer = WriteCoalescer(flush, window=0.01, max_batch_size=100)
+
+    results = await asyncio.gather(*(coalescer.submit(i) for i in range(5)))
+
+    assert results == [0, 10, 20, 30, 40]
+    assert flushed == [[0, 1, 2, 3, 4]]
+    assert coalescer.stats() == {"flushes": 1, "rows": 5, "batch_sizes": {5: 1}}
+
+
+async def test_flushes_when_batch_is_full():
+    flushed = []
+
+    async def flush(items):
+        flushed.append(items)
+        return items
+
+    coalescer = WriteCoalescer(flush, window=10, max_batch_size=2)
+
+    results = await asyncio.wait_for(asyncio.gather(*(coalescer.submit(i) for i in range(4))), timeout=1)
+
+    assert results == [0, 1, 2, 3]
+    assert flushed == [[0, 1], [2, 3]]
+
+
+async def test_flush_error_is_raised_to_every_submitter():
+    async def flush(items):
+        raise ValueError("boom")
+
+    coalescer = WriteCoalescer(flush, window=0.01, max_batch_size=100)
+
+    results = await asyncio.gather(coalescer.submit(1), coalescer.submit(2), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    with pytest.raises(ValueError):
+        await coalescer.submit(3)
+
+
+async def test_bad_item_only_fails_its_own_submitter():
+    async def flush(items):
+        if "bad" in items:
+            raise ValueError("bad item")
+        return [item.upper() for item in items]
+
+    coalescer = WriteCoalescer(flush, window=0.01, max_batch_size=100)
+
+    results = await asyncio.gather(
+        coalescer.submit("a"), coalescer.submit("bad"), coalescer.submit("b"), return_exceptions=True
+    )
+
+    assert results[0] == "A"
+    assert isinstance(results[1], ValueError)
+    assert results[2] == "B"
+
+
+async def test_failed_follow_up_does_not_flush_again():
+    flushed = []
+    followed_up = []
+
+    async def flush(items):
+        flushed.append(items)
+        return items
+
+    async def after_flush(results):
+        followed_up.append(results)
+        raise ConnectionError("cache down")
+
+    coalescer = WriteCoalescer(flush, window=0.01, max_batch_size=100, after_flush=after_flush)
+
+    results = await asyncio.gather(coalescer.submit(1), coalescer.submit(2))
+
+    assert results == [1, 2]
+    assert flushed == [[1, 2]]
+    assert followed_up == [[1, 2]]
+
+
+async def test_follow_up_gets_only_written_items():
+    followed_up = []
+
+    async def flush(items):
+        if "bad" in items:
+            raise ValueError("bad item")
+        return items
+
+    async def after_flush(results):
+        followed_up.append(results)
+
+    coalescer = WriteCoalescer(flush, window=0.01, max_batch_size=100, after_flush=after_flush)
+
+    await asyncio.gather(coalescer.submit("a"), coalescer.submit("bad"), coalescer.submit("b"), return_exceptions=True)
+
+    assert followed_up == [["a", "b"]]
+
+
+async def test_drain_flushes_pending_items():
+    flushed = []
+
+    async def flush(items):
+        flushed.append(items)
+        return items
+
+    coalescer = WriteCoalescer(flush, window=10, max_batch_size=100)
+    submitted = asyncio.ensure_future(coalescer.submit(1))
+    await asyncio.sleep(0)
+
+    await coalescer.drain()
+
+    assert flushed == [[1]]
+    assert await submitted == 1
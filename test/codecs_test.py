@@ -0,0 +1,38 @@
+import pytest
+
+from app.utils import codecs
+
+VALUE = [{"id": i, "type": "Food", "weight": 1.5, "timestamp": "2024-01-01T08:00:00", "user_id": 1} for i in range(50)]
+
+
+@pytest.mark.parametrize("name", ["json", "orjson", "msgpack"])
+def test_codecs_round_trip(name):
+    encoder = codecs.ValueEncoder(codecs.get_codec(name))
+
+    assert encoder.decode(encoder.encode(VALUE)) == VALUE
+
+
+def test_compresses_values_above_the_threshold():
+    encoder = codecs.ValueEncoder(codecs.get_codec("json"), codecs.get_compressor("lz4"), min_size=100)
+
+    small, large = encoder.encode({"id": 1}), encoder.encode(VALUE)
+
+    assert small.startswith(codecs.PLAIN)
+    assert large.startswith(b"l")
+    assert len(large) < len(codecs.JsonCodec().dumps(VALUE))
+    assert encoder.decode(small) == {"id": 1}
+    assert encoder.decode(large) == VALUE
+
+
+def test_reads_values_compressed_under_another_setting():
+    compressed = codecs.ValueEncoder(codecs.get_codec("json"), codecs.get_compressor("lz4"), min_size=0)
+
+    assert codecs.ValueEncoder(codecs.get_codec("json")).decode(compressed.encode(VALUE)) == VALUE
+
+
+def test_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        codecs.get_codec("pickle")
+    with pytest.raises(ValueError):
+        codecs.get_compressor("brotli")
+    assert codecs.get_compressor("none") is None
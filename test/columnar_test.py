@@ -0,0 +1,45 @@
+import io
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app.utils.columnar import ColumnarWriter
+
+
+def make_columns(start: int, count: int) -> dict:
+    return {
+        "id": list(range(start, start + count)),
+        "type": ["Food", "Plastic"] * (count // 2),
+        "weight": [float(i) for i in range(count)],
+        "timestamp": [datetime(2024, 1, 1, i % 24) for i in range(count)],
+        "user_id": [1] * count,
+    }
+
+
+def write_all(format: str) -> bytes:
+    writer = ColumnarWriter(format)
+    chunks = [writer.write(make_columns(0, 4)), writer.write(make_columns(4, 4)), writer.close()]
+    return b"".join(chunks)
+
+
+def test_parquet_writes_one_row_group_per_batch():
+    table = pq.ParquetFile(io.BytesIO(write_all("parquet")))
+
+    assert table.metadata.num_row_groups == 2
+    assert table.metadata.row_group(0).column(0).compression == "ZSTD"
+    assert table.read().column("id").to_pylist() == list(range(8))
+
+
+def test_arrow_stream_round_trip():
+    table = pa.ipc.open_stream(write_all("arrow")).read_all()
+
+    assert table.num_rows == 8
+    assert table.column("type").to_pylist()[:2] == ["Food", "Plastic"]
+    assert table.column("timestamp").to_pylist()[1] == datetime(2024, 1, 1, 1)
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        ColumnarWriter("csv")
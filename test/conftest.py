@@ -1,8 +1,9 @@
 import asyncio
 import os
 from contextlib import asynccontextmanager
+from datetime import date, datetime
 from functools import wraps
-from typing import AsyncIterator, Callable, Dict, List, Optional
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 from unittest.mock import patch
 
 import asyncpg
@@ -12,11 +13,12 @@ from httpx import ASGITransport, AsyncClient
 
 load_dotenv(dotenv_path="../.env.test", override=True)
 from app.models.teams import Team
-from app.models.users import User
-from app.models.waste import WasteEntry
+from app.models.users import User, UserRole
+from app.models.waste import WasteEntry, WasteFilter, WasteTotal
 from app.repositories.team_repository import AbstractTeamRepository
 from app.repositories.user_repository import AbstractUserRepository
 from app.repositories.waste_repository import AbstractWasteRepository
+from app.utils import cache
 from app.utils.db import initdb
 from app.utils.permissions import Permission
 
@@ -37,6 +39,8 @@ async def no_auth_client():
         def decorator(func: Callable):
             @wraps(func)
             async def wrapper(*args, **kwargs):
+                if "request" in kwargs:
+                    kwargs["request"].state.user = User("admin", "admin@example.com", UserRole.ADMIN, team_id=1, id=1)
                 return await func(*args, **kwargs)
 
             return wrapper
@@ -60,7 +64,7 @@ async def client():
 async def drop_tables(pool: asyncpg.Pool):
     async with pool.acquire() as conn:
         conn: asyncpg.Connection = conn
-        for table in ["waste_entries", "users", "teams"]:
+        for table in ["waste_entries", "waste_types", "waste_daily_rollup", "users", "teams"]:
             await conn.execute(f"drop table if exists {table}; ")
 
 
@@ -80,6 +84,9 @@ async def db_test_pool() -> asyncpg.Pool:
     await initdb(pool)
     yield pool
     await drop_tables(pool)
+    # cached collections are updated in place, so they must not outlive the tables they mirror
+    async with cache.get_cache() as redis_cache:
+        await redis_cache.flushdb()
     await pool.close()
 
 
@@ -205,6 +212,15 @@ class FakeWasteRepository(AbstractWasteRepository):
         self.current_id += 1
         return waste_entry
 
+    async def create_many(self, waste_entries: List[WasteEntry]) -> List[WasteEntry]:
+        return [await self.create(waste_entry) for waste_entry in waste_entries]
+
+    async def insert_many(self, waste_entries: List[WasteEntry]) -> List[WasteEntry]:
+        return [await self.create(waste_entry) for waste_entry in waste_entries]
+
+    async def write_user_waste(self, waste_entries: List[WasteEntry]) -> None:
+        pass
+
     async def read(self, entry_id: int) -> Optional[WasteEntry]:
         # Retrieve the waste entry by ID from the dictionary
         return self.entries.get(entry_id)
@@ -214,12 +230,71 @@ class FakeWasteRepository(AbstractWasteRepository):
         if entry_id in self.entries:
             del self.entries[entry_id]
 
-    async def get_waste_by_user_id(self, user_id: int) -> List[WasteEntry]:
-        pass
+    async def get_waste_by_user_id(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        filters: Optional[WasteFilter] = None,
+    ) -> List[WasteEntry]:
+        entries = sorted(
+            (entry for entry in self.entries.values() if self._matches(entry, user_id, filters)),
+            key=lambda entry: (entry.timestamp, entry.id),
+            reverse=True,
+        )
+        if after is not None:
+            entries = [entry for entry in entries if (entry.timestamp, entry.id) < after]
+        return entries[:limit]
+
+    async def iterate_waste_by_user_id(
+        self, user_id: int, batch_size: int, filters: Optional[WasteFilter] = None
+    ) -> AsyncIterator[List[dict]]:
+        entries = [vars(entry) for entry in self.entries.values() if self._matches(entry, user_id, filters)]
+        for start in range(0, len(entries), batch_size):
+            yield entries[start : start + batch_size]
+
+    async def iterate_waste_columns(
+        self, batch_size: int, team_id: Optional[int] = None, filters: Optional[WasteFilter] = None
+    ) -> AsyncIterator[Dict[str, list]]:
+        entries = list(self.entries.values())
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start : start + batch_size]
+            yield {column: [getattr(entry, column) for entry in batch] for column in vars(batch[0])}
+
+    @staticmethod
+    def _matches(entry: WasteEntry, user_id: int, filters: Optional[WasteFilter]) -> bool:
+        filters = filters or WasteFilter()
+        return (
+            entry.user_id == user_id
+            and (filters.start is None or entry.timestamp >= filters.start)
+            and (filters.end is None or entry.timestamp < filters.end)
+            and (filters.type is None or entry.type == filters.type)
+        )
 
     async def get_waste_by_team_id(self, team_id: int) -> List[WasteEntry]:
         pass
 
+    async def aggregate_waste_by_user_id(
+        self, user_id: int, bucket: str, filters: Optional[WasteFilter] = None
+    ) -> List[WasteTotal]:
+        pass
+
+    async def aggregate_waste_by_team_id(
+        self, team_id: int, bucket: str, filters: Optional[WasteFilter] = None
+    ) -> List[WasteTotal]:
+        pass
+
+    async def get_daily_totals(
+        self, start: date, end: date, team_id: Optional[int] = None, user_id: Optional[int] = None
+    ) -> Dict[str, list]:
+        pass
+
+    async def get_team_waste_summary(self, team_id: int, filters: Optional[WasteFilter] = None) -> dict:
+        pass
+
+    async def rebuild_daily_rollup(self) -> int:
+        pass
+
 
 @asynccontextmanager
 async def get_waste_repo() -> AsyncIterator[AbstractWasteRepository]:
@@ -1,3 +1,13 @@
+def create_team_member_data(number: int) -> dict:
+    return {
+        "username": f"member{number}",
+        "email": f"member{number}@example.com",
+        "password": "password",
+        "role": "Employee",
+        "team_id": 1,
+    }
+
+
 async def test_get_all_teams(patch_get_db_pool_team_service, no_auth_client):
 
     # Send a POST request to the /teams endpoint
@@ -26,3 +36,58 @@ async def test_create_team(patch_get_db_pool_team_service, no_auth_client):
 
     # Assert that the response body contains the expected message
     assert response.json() == {"id": 2, "name": "New Team"}
+
+
+async def test_get_team_waste_summary(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    user_data = create_team_member_data(1)
+    response = await no_auth_client.post("/users", json=user_data)
+    assert response.status_code == 201
+    member_id = response.json()["id"]
+    entries = [
+        {"type": "Food", "weight": 1.5, "user_id": 1, "timestamp": "2024-01-01T08:00:00"},
+        {"type": "Plastic", "weight": 2.0, "user_id": 1, "timestamp": "2024-01-02T08:00:00"},
+        {"type": "Food", "weight": 3.0, "user_id": member_id, "timestamp": "2024-01-03T08:00:00"},
+        {"type": "Food", "weight": 9.0, "user_id": member_id, "timestamp": "2024-02-01T08:00:00"},
+    ]
+    response = await no_auth_client.post("/waste/batch", json={"entries": entries})
+    assert response.status_code == 201
+
+    response = await no_auth_client.get(
+        "/teams/1/waste/summary", params={"from": "2024-01-01T00:00:00", "to": "2024-02-01T00:00:00"}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "team_id": 1,
+        "from": "2024-01-01T00:00:00",
+        "to": "2024-02-01T00:00:00",
+        "total_weight": 6.5,
+        "entry_count": 3,
+        "members": [
+            {"user_id": 1, "username": "admin", "total_weight": 3.5, "entry_count": 2},
+            {"user_id": member_id, "username": user_data["username"], "total_weight": 3.0, "entry_count": 1},
+        ],
+        "types": [
+            {"type": "Food", "total_weight": 4.5, "entry_count": 2},
+            {"type": "Plastic", "total_weight": 2.0, "entry_count": 1},
+        ],
+    }
+
+    # a new member shows up in the cached summary with empty totals
+    response = await no_auth_client.post("/users", json=create_team_member_data(2))
+    new_member_id = response.json()["id"]
+    response = await no_auth_client.get(
+        "/teams/1/waste/summary", params={"from": "2024-01-01T00:00:00", "to": "2024-02-01T00:00:00"}
+    )
+    assert response.json()["members"][-1] == {
+        "user_id": new_member_id,
+        "username": "member2",
+        "total_weight": 0.0,
+        "entry_count": 0,
+    }
+    assert len(response.json()["types"]) == 2
+
+    response = await no_auth_client.get("/teams/999/waste/summary")
+    assert response.status_code == 400
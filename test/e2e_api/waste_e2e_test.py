@@ -1,5 +1,11 @@
+import asyncio
+import io
+import json
 from unittest.mock import ANY
 
+import pyarrow as pa
+import pyarrow.parquet as pq
+
 from test.e2e_api.users_e2e_test import create_test_user_data
 
 sample_waste_data = {"type": "trash", "weight": 3.4, "user_id": 1}
@@ -28,6 +34,89 @@ async def test_create_waste(
     }
 
 
+async def test_create_waste_idempotent(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    headers = {"Idempotency-Key": "create-waste-e2e"}
+    responses = await asyncio.gather(
+        *(no_auth_client.post("/waste", json=sample_waste_data, headers=headers) for _ in range(3))
+    )
+
+    assert [response.status_code for response in responses] == [201, 201, 201]
+    assert {response.json()["id"] for response in responses} == {1}
+
+    response = await no_auth_client.post("/waste", json={**sample_waste_data, "weight": 1.0}, headers=headers)
+    assert response.status_code == 409
+
+
+async def test_create_waste_batch(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    entries = [
+        sample_waste_data,
+        {"type": "glass", "weight": 1.2, "user_id": 1, "timestamp": "2025-01-01T10:00:00"},
+        {"type": "glass", "weight": 1.2, "user_id": 1, "timestamp": "2025-01-01T12:00:00+02:00"},
+    ]
+    response = await no_auth_client.post("/waste/batch", json={"entries": entries})
+
+    assert response.status_code == 201
+    assert response.json() == {"ids": [1, 2, 3]}
+
+    response = await no_auth_client.post("/waste/batch", json={"entries": [{"type": "glass", "user_id": 1}]})
+    assert response.status_code == 400
+
+
+async def test_stream_waste(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    async def body():
+        yield b'{"type": "trash", "weight": 3.4, "user_id": 1}\n{"type": "glass", '
+        yield b'"weight": 1.0, "user_id": 1}\nnot json\n{"type": "trash", "weight": 2.0, "user_id": 999}\n'
+
+    response = await no_auth_client.post(
+        "/waste/stream", content=body(), headers={"Content-Type": "application/x-ndjson"}
+    )
+
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert results == [
+        {"line": 1, "status": "accepted", "id": 1},
+        {"line": 2, "status": "accepted", "id": 2},
+        {"line": 3, "status": "rejected", "error": ANY},
+        {"line": 4, "status": "rejected", "error": "User 999 does not exist"},
+    ]
+
+    response = await no_auth_client.post("/waste/stream", json=sample_waste_data)
+    assert response.status_code == 415
+
+
+async def test_import_waste_csv(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    csv_data = (
+        b"type,weight,timestamp,user_id\n"
+        b"trash,3.4,2024-01-01T10:00:00,1\n"
+        b"glass,oops,2024-01-02T10:00:00,1\n"
+        b"paper,1.5,2024-01-03T10:00:00,999\n"
+        b"paper,2.5,,1\n"
+    )
+
+    response = await no_auth_client.post("/waste/import", content=csv_data, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    response = await no_auth_client.get(f"/waste/import/{job_id}")
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "completed"
+    assert job["rows_processed"] == 4
+    assert job["rows_imported"] == 2
+    assert [error["line"] for error in job["errors"]] == [3, 4]
+
+    response = await no_auth_client.get("/waste/import/unknown")
+    assert response.status_code == 404
+
+
 async def test_get_waste_by_user_id(
     patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
 ):
@@ -47,3 +136,176 @@ async def test_get_waste_by_user_id(
 
     # Assert that the response body contains the expected message
     assert response.json() == [{"id": 1, "timestamp": ANY, "type": "trash", "user_id": 1, "weight": 3.4}]
+
+
+async def test_get_waste_by_user_id_paginated(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    entries = [{**sample_waste_data, "timestamp": f"2024-01-0{day}T10:00:00"} for day in range(1, 4)]
+    response = await no_auth_client.post("/waste/batch", json={"entries": entries})
+    assert response.status_code == 201
+
+    response = await no_auth_client.get("/waste/user/1", params={"limit": 2})
+    assert response.status_code == 200
+    assert [entry["id"] for entry in response.json()] == [3, 2]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = await no_auth_client.get("/waste/user/1", params={"limit": 2, "cursor": cursor})
+    assert [entry["id"] for entry in response.json()] == [1]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = await no_auth_client.get("/waste/user/1", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+async def test_export_waste_by_user_id(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    entries = [{**sample_waste_data, "timestamp": f"2024-01-0{day}T10:00:00"} for day in range(1, 4)]
+    response = await no_auth_client.post("/waste/batch", json={"entries": entries})
+    assert response.status_code == 201
+
+    response = await no_auth_client.get("/waste/user/1/export")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [1, 2, 3]
+
+    response = await no_auth_client.get("/waste/user/1/export", params={"format": "json"})
+    assert [entry["timestamp"] for entry in response.json()] == [entry["timestamp"] for entry in entries]
+
+    response = await no_auth_client.get("/waste/user/1/export", params={"format": "xml"})
+    assert response.status_code == 400
+
+
+async def test_get_waste_by_user_id_filtered(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    entries = [
+        {**sample_waste_data, "type": "Food" if day % 2 else "Plastic", "timestamp": f"2024-01-0{day}T10:00:00"}
+        for day in range(1, 6)
+    ]
+    response = await no_auth_client.post("/waste/batch", json={"entries": entries})
+    assert response.status_code == 201
+
+    params = {"from": "2024-01-02T00:00:00", "to": "2024-01-05T00:00:00"}
+    response = await no_auth_client.get("/waste/user/1", params=params)
+    assert response.status_code == 200
+    assert [entry["id"] for entry in response.json()] == [4, 3, 2]
+
+    response = await no_auth_client.get("/waste/user/1", params={**params, "type": "Food"})
+    assert [entry["id"] for entry in response.json()] == [3]
+
+    response = await no_auth_client.get("/waste/user/1/export", params={"type": "Plastic"})
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [2, 4]
+
+    response = await no_auth_client.get("/waste/user/1", params={"from": "2024-01-05", "to": "2024-01-02"})
+    assert response.status_code == 400
+
+    response = await no_auth_client.get("/waste/user/1", params={"from": "yesterday"})
+    assert response.status_code == 400
+
+
+async def test_aggregate_waste(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    entries = [
+        {**sample_waste_data, "type": "Food", "weight": 1.5, "timestamp": "2024-01-01T08:00:00"},
+        {**sample_waste_data, "type": "Food", "weight": 2.5, "timestamp": "2024-01-01T18:00:00"},
+        {**sample_waste_data, "type": "Food", "weight": 4.0, "timestamp": "2024-01-02T08:00:00"},
+        {**sample_waste_data, "type": "Plastic", "weight": 1.0, "timestamp": "2024-01-02T09:00:00"},
+    ]
+    response = await no_auth_client.post("/waste/batch", json={"entries": entries})
+    assert response.status_code == 201
+
+    response = await no_auth_client.get("/waste/user/1/aggregate", params={"bucket": "day"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "bucket": "day",
+        "series": [
+            {
+                "type": "Food",
+                "buckets": ["2024-01-01T00:00:00", "2024-01-02T00:00:00"],
+                "total_weight": [4.0, 4.0],
+                "entry_count": [2, 1],
+            },
+            {"type": "Plastic", "buckets": ["2024-01-02T00:00:00"], "total_weight": [1.0], "entry_count": [1]},
+        ],
+    }
+
+    # a new entry invalidates both the user's and the team's cached aggregates
+    response = await no_auth_client.post(
+        "/waste/batch", json={"entries": [{**sample_waste_data, "type": "Plastic", "timestamp": "2024-01-03T09:00:00"}]}
+    )
+    assert response.status_code == 201
+
+    response = await no_auth_client.get("/waste/user/1/aggregate", params={"bucket": "day"})
+    assert response.json()["series"][1]["buckets"] == ["2024-01-02T00:00:00", "2024-01-03T00:00:00"]
+
+    response = await no_auth_client.get("/waste/user/1/aggregate", params={"bucket": "month", "type": "Plastic"})
+    assert response.json()["series"] == [
+        {"type": "Plastic", "buckets": ["2024-01-01T00:00:00"], "total_weight": [4.4], "entry_count": [2]}
+    ]
+
+    response = await no_auth_client.get("/waste/team/1/aggregate", params={"bucket": "month"})
+    assert response.status_code == 200
+    assert [(series["type"], series["entry_count"]) for series in response.json()["series"]] == [
+        ("Food", [3]),
+        ("Plastic", [2]),
+    ]
+
+    response = await no_auth_client.get("/waste/user/1/aggregate", params={"bucket": "year"})
+    assert response.status_code == 400
+
+    response = await no_auth_client.get("/waste/team/999/aggregate")
+    assert response.status_code == 400
+
+
+async def test_export_waste_columnar(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    entries = [{**sample_waste_data, "timestamp": f"2024-01-0{day}T10:00:00"} for day in range(1, 4)]
+    response = await no_auth_client.post("/waste/batch", json={"entries": entries})
+    assert response.status_code == 201
+
+    response = await no_auth_client.get("/waste/export", params={"team_id": 1, "from": "2024-01-02"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/vnd.apache.parquet"
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.column("id").to_pylist() == [2, 3]
+    assert table.column("type").to_pylist() == ["trash", "trash"]
+
+    response = await no_auth_client.get("/waste/export", params={"format": "arrow"})
+    assert pa.ipc.open_stream(response.content).read_all().num_rows == 3
+
+    response = await no_auth_client.get("/waste/export", params={"format": "orc"})
+    assert response.status_code == 400
+
+
+async def test_waste_anomalies(
+    patch_get_db_pool_waste_service, patch_get_db_pool_user_service, patch_get_db_pool_team_service, no_auth_client
+):
+    entries = [
+        {**sample_waste_data, "weight": 2.0 + day % 2 * 0.2, "timestamp": f"2024-01-{day:02d}T08:00:00"}
+        for day in range(1, 21)
+    ]
+    entries.append({**sample_waste_data, "weight": 30.0, "timestamp": "2024-01-21T08:00:00"})
+    response = await no_auth_client.post("/waste/batch", json={"entries": entries})
+    assert response.status_code == 201
+
+    params = {"from": "2024-01-01", "to": "2024-02-01", "window": 14}
+    response = await no_auth_client.get("/waste/user/1/anomalies", params=params)
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["from"], report["to"], report["window"]) == ("2024-01-01", "2024-02-01", 14)
+    assert [(outlier["user_id"], outlier["day"]) for outlier in report["outliers"]] == [(1, "2024-01-21")]
+    assert report["users"][0]["user_id"] == 1
+
+    response = await no_auth_client.get("/waste/team/1/anomalies", params=params)
+    assert response.status_code == 200
+    assert response.json()["team_id"] == 1
+    assert len(response.json()["outliers"]) == 1
+
+    response = await no_auth_client.get("/waste/team/1/anomalies", params={**params, "window": 0})
+    assert response.status_code == 400
+    response = await no_auth_client.get("/waste/team/999/anomalies", params=params)
+    assert response.status_code == 400
@@ -0,0 +1,142 @@
+import asyncio
+import uuid
+from unittest.mock import patch
+
+import pytest
+from redis.exceptions import ResponseError
+
+from app.utils import cache, idempotency
+from app.utils.idempotency import IdempotencyError, run_once
+
+
+async def test_run_once_runs_concurrent_duplicates_once():
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 201, {"id": len(calls)}
+
+    key = uuid.uuid4().hex
+    results = await asyncio.gather(*(run_once("test", 1, key, "fp", handler) for _ in range(5)))
+
+    assert calls == [1]
+    assert results == [(201, {"id": 1})] * 5
+    assert await run_once("test", 1, key, "fp", handler) == (201, {"id": 1})
+
+
+async def test_run_once_rejects_key_reuse_with_different_request():
+    async def handler():
+        return 201, {}
+
+    key = uuid.uuid4().hex
+    await run_once("test", 1, key, "fp", handler)
+
+    with pytest.raises(IdempotencyError):
+        await run_once("test", 1, key, "other", handler)
+
+
+async def test_run_once_stores_responses_without_a_ttl():
+    async def handler():
+        return 201, {}
+
+    key = uuid.uuid4().hex
+    await run_once("test", 1, key, "fp", handler)
+
+    async with cache.get_cache() as redis_cache:
+        # a response with a TTL could be evicted, and a retry would then write again
+        assert await redis_cache.ttl(cache.durable_key(f"idempotency:test:1:{key}")) == -1
+
+
+async def test_run_once_releases_key_when_handler_fails():
+    async def failing_handler():
+        raise ValueError("boom")
+
+    async def handler():
+        return 201, {"ok": True}
+
+    key = uuid.uuid4().hex
+    with pytest.raises(ValueError):
+        await run_once("test", 1, key, "fp", failing_handler)
+
+    assert await run_once("test", 1, key, "fp", handler) == (201, {"ok": True})
+    assert idempotency._in_flight == {}
+
+
+async def test_run_once_keeps_claim_when_handler_fails_after_writing():
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        # e.g. the row is committed, then updating the cache fails
+        raise ResponseError("OOM command not allowed")
+
+    key = uuid.uuid4().hex
+    with pytest.raises(ResponseError):
+        await run_once("test", 1, key, "fp", handler)
+
+    with patch.object(idempotency, "WAIT_TIMEOUT", 0.1):
+        with pytest.raises(IdempotencyError):
+            await run_once("test", 1, key, "fp", handler)
+    assert calls == [1]
+
+
+async def test_run_once_scopes_keys_by_user():
+    async def handler():
+        return 201, {"calls": 1}
+
+    key = uuid.uuid4().hex
+    await run_once("test", 1, key, "fp", handler)
+
+    # another user's request with the same key and body is not a retry of the first one
+    async def other_handler():
+        return 201, {"calls": 2}
+
+    assert await run_once("test", 2, key, "fp", other_handler) == (201, {"calls": 2})
+
+
+async def test_run_once_keeps_claim_of_cancelled_request():
+    started = asyncio.Event()
+
+    async def slow_handler():
+        started.set()
+        await asyncio.sleep(10)
+        return 201, {}
+
+    key = uuid.uuid4().hex
+    task = asyncio.ensure_future(run_once("test", 1, key, "fp", slow_handler))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # the write may have committed before the cancellation, so a retry must not run it again
+    with patch.object(idempotency, "WAIT_TIMEOUT", 0.1):
+        with pytest.raises(IdempotencyError):
+            await run_once("test", 1, key, "fp", slow_handler)
+
+
+async def test_run_once_keeps_claim_past_its_expiry_while_running():
+    calls = []
+
+    async def slow_handler():
+        calls.append(1)
+        await asyncio.sleep(1.5)
+        return 201, {"id": 1}
+
+    key = uuid.uuid4().hex
+    cache_key = cache.durable_key(f"idempotency:test:1:{key}")
+    with patch.object(idempotency, "PENDING_TTL", 1):
+        task = asyncio.ensure_future(run_once("test", 1, key, "fp", slow_handler))
+        await asyncio.sleep(1.2)
+        # the claim's first expiry has passed, and it holds no Redis TTL to be evicted by
+        await cache.purge_expired()
+        async with cache.get_cache() as redis_cache:
+            claimed = await redis_cache.exists(cache_key)
+            claim_ttl = await redis_cache.ttl(cache_key)
+        result = await task
+
+    assert (claimed, claim_ttl) == (1, -1)
+    assert result == (201, {"id": 1})
+    assert await run_once("test", 1, key, "fp", slow_handler) == (201, {"id": 1})
+    assert calls == [1]
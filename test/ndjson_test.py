@@ -0,0 +1,22 @@
+from app.utils.ndjson import iter_lines
+
+
+async def chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+async def collect(lines):
+    return [line async for line in lines]
+
+
+async def test_iter_lines_across_chunks():
+    lines = iter_lines(chunks(b'{"a": 1}\n{"b"', b": 2}\n", b'{"c": 3}'), max_line_length=100)
+
+    assert await collect(lines) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+async def test_iter_lines_reports_long_lines_once():
+    lines = iter_lines(chunks(b"ok\n", b"x" * 8, b"x" * 8, b"x\nok again\n"), max_line_length=10)
+
+    assert await collect(lines) == [b"ok", None, b"ok again"]
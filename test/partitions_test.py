@@ -0,0 +1,81 @@
+from datetime import date, datetime
+
+import asyncpg
+
+from app.models.waste import WasteEntry
+from app.repositories.waste_repository import WasteRepository
+from app.utils import partitions
+from app.utils.db import initdb
+
+
+async def test_maintain_partitions_creates_months_ahead(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        result = await partitions.maintain_partitions(conn, today=date(2024, 11, 15))
+        again = await partitions.maintain_partitions(conn, today=date(2024, 11, 15))
+
+        assert result["created"] == [
+            "waste_entries_p202411",
+            "waste_entries_p202412",
+            "waste_entries_p202501",
+            "waste_entries_p202502",
+        ]
+        assert again["created"] == []
+        assert "waste_entries_default" in await partitions.get_partitions(conn)
+
+
+async def test_create_partition_moves_rows_from_default(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        repo = WasteRepository(conn)
+        entry = await repo.create(WasteEntry(type="Food", weight=1.0, timestamp=datetime(2020, 3, 10), user_id=1))
+
+        created = await partitions.create_partitions(conn, date(2020, 3, 1), 1)
+
+        assert created == ["waste_entries_p202003"]
+        assert await conn.fetchval("SELECT count(*) FROM waste_entries_default") == 0
+        assert await conn.fetchval("SELECT id FROM waste_entries_p202003") == entry.id
+        assert (await repo.read(entry.id)).weight == 1.0
+
+
+async def test_time_bounded_query_prunes_partitions(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        await partitions.create_partitions(conn, date(2020, 1, 1), 3)
+
+        rows = await conn.fetch(
+            """
+            EXPLAIN (COSTS OFF)
+            SELECT * FROM waste_entries
+            WHERE user_id = 1 AND timestamp >= '2020-02-01' AND timestamp < '2020-03-01'
+            """
+        )
+        plan = "\n".join(row[0] for row in rows)
+
+        assert "waste_entries_p202002" in plan
+        assert "waste_entries_p202001" not in plan
+        assert "waste_entries_p202003" not in plan
+
+
+async def test_detach_partitions(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        await partitions.create_partitions(conn, date(2020, 1, 1), 3)
+
+        detached = await partitions.detach_partitions(conn, date(2020, 2, 15))
+
+        try:
+            assert detached == ["waste_entries_p202001"]
+            assert "waste_entries_p202001" not in await partitions.get_partitions(conn)
+            assert "waste_entries_p202002" in await partitions.get_partitions(conn)
+        finally:
+            await conn.execute("DROP TABLE waste_entries_p202001")
+
+
+async def test_initdb_drops_the_user_id_index(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        # left behind by an older release, on the parent table and every partition
+        await conn.execute("CREATE INDEX idx_waste_entries_user_id ON waste_entries (user_id)")
+
+    await initdb(db_test_pool)
+
+    async with db_test_pool.acquire() as conn:
+        indexes = await conn.fetch("SELECT indexdef FROM pg_indexes WHERE tablename LIKE 'waste_entries%'")
+    assert not [row for row in indexes if row["indexdef"].endswith("(user_id)")]
+    assert [row for row in indexes if row["indexdef"].endswith('(user_id, "timestamp" DESC, id DESC)')]
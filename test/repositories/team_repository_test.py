@@ -1,8 +1,12 @@
+from unittest.mock import patch
+
 import asyncpg
 import pytest
 
 from app.models.teams import Team
 from app.repositories.team_repository import CacheTeamRepository, TeamRepository
+from app.utils import cache
+from app.utils.circuit_breaker import OPEN
 
 
 async def test_create_team(db_test_pool: asyncpg.Pool):
@@ -41,3 +45,33 @@ async def test_cache_team(db_test_pool: asyncpg.Pool):
 
         # Assert
         assert created_team.id is not None
+
+
+async def test_missing_teams_are_cached(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        repo = CacheTeamRepository(conn)
+
+        # Act
+        missing_team = await repo.read(9999)
+        await conn.execute("INSERT INTO teams (id, name) VALUES (9999, 'Created elsewhere')")
+        cached_missing_team = await repo.read(9999)
+
+        # Assert
+        assert missing_team is None
+        assert cached_missing_team is None
+        assert await cache.get_value("team:9999") == {}
+
+
+async def test_team_reads_skip_an_open_cache_circuit(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        repo = CacheTeamRepository(conn)
+        with patch.object(cache.breaker, "state", OPEN), patch.object(cache, "_stale_keys", set()) as stale_keys:
+            # Act
+            created_team = await repo.create(Team(name="Development Team"))
+            read_team = await repo.read(created_team.id)
+            teams = await repo.read_all()
+
+        # Assert
+        assert read_team.name == "Development Team"
+        assert [team.id for team in teams] == [1, created_team.id]
+        assert stale_keys == {cache.redis_key(f"team:{created_team.id}"), cache.redis_key("all_teams")}
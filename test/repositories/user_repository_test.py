@@ -3,6 +3,7 @@ import pytest
 
 from app.models.users import User, UserRole
 from app.repositories.user_repository import CacheUserRepository, UserRepository
+from app.utils import cache
 
 
 def create_test_user() -> User:
@@ -132,7 +133,51 @@ async def test_get_users_by_team_id_cache(db_test_pool: asyncpg.Pool):
         await repo.delete(created_user1.id)
 
         users = await repo.get_users_by_team_id(user2.team_id)
+        user3 = create_test_user()
+        user3.username = "testuser3"
+        user3.email = "testuser3@example.com"
+        created_user3 = await repo.create(user3)
+        users_after_create = await repo.get_users_by_team_id(user3.team_id)
 
         # Assert
         assert len(users) == 2
         assert any(u.id == created_user2.id for u in users)
+        assert [u.id for u in users_after_create] == [u.id for u in users] + [created_user3.id]
+
+
+async def test_missing_users_are_cached_until_created(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        repo = CacheUserRepository(conn)
+        created_user = await repo.create(create_test_user())
+
+        # Act
+        missing_user = await repo.read(created_user.id + 1)
+        missing_username = await repo.get_user_by_username("testuser2")
+        tombstone = await cache.get_value(f"user:{created_user.id + 1}")
+
+        user2 = create_test_user()
+        user2.username = "testuser2"
+        user2.email = "testuser2@example.com"
+        created_user2 = await repo.create(user2)
+
+        # Assert
+        assert missing_user is None
+        assert missing_username is None
+        assert tombstone == {}
+        assert created_user2.id == created_user.id + 1
+        assert (await repo.read(created_user2.id)).username == "testuser2"
+        assert (await repo.get_user_by_username("testuser2")).id == created_user2.id
+
+
+async def test_late_not_found_does_not_hide_a_created_user(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        repo = CacheUserRepository(conn)
+        created_user = await repo.create(create_test_user())
+
+        # Act
+        # a lookup that read the database before the insert committed caches its "not found" afterwards
+        await cache.set_missing(f"user_by_username:{created_user.username}")
+        found = await repo.get_user_by_username(created_user.username)
+
+        # Assert
+        assert found.id == created_user.id
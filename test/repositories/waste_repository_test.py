@@ -1,9 +1,19 @@
-from datetime import datetime
+from datetime import date, datetime
+from unittest.mock import patch
 
 import asyncpg
+import pytest
 
-from app.models.waste import WasteEntry
+from app.models.waste import WasteEntry, WasteFilter
 from app.repositories.waste_repository import CacheWasteRepository, WasteRepository
+from app.utils import cache
+from app.utils.db import initdb
+
+ENTRIES_WITH_TYPE_NAMES = """
+SELECT waste_entries.*, waste_types.name AS type
+FROM waste_entries
+JOIN waste_types ON waste_types.id = waste_entries.type_id
+"""
 
 
 async def test_create_waste_entry(db_test_pool: asyncpg.Pool):
@@ -24,13 +34,67 @@ async def test_create_waste_entry(db_test_pool: asyncpg.Pool):
         assert created_entry.id is not None
 
         # Verify the entry exists in the database
-        row = await conn.fetchrow("SELECT * FROM waste_entries WHERE id = $1", created_entry.id)
+        row = await conn.fetchrow(f"{ENTRIES_WITH_TYPE_NAMES} WHERE waste_entries.id = $1", created_entry.id)
         assert row is not None
         assert row["type"] == "Plastic"
         assert row["weight"] == 2.5
         assert row["user_id"] == 1
 
 
+async def test_create_many_waste_entries(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        waste_entries = [
+            WasteEntry(type="Plastic", weight=2.5, timestamp=datetime.now(), user_id=1),
+            WasteEntry(type="Glass", weight=1.0, timestamp=datetime.now(), user_id=1),
+        ]
+        await repo.get_waste_by_user_id(1)
+
+        # Act
+        created_entries = await repo.create_many(waste_entries)
+
+        # Assert
+        assert [entry.id for entry in created_entries] == [1, 2]
+        rows = await conn.fetch(f"{ENTRIES_WITH_TYPE_NAMES} ORDER BY waste_entries.id")
+        assert [(row["id"], row["type"]) for row in rows] == [(1, "Plastic"), (2, "Glass")]
+        assert len(await repo.get_waste_by_user_id(1)) == 2
+
+
+async def test_create_many_waste_entries_unknown_user(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = WasteRepository(conn)
+        waste_entries = [
+            WasteEntry(type="Plastic", weight=2.5, timestamp=datetime.now(), user_id=1),
+            WasteEntry(type="Glass", weight=1.0, timestamp=datetime.now(), user_id=9999),
+        ]
+
+        # Act / Assert
+        with pytest.raises(ValueError, match="9999"):
+            await repo.create_many(waste_entries)
+        row = await conn.fetchrow("SELECT count(*) FROM waste_entries")
+        assert row["count"] == 0
+
+
+async def test_insert_many_waste_entries(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        waste_entries = [
+            WasteEntry(type=f"Type {i}", weight=float(i), timestamp=datetime.now(), user_id=1) for i in range(3)
+        ]
+
+        # Act
+        created_entries = await repo.insert_many(waste_entries)
+
+        # Assert
+        for entry in created_entries:
+            row = await conn.fetchrow(f"{ENTRIES_WITH_TYPE_NAMES} WHERE waste_entries.id = $1", entry.id)
+            assert row["type"] == entry.type
+            assert row["weight"] == entry.weight
+
+
 async def test_read_waste_entry(db_test_pool: asyncpg.Pool):
     # Arrange
     async with db_test_pool.acquire() as conn:
@@ -75,7 +139,7 @@ async def test_delete_waste_entry(db_test_pool: asyncpg.Pool):
 
         # Assert
         # Verify the entry no longer exists in the database
-        row = await conn.fetchrow("SELECT * FROM waste_entries WHERE id = $1", created_entry.id)
+        row = await conn.fetchrow(f"{ENTRIES_WITH_TYPE_NAMES} WHERE waste_entries.id = $1", created_entry.id)
         assert row is None
 
 
@@ -102,3 +166,289 @@ async def test_delete_waste_entry_cache(db_test_pool: asyncpg.Pool):
         # Assert
         entries = await repo.get_waste_by_user_id(waste_entry.user_id)
         assert len(entries) == 0
+
+
+async def test_get_waste_by_user_id_keyset_pages(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        await repo.create_many(
+            [WasteEntry(type="Plastic", weight=i, timestamp=datetime(2024, 1, 1 + i), user_id=1) for i in range(5)]
+        )
+
+        # Act
+        first_page = await repo.get_waste_by_user_id(1, limit=2)
+        last = first_page[-1]
+        second_page = await repo.get_waste_by_user_id(1, limit=2, after=(last.timestamp, last.id))
+        cached_second_page = await repo.get_waste_by_user_id(1, limit=2, after=(last.timestamp, last.id))
+
+        # Assert
+        assert [entry.weight for entry in first_page] == [4, 3]
+        assert [entry.weight for entry in second_page] == [2, 1]
+        assert [entry.id for entry in cached_second_page] == [entry.id for entry in second_page]
+
+
+async def test_get_waste_by_user_id_filtered(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        await repo.create_many(
+            [
+                WasteEntry(type="Plastic" if i % 2 else "Food", weight=i, timestamp=datetime(2024, 1, 1 + i), user_id=1)
+                for i in range(6)
+            ]
+        )
+        unfiltered = await repo.get_waste_by_user_id(1)
+
+        # Act
+        in_range = await repo.get_waste_by_user_id(
+            1, filters=WasteFilter(start=datetime(2024, 1, 2), end=datetime(2024, 1, 5))
+        )
+        food_in_range = await repo.get_waste_by_user_id(
+            1, filters=WasteFilter(start=datetime(2024, 1, 2), end=datetime(2024, 1, 5), type="Food")
+        )
+        first_page = await repo.get_waste_by_user_id(1, limit=1, filters=WasteFilter(type="Plastic"))
+        last = first_page[-1]
+        second_page = await repo.get_waste_by_user_id(
+            1, limit=1, after=(last.timestamp, last.id), filters=WasteFilter(type="Plastic")
+        )
+
+        # Assert
+        assert len(unfiltered) == 6
+        assert [entry.weight for entry in in_range] == [3, 2, 1]
+        assert [entry.weight for entry in food_in_range] == [2]
+        assert [entry.weight for entry in first_page] == [5]
+        assert [entry.weight for entry in second_page] == [3]
+
+
+async def test_cached_history_is_updated_in_place(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        first = await repo.create(WasteEntry(type="Food", weight=1, timestamp=datetime(2024, 1, 1), user_id=1))
+        await repo.get_waste_by_user_id(1)
+        # rows written behind the cache's back only show up if the cached history is reloaded
+        await conn.execute("UPDATE waste_entries SET weight = 100 WHERE id = $1", first.id)
+
+        # Act
+        same_time = await repo.create_many(
+            [WasteEntry(type="Plastic", weight=i, timestamp=datetime(2024, 1, 2), user_id=1) for i in (2, 3)]
+        )
+        history = await repo.get_waste_by_user_id(1)
+        page = await repo.get_waste_by_user_id(1, limit=1, after=(same_time[1].timestamp, same_time[1].id))
+        await repo.delete(same_time[0].id)
+        after_delete = await repo.get_waste_by_user_id(1)
+
+        # Assert
+        assert [(entry.id, entry.weight) for entry in history] == [
+            (same_time[1].id, 3),
+            (same_time[0].id, 2),
+            (first.id, 1),
+        ]
+        assert [entry.id for entry in page] == [same_time[0].id]
+        assert [entry.id for entry in after_delete] == [same_time[1].id, first.id]
+
+
+async def test_empty_history_is_cached(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        await repo.get_waste_by_user_id(1)
+
+        # Act
+        with patch.object(WasteRepository, "get_waste_by_user_id", side_effect=AssertionError("read the database")):
+            cached = await repo.get_waste_by_user_id(1)
+            filtered = await repo.get_waste_by_user_id(1, limit=5, filters=WasteFilter(end=datetime(2024, 1, 3)))
+        created = await repo.create(WasteEntry(type="Food", weight=1, timestamp=datetime(2024, 1, 1), user_id=1))
+        history = await repo.get_waste_by_user_id(1)
+        await repo.delete(created.id)
+        after_delete = await repo.get_waste_by_user_id(1)
+
+        # Assert
+        assert (cached, filtered) == ([], [])
+        assert [entry.id for entry in history] == [created.id]
+        assert after_delete == []
+
+
+async def test_cached_history_keeps_only_the_newest_entries(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        with patch("app.repositories.waste_repository.CACHED_HISTORY_SIZE", 3):
+            await repo.create_many(
+                [WasteEntry(type="Plastic", weight=i, timestamp=datetime(2024, 1, 1 + i), user_id=1) for i in range(5)]
+            )
+            newest = await repo.get_waste_by_user_id(1, limit=2)
+
+            # Act
+            await repo.create(WasteEntry(type="Plastic", weight=5, timestamp=datetime(2024, 1, 6), user_id=1))
+            async with cache.get_cache() as redis_cache:
+                cached_size = await redis_cache.zcard(cache.redis_key("waste_by_user_id:1"))
+            history = await repo.get_waste_by_user_id(1)
+            last = newest[-1]
+            past_window = await repo.get_waste_by_user_id(1, limit=3, after=(last.timestamp, last.id))
+
+        # Assert
+        assert [entry.weight for entry in newest] == [4, 3]
+        # the window plus the marker that the history goes on in the database
+        assert cached_size == 4
+        assert [entry.weight for entry in history] == [5, 4, 3, 2, 1, 0]
+        assert [entry.weight for entry in past_window] == [2, 1, 0]
+
+
+async def test_cached_history_reads_below_the_window_from_the_database(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        with patch("app.repositories.waste_repository.CACHED_HISTORY_SIZE", 3):
+            await repo.create_many(
+                [WasteEntry(type="Plastic", weight=i, timestamp=datetime(2024, 1, 1 + i), user_id=1) for i in range(6)]
+            )
+            history = await repo.get_waste_by_user_id(1)
+
+            # Act
+            below = history[4]
+            past_cursor = await repo.get_waste_by_user_id(1, limit=2, after=(below.timestamp, below.id))
+            old_window = await repo.get_waste_by_user_id(1, filters=WasteFilter(end=datetime(2024, 1, 3)))
+
+        # Assert
+        assert [entry.weight for entry in history] == [5, 4, 3, 2, 1, 0]
+        assert [entry.weight for entry in past_cursor] == [0]
+        assert [entry.weight for entry in old_window] == [1, 0]
+
+
+async def test_writes_invalidate_the_team_aggregates(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = CacheWasteRepository(conn)
+        entry = WasteEntry(type="Food", weight=1.0, timestamp=datetime(2024, 1, 1, 8), user_id=1)
+
+        async def team_total():
+            (total,) = await repo.aggregate_waste_by_team_id(1, "month")
+            return total.total_weight
+
+        # Act
+        created = await repo.create(entry)
+        after_create = await team_total()
+        await repo.create_many([WasteEntry(type="Food", weight=2.0, timestamp=datetime(2024, 1, 1, 9), user_id=1)])
+        after_create_many = await team_total()
+        inserted = await repo.insert_many(
+            [WasteEntry(type="Food", weight=4.0, timestamp=datetime(2024, 1, 1, 10), user_id=1)]
+        )
+        await repo.write_user_waste(inserted)
+        after_insert_many = await team_total()
+        await repo.delete(created.id)
+        after_delete = await team_total()
+
+        # Assert
+        assert (created.team_id, inserted[0].team_id) == (1, 1)
+        assert [after_create, after_create_many, after_insert_many, after_delete] == [1.0, 3.0, 7.0, 6.0]
+
+
+async def test_daily_rollup_follows_writes(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = WasteRepository(conn)
+        created = await repo.create(WasteEntry(type="Food", weight=1.5, timestamp=datetime(2024, 1, 1, 8), user_id=1))
+        await repo.create_many(
+            [
+                WasteEntry(type="Food", weight=2.5, timestamp=datetime(2024, 1, 1, 18), user_id=1),
+                WasteEntry(type="Food", weight=2.0, timestamp=datetime(2024, 1, 1, 19), user_id=1),
+            ]
+        )
+        await repo.insert_many([WasteEntry(type="Food", weight=4.0, timestamp=datetime(2024, 1, 9, 8), user_id=1)])
+
+        # Act
+        await repo.delete(created.id)
+        rollup = await conn.fetch("SELECT day, total_weight, entry_count FROM waste_daily_rollup ORDER BY day")
+        by_month = await repo.aggregate_waste_by_team_id(1, "month")
+        await conn.execute("DELETE FROM waste_daily_rollup")
+        rebuilt_rows = await repo.rebuild_daily_rollup()
+        rebuilt = await conn.fetch("SELECT day, total_weight, entry_count FROM waste_daily_rollup ORDER BY day")
+
+        # Assert
+        assert [tuple(row) for row in rollup] == [(date(2024, 1, 1), 4.5, 2), (date(2024, 1, 9), 4.0, 1)]
+        assert [(total.bucket, total.total_weight, total.entry_count) for total in by_month] == [
+            (datetime(2024, 1, 1), 8.5, 3)
+        ]
+        assert rebuilt_rows == 2
+        assert [tuple(row) for row in rebuilt] == [tuple(row) for row in rollup]
+
+
+async def test_team_totals_follow_current_members(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = WasteRepository(conn)
+        await conn.execute("INSERT INTO teams (name) VALUES ('Other')")
+        mover = await conn.fetchval(
+            "INSERT INTO users (username, email, role, password_hash, team_id) "
+            "VALUES ('mover', 'mover@example.com', 'Employee', 'hash', 1) RETURNING id"
+        )
+        leaver = await conn.fetchval(
+            "INSERT INTO users (username, email, role, password_hash, team_id) "
+            "VALUES ('leaver', 'leaver@example.com', 'Employee', 'hash', 1) RETURNING id"
+        )
+        await repo.create_many(
+            [
+                WasteEntry(type="Food", weight=1.0, timestamp=datetime(2024, 1, 1, 8), user_id=1),
+                WasteEntry(type="Food", weight=2.0, timestamp=datetime(2024, 1, 1, 9), user_id=mover),
+                WasteEntry(type="Food", weight=4.0, timestamp=datetime(2024, 1, 1, 10), user_id=leaver),
+            ]
+        )
+
+        # Act
+        await conn.execute("UPDATE users SET team_id = 2 WHERE id = $1", mover)
+        await conn.execute("DELETE FROM users WHERE id = $1", leaver)
+        from_rollup = [await repo.aggregate_waste_by_team_id(team_id, "day") for team_id in (1, 2)]
+        from_entries = [await repo.aggregate_waste_by_team_id(team_id, "hour") for team_id in (1, 2)]
+        daily = await repo.get_daily_totals(date(2024, 1, 1), date(2024, 1, 2), team_id=2)
+
+        # Assert
+        assert [[total.total_weight for total in totals] for totals in from_rollup] == [[1.0], [2.0]]
+        assert [[total.total_weight for total in totals] for totals in from_entries] == [[1.0], [2.0]]
+        assert daily == {"user_id": [mover], "day_offset": [0], "total_weight": [2.0]}
+
+
+async def test_initdb_fills_a_new_rollup(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = WasteRepository(conn)
+        await repo.create(WasteEntry(type="Food", weight=1.5, timestamp=datetime(2024, 1, 1, 8), user_id=1))
+        # a database from before the rollup existed
+        await conn.execute("DROP TABLE waste_daily_rollup")
+
+        # Act
+        await initdb(db_test_pool)
+        await initdb(db_test_pool)
+        by_day = await repo.aggregate_waste_by_user_id(1, "day")
+
+        # Assert
+        assert [(total.bucket, total.total_weight, total.entry_count) for total in by_day] == [
+            (datetime(2024, 1, 1), 1.5, 1)
+        ]
+
+
+async def test_waste_types_are_created_once(db_test_pool: asyncpg.Pool):
+    # Arrange
+    async with db_test_pool.acquire() as conn:
+        repo = WasteRepository(conn)
+
+        # Act
+        await repo.create(WasteEntry(type="Food", weight=1.0, timestamp=datetime(2024, 1, 1), user_id=1))
+        await repo.create(WasteEntry(type="Food", weight=2.0, timestamp=datetime(2024, 1, 2), user_id=1))
+        await repo.insert_many([WasteEntry(type=t, weight=1.0, timestamp=datetime.now(), user_id=1) for t in "ABA"])
+        await repo.create_many([WasteEntry(type=t, weight=1.0, timestamp=datetime.now(), user_id=1) for t in "BCC"])
+        # another replica added a type this process has not seen
+        await conn.execute("INSERT INTO waste_types (name) VALUES ('Glass')")
+        glass_id = await conn.fetchval("SELECT id FROM waste_types WHERE name = 'Glass'")
+        await conn.execute(
+            "INSERT INTO waste_entries (type_id, weight, timestamp, user_id) VALUES ($1, 1, now(), 1)", glass_id
+        )
+
+        # Assert
+        types = await conn.fetch("SELECT name FROM waste_types ORDER BY name")
+        assert [row["name"] for row in types] == ["A", "B", "C", "Food", "Glass"]
+        entries = await repo.get_waste_by_user_id(1)
+        assert sorted(entry.type for entry in entries) == ["A", "A", "B", "B", "C", "C", "Food", "Food", "Glass"]
+        assert len(await repo.get_waste_by_user_id(1, filters=WasteFilter(type="Glass"))) == 1
+        assert await repo.get_waste_by_user_id(1, filters=WasteFilter(type="Metal")) == []
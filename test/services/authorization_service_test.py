@@ -51,3 +51,10 @@ async def test_admin_permission_granted():
     user = User(id=1, role=UserRole.ADMIN, team_id=1, username="test", email="<EMAIL>")
     request_data = {"user_id": 1}
     await verify_authorization(user, Permission.CREATE_USER, request_data)
+
+
+async def test_manager_team_waste_permission_denied():
+    user = User(id=1, role=UserRole.MANAGER, team_id=1, username="test", email="<EMAIL>")
+    await verify_authorization(user, Permission.GET_WASTE_BY_TEAM_ID, {"team_id": 1})
+    with pytest.raises(AuthorizationError):
+        await verify_authorization(user, Permission.GET_WASTE_BY_TEAM_ID, {"team_id": 2})
@@ -0,0 +1,64 @@
+from unittest.mock import patch
+
+import asyncpg
+
+from app.repositories.user_repository import READ_USER
+from app.services import warmup_service
+from app.utils import cache, db
+
+
+async def test_prepare_pool(db_test_pool: asyncpg.Pool):
+    # Arrange: db_test_pool has created the tables
+    pool = await asyncpg.create_pool(db.DATABASE_URL, min_size=1, max_size=2, init=db._init_connection)
+
+    try:
+        # Act
+        connections = await db.prepare_pool(pool)
+
+        # Assert
+        assert connections == pool.get_min_size()
+        # the second connection is opened past the minimum, the way the pool grows under load
+        async with pool.acquire() as first, pool.acquire() as second:
+            prepared = [
+                [row["statement"] for row in await conn.fetch("SELECT statement FROM pg_prepared_statements")]
+                for conn in (first, second)
+            ]
+            # a hot query is served from the statement cache instead of being prepared again
+            await first.fetch(READ_USER, 1)
+            prepared_after_fetch = await first.fetch("SELECT statement FROM pg_prepared_statements")
+        assert all(set(db.hot_queries) <= set(statements) for statements in prepared)
+        assert len(prepared_after_fetch) == len(prepared[0])
+    finally:
+        await pool.close()
+
+
+async def test_warm_up(db_test_pool, patch_get_db_pool_team_service, patch_get_db_pool_user_service, no_auth_client):
+    warmup_service.set_ready(False)
+    response = await no_auth_client.get("/healthz/ready")
+    assert response.status_code == 503
+
+    # Act
+    with patch("app.utils.db.get_db_pool", return_value=db_test_pool):
+        await warmup_service.warm_up()
+
+    # Assert
+    assert (await no_auth_client.get("/healthz/ready")).status_code == 200
+    assert (await no_auth_client.get("/healthz/live")).status_code == 200
+    assert await cache.get_fields("all_teams") == {"1": {"id": 1, "name": "Admin"}}
+    assert await cache.get_value("team:1") == {"id": 1, "name": "Admin"}
+    assert (await cache.get_value("user_by_username:admin"))["id"] == 1
+    assert "1" in await cache.get_fields("users_by_team_id:1")
+    warmup_service.set_ready(False)
+
+
+async def test_warm_up_reports_ready_when_priming_fails(db_test_pool):
+    warmup_service.set_ready(False)
+
+    # Act
+    with patch("app.utils.db.get_db_pool", return_value=db_test_pool):
+        with patch.object(warmup_service, "prime_caches", side_effect=KeyError("id")):
+            await warmup_service.warm_up()
+
+    # Assert
+    assert warmup_service.is_ready()
+    warmup_service.set_ready(False)
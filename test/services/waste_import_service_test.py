@@ -0,0 +1,55 @@
+import os
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.services import waste_import_service
+from app.services.waste_import_service import create_import_job, get_import_job, run_import_job
+from app.utils import cache
+
+
+async def test_failed_upload_removes_spooled_file(tmp_path):
+    async def body():
+        yield b"type,weight,user_id\n"
+        raise ConnectionError("client went away")
+
+    with patch.object(waste_import_service, "IMPORT_DIR", str(tmp_path)):
+        with pytest.raises(ConnectionError):
+            await create_import_job(body())
+
+    assert os.listdir(tmp_path) == []
+
+
+async def test_run_import_job_imports_in_chunks(tmp_path):
+    async def body():
+        yield b"type,weight,user_id\ntrash,1,1\ntrash,oops,1\nplastic,2,1\n"
+
+    create_entries = AsyncMock(return_value={})
+    with patch.object(waste_import_service, "IMPORT_DIR", str(tmp_path)):
+        with patch.object(waste_import_service, "IMPORT_CHUNK_SIZE", 2):
+            with patch("app.services.waste_service.create_numbered_waste_entries", create_entries):
+                job = await create_import_job(body())
+                await run_import_job(job["id"])
+
+    job = await get_import_job(job["id"])
+    assert job["status"] == "completed"
+    assert (job["rows_processed"], job["rows_imported"], job["rows_rejected"]) == (3, 2, 1)
+    assert job["errors"][0]["line"] == 3
+    assert [[entry.type for _, entry in call.args[0]] for call in create_entries.await_args_list] == [
+        ["trash"],
+        ["plastic"],
+    ]
+    assert os.listdir(tmp_path) == []
+
+
+async def test_run_import_job_removes_spooled_file_when_redis_is_down(tmp_path):
+    async def body():
+        yield b"type,weight,user_id\ntrash,1,1\n"
+
+    with patch.object(waste_import_service, "IMPORT_DIR", str(tmp_path)):
+        job = await create_import_job(body())
+        with patch.object(waste_import_service.cache, "available", return_value=False):
+            with pytest.raises(cache.CacheUnavailableError):
+                await run_import_job(job["id"])
+
+    assert os.listdir(tmp_path) == []
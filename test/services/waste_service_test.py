@@ -1,6 +1,24 @@
+import asyncio
+import io
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
 from app.services.team_service import create_team
 from app.services.user_service import create_user
-from app.services.waste_service import create_waste
+from app.services.waste_service import (
+    cache_waste_entries,
+    create_waste,
+    ingest_waste_stream,
+    insert_waste_entries,
+    parse_timestamp,
+    parse_waste_entry,
+)
+from app.utils.coalescer import WriteCoalescer
+from app.utils.db import DatabaseError
 
 sample_waste_data = {"type": "trash", "weight": 3.4, "user_id": 1}
 
@@ -20,3 +38,113 @@ async def test_create_waste_success(get_waste_repo_mock, get_team_repo_mock, get
     assert created_waste.id is not None
     assert created_waste.type == sample_waste_data["type"]
     assert created_waste.weight == sample_waste_data["weight"]
+
+
+async def test_create_waste_coalesced(get_waste_repo_mock, get_team_repo_mock, get_user_repo_mock):
+    team = await create_team(name="teamname")
+    user = await create_user(
+        username="username2", role="Employee", email="<EMAIL>", team_id=team.id, password="password"
+    )
+    coalescer = WriteCoalescer(insert_waste_entries, window=0.01, max_batch_size=10, after_flush=cache_waste_entries)
+
+    with patch("app.services.waste_service.write_coalescer", coalescer):
+        created = await asyncio.gather(*(create_waste(type="trash", weight=i, user_id=user.id) for i in range(3)))
+
+    assert [entry.weight for entry in created] == [0, 1, 2]
+    assert all(entry.id is not None for entry in created)
+    assert coalescer.stats()["batch_sizes"] == {3: 1}
+
+
+async def test_coalesced_write_is_not_repeated_when_cache_update_fails(get_team_repo_mock, get_user_repo_mock):
+    team = await create_team(name="teamname")
+    user = await create_user(
+        username="username3", role="Employee", email="<EMAIL>", team_id=team.id, password="password"
+    )
+    coalescer = WriteCoalescer(insert_waste_entries, window=0.01, max_batch_size=10, after_flush=cache_waste_entries)
+
+    repo = AsyncMock()
+    repo.insert_many.side_effect = lambda entries: entries
+    repo.write_user_waste.side_effect = ConnectionError("cache down")
+
+    @asynccontextmanager
+    async def get_flaky_cache_waste_repo():
+        yield repo
+
+    with patch("app.services.waste_service.write_coalescer", coalescer):
+        with patch("app.services.waste_service.get_waste_repo", get_flaky_cache_waste_repo):
+            created = await asyncio.gather(*(create_waste(type="trash", weight=i, user_id=user.id) for i in range(2)))
+
+    assert [entry.weight for entry in created] == [0, 1]
+    assert repo.insert_many.await_count == 1
+    assert repo.write_user_waste.await_count == 1
+
+
+async def test_ingest_waste_stream_rejects_failed_batch():
+    repo = AsyncMock()
+    repo.create_many.side_effect = DatabaseError("Unexpected error occurred")
+
+    @asynccontextmanager
+    async def get_failing_waste_repo():
+        yield repo
+
+    async def body():
+        yield b'{"type": "trash", "weight": 1, "user_id": 1}\n{"type": "trash"}\n'
+
+    results = io.StringIO()
+    with patch("app.services.waste_service.get_waste_repo", get_failing_waste_repo):
+        summary = await ingest_waste_stream(body(), results)
+
+    assert summary == {"accepted": 0, "rejected": 2}
+    assert [json.loads(line)["status"] for line in results.getvalue().splitlines()] == ["rejected", "rejected"]
+
+
+def test_parse_waste_entry_accepts_json_and_csv_values():
+    from_json = parse_waste_entry({"type": "trash", "weight": 2, "user_id": 1.0})
+    from_csv = parse_waste_entry({"type": "trash", "weight": "2.5", "user_id": "1", "timestamp": ""})
+
+    assert (from_json.type, from_json.weight, from_json.user_id) == ("trash", 2.0, 1)
+    assert (from_csv.type, from_csv.weight, from_csv.user_id) == ("trash", 2.5, 1)
+
+
+def test_parse_timestamp_uses_naive_utc():
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    assert abs(parse_timestamp("") - now) < timedelta(seconds=5)
+    assert parse_timestamp("2024-03-01T12:00:00+02:00") == datetime(2024, 3, 1, 10, 0)
+
+
+async def test_created_entries_are_stamped_when_written(get_waste_repo_mock, get_team_repo_mock, get_user_repo_mock):
+    team = await create_team(name="teamname")
+    await create_user(username="username1", role="Employee", email="<EMAIL>", team_id=team.id, password="password")
+
+    first = await create_waste(**sample_waste_data)
+    await asyncio.sleep(0.01)
+    second = await create_waste(**sample_waste_data)
+
+    assert first.timestamp < second.timestamp
+    assert abs(second.timestamp - datetime.now(timezone.utc).replace(tzinfo=None)) < timedelta(seconds=5)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"type": None, "weight": 1, "user_id": 1},
+        {"type": 5, "weight": 1, "user_id": 1},
+        {"type": {"name": "trash"}, "weight": 1, "user_id": 1},
+        {"type": "", "weight": 1, "user_id": 1},
+        # a short CSV row
+        {"type": "trash", "weight": None, "user_id": None},
+        {"type": "trash", "weight": 1, "user_id": 1.9},
+        {"type": "trash", "weight": 1, "user_id": "1.9"},
+        {"type": "trash", "weight": 1, "user_id": True},
+        {"type": "trash", "weight": 1, "user_id": False},
+        {"type": "trash", "weight": "nan", "user_id": 1},
+        {"type": "trash", "weight": "inf", "user_id": 1},
+        {"type": "trash", "weight": float("-inf"), "user_id": 1},
+        {"type": "trash", "weight": True, "user_id": 1},
+        {"type": "trash", "weight": [1], "user_id": 1},
+    ],
+)
+def test_parse_waste_entry_rejects_invalid_values(data):
+    with pytest.raises(ValueError):
+        parse_waste_entry(data)
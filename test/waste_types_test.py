@@ -0,0 +1,72 @@
+import asyncpg
+import pytest
+
+from app.repositories.waste_repository import WasteRepository
+from app.utils import waste_types
+from app.utils.db import initdb
+from app.utils.waste_types import TooManyWasteTypesError, registry
+
+
+async def test_initdb_migrates_type_names(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        await conn.execute("DROP TABLE waste_entries, waste_daily_rollup, waste_types")
+        # the schema from before waste_types existed
+        await conn.execute(
+            """
+            CREATE TABLE waste_entries
+            (
+                id        serial primary key,
+                type      varchar(100)     not null,
+                weight    double precision not null,
+                timestamp timestamp        not null,
+                user_id   integer          not null
+            );
+            CREATE TABLE waste_daily_rollup
+            (
+                user_id      integer          not null,
+                team_id      integer          not null,
+                type         varchar(100)     not null,
+                day          date             not null,
+                total_weight double precision not null,
+                entry_count  integer          not null,
+                primary key (user_id, type, day)
+            );
+            INSERT INTO waste_entries (type, weight, timestamp, user_id)
+            VALUES ('Food', 1, '2024-01-01', 1), ('Glass', 2, '2024-01-01', 1), ('Food', 3, '2024-01-02', 1);
+            INSERT INTO waste_daily_rollup VALUES (1, 1, 'Food', '2024-01-01', 1, 1), (1, 1, 'Paper', '2024-01-01', 4, 1);
+            """
+        )
+
+        await initdb(db_test_pool)
+        await initdb(db_test_pool)
+
+        columns = await conn.fetch(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = 'waste_entries' ORDER BY 1"
+        )
+        assert [row["column_name"] for row in columns] == ["id", "timestamp", "type_id", "user_id", "weight"]
+        types = await conn.fetch("SELECT name FROM waste_types ORDER BY name")
+        assert [row["name"] for row in types] == ["Food", "Glass", "Paper"]
+        entries = await WasteRepository(conn).get_waste_by_user_id(1)
+        assert sorted((entry.type, entry.weight) for entry in entries) == [("Food", 1), ("Food", 3), ("Glass", 2)]
+        rollup = await conn.fetch(
+            "SELECT name FROM waste_daily_rollup JOIN waste_types ON waste_types.id = type_id ORDER BY name"
+        )
+        assert [row["name"] for row in rollup] == ["Food", "Paper"]
+
+
+async def test_resolve_id_does_not_create_types(db_test_pool: asyncpg.Pool):
+    async with db_test_pool.acquire() as conn:
+        assert await registry.resolve_id(conn, "Unknown") is None
+        assert await conn.fetchval("SELECT count(*) FROM waste_types WHERE name = 'Unknown'") == 0
+
+        # created by another replica
+        glass_id = await conn.fetchval("INSERT INTO waste_types (name) VALUES ('Glass') RETURNING id")
+        assert await registry.resolve_id(conn, "Glass") == glass_id
+
+
+def test_check_new_types_caps_created_types(monkeypatch):
+    monkeypatch.setattr(waste_types, "MAX_WASTE_TYPES", len(registry._ids) + 1)
+
+    registry.check_new_types(["Brand new"])
+    with pytest.raises(TooManyWasteTypesError):
+        registry.check_new_types(["Brand new", "Another"])